@@ -1,8 +1,10 @@
+-- Same numbers (and more) from GET /study/stats or `flask study-stats`.
 SELECT
   p.condition,
-  AVG(ABS(json_extract(r.answer, '$.value') - json_extract(t.payload, '$.gt_severity_score'))) AS avg_abs_err,
+  AVG(ABS(r.answer_value - t.gt_severity_score)) AS avg_abs_err,
   COUNT(*) AS n
 FROM response r
 JOIN participant p ON p.id = r.participant_id
 JOIN trial t ON t.id = r.trial_id
+WHERE r.answer_value IS NOT NULL
 GROUP BY p.condition;
@@ -1,17 +1,39 @@
+"""
+Application factory.
+
+wsgi.py builds the serving app with create_app(cli=False): routes, assets,
+metrics and slow-query capture only. minisurvey.py (FLASK_APP) adds the CLI
+blueprint and Flask-Migrate, whose imports (alembic, click commands) the web
+workers never need. Nothing here touches the database, so gunicorn can
+import the app once in the master (preload_app) and fork workers that share
+those pages copy-on-write; gunicorn_conf.py drops the inherited pool in
+post_fork.
+"""
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
 from config import Config
+from app.pool import engine_options
+
+db = SQLAlchemy()
 
-app = Flask(__name__)
-app.config.from_object(Config)
 
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
+def create_app(config_class=Config, cli=True):
+    app = Flask(__name__)
+    app.config.from_object(config_class)
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config))
+    db.init_app(app)
 
-# these imports MUST be after db is created so Alembic can autogenerate
-from app import models, routes  # <- keep both
+    from app import models  # noqa: F401  (tables on db.metadata)
+    from app.routes import bp as study_bp
+    from app.assets import bp as assets_bp  # fingerprinted static files (/assets/...)
+    from app.metrics import bp as metrics_bp  # request/SQL timing, /metrics
+    from app.slowlog import bp as slowlog_bp  # slow-query capture + EXPLAIN
+    for bp in (study_bp, assets_bp, metrics_bp, slowlog_bp):
+        app.register_blueprint(bp)
 
-# Register custom CLI commands (import after models are defined)
-from app.cli import import_ai_confidence
-app.cli.add_command(import_ai_confidence)
+    if cli:
+        from flask_migrate import Migrate
+        from app.cli import bp as cli_bp
+        Migrate(app, db)
+        app.register_blueprint(cli_bp)
+    return app
@@ -0,0 +1,23 @@
+"""
+STUDY_ADMIN_TOKEN check shared by the operational endpoints (/metrics,
+/study/pool, /study/admin/slow-queries).
+
+When the token is set, a request must carry it as `?token=` or as
+`Authorization: Bearer <token>` (what Prometheus sends with
+`authorization: {credentials: ...}` in a scrape config). Unset, the
+endpoints stay open, as in local development.
+"""
+import hmac
+
+from flask import abort, current_app, request
+
+
+def require_admin():
+    """abort(403) unless the request carries STUDY_ADMIN_TOKEN (no-op when it is unset)."""
+    token = current_app.config.get('STUDY_ADMIN_TOKEN')
+    if not token:
+        return
+    auth = request.headers.get('Authorization', '')
+    given = auth[7:] if auth.startswith('Bearer ') else request.args.get('token', '')
+    if not hmac.compare_digest(given.encode(), token.encode()):
+        abort(403)
@@ -0,0 +1,316 @@
+"""
+Atomic trial-slot allocation for /study/start and /study/extend.
+
+Reading coverage counts and inserting Assignment rows has to happen as one
+step, otherwise parallel starts all see the same least-covered trials.
+
+- Postgres: the least-covered trial_coverage rows are locked with
+  `FOR UPDATE SKIP LOCKED`, so concurrent transactions take disjoint trials
+  instead of queueing behind each other. If too few are free, the attempt
+  is rolled back and retried with a blocking `FOR UPDATE` taken in
+  trial_id order, so waiting transactions never hold rows another waits on.
+- SQLite: a single writer thread per process drains queued requests and
+  serves them together inside one `BEGIN IMMEDIATE` transaction. A caller
+  that gives up waiting marks its ticket abandoned; the writer drops
+  abandoned tickets, re-running the batch without them if one was
+  abandoned mid-transaction, so a timed-out start never leaves a
+  participant behind.
+  The writer keeps trial_coverage mirrored in memory and reloads it only
+  when the 'coverage' cache_version moved (app/coverage.py).
+
+Either way, `reserve()` accepts requests for many participants (new ones are
+created in the same transaction) and fills them in one round trip. A new
+participant whose (worker_id, assignment_id) already exists, or repeats an
+earlier request in the batch, is neither created nor given trials; its
+result is (None, None) and the caller resumes the existing participant.
+
+When `flask plan-design` has stored a plan, a new participant first claims
+the next open design_slot for its condition (app/design.py) and gets that
+block verbatim; coverage is still bumped, and the greedy pick above only
+serves extensions and starts the plan has no slot for.
+"""
+import queue
+import threading
+from collections import Counter, namedtuple
+from contextlib import ExitStack
+
+from flask import current_app
+from sqlalchemy import bindparam, insert, text
+
+from app import db, design
+from app.trial_cache import bump_version
+from app.coverage import COVERAGE_KEY, CoverageIndex, coverage_index, coverage_version, ensure_counters
+from app.models import Assignment, Participant
+
+# `participant` is an existing participant id, or a dict of column values
+# for a Participant the allocator should create alongside its assignments.
+SlotRequest = namedtuple('SlotRequest', 'participant n exclude start_idx')
+SlotRequest.__new__.__defaults__ = ((), 0)
+
+# a participant's assigned trials, for an extension's exclude/start_idx;
+# served by ix_assignment_participant_order
+ASSIGNED_SQL = text("SELECT trial_id, order_idx FROM assignment WHERE participant_id = :pid")
+
+# least-covered trials; served by ix_trial_coverage_n_assigned
+LEAST_COVERED_SQL = """
+    SELECT trial_id, n_assigned FROM trial_coverage
+    ORDER BY n_assigned
+    LIMIT :k
+"""
+
+# ... that nobody else holds (first attempt)
+FREE_COVERAGE_SQL = text(LEAST_COVERED_SQL + " FOR UPDATE SKIP LOCKED")
+
+# the least-covered trials, waiting for locks in trial_id order (retry)
+WAIT_COVERAGE_SQL = text("""
+    SELECT trial_id, n_assigned FROM trial_coverage
+    WHERE trial_id IN (SELECT trial_id FROM trial_coverage ORDER BY n_assigned LIMIT :k)
+    ORDER BY trial_id
+    FOR UPDATE
+""")
+
+BUMP_COVERAGE_SQL = text(
+    "UPDATE trial_coverage SET n_assigned = n_assigned + :delta WHERE trial_id IN :tids"
+).bindparams(bindparam('tids', expanding=True))
+
+
+def _duplicates(conn, requests):
+    """Indexes of new-participant requests whose (worker_id, assignment_id) is taken."""
+    keyed = {}
+    for i, req in enumerate(requests):
+        if isinstance(req.participant, dict):
+            key = (req.participant.get('worker_id'), req.participant.get('assignment_id'))
+            if None not in key:
+                keyed.setdefault(key, []).append(i)
+    if not keyed:
+        return set()
+    existing = conn.execute(text(
+        "SELECT worker_id, assignment_id FROM participant WHERE worker_id IN :w AND assignment_id IN :a"
+    ).bindparams(bindparam('w', expanding=True), bindparam('a', expanding=True)),
+        {'w': sorted({k[0] for k in keyed}), 'a': sorted({k[1] for k in keyed})}).fetchall()
+    existing = {tuple(r) for r in existing}
+    dup = set()
+    for key, idx in keyed.items():
+        dup.update(idx if key in existing else idx[1:])
+    return dup
+
+
+def duplicate_start(exc):
+    """Whether IntegrityError `exc` is a concurrent start for the same
+    (worker_id, assignment_id), i.e. ux_participant_worker_assignment."""
+    diag = getattr(exc.orig, 'diag', None)  # psycopg2 / psycopg
+    if getattr(diag, 'constraint_name', None):
+        return diag.constraint_name == 'ux_participant_worker_assignment'
+    # SQLite names the columns instead
+    return 'participant.worker_id, participant.assignment_id' in str(exc.orig)
+
+
+def _distribute(index, requests, skip=(), claims=None):
+    """Pick trials for each request from `index`, bumping it as we go.
+
+    Requests with a claimed design slot take its block instead.
+    """
+    claims = claims or {}
+    out = []
+    for i, req in enumerate(requests):
+        if i in skip:
+            out.append(None)
+            continue
+        if i in claims:
+            chosen = claims[i][1]
+        else:
+            chosen = index.pick(req.n, req.exclude)
+        index.bump(chosen)
+        out.append(chosen)
+    return out
+
+
+def _write(conn, requests, chosen):
+    """Create new participants, insert Assignment rows and bump trial_coverage.
+
+    Returns [(participant_id, [trial_id, ...]), ...] aligned with `requests`;
+    a new participant that got no trials is not created (id None), and a
+    skipped duplicate (chosen None) comes back as (None, None).
+    """
+    pids = [req.participant if isinstance(req.participant, int) else None
+            for req in requests]
+    new = [i for i, req in enumerate(requests) if pids[i] is None and chosen[i]]
+    if new:
+        created = conn.execute(
+            insert(Participant.__table__).returning(
+                Participant.__table__.c.id, sort_by_parameter_order=True),
+            [dict(requests[i].participant) for i in new],
+        ).scalars().all()
+        for i, pid in zip(new, created):
+            pids[i] = pid
+
+    rows = []
+    for req, pid, tids in zip(requests, pids, chosen):
+        for i, tid in enumerate(tids or ()):
+            rows.append({'participant_id': pid, 'trial_id': tid,
+                         'order_idx': req.start_idx + i})
+    result = list(zip(pids, chosen))
+    if not rows:
+        return result
+    conn.execute(insert(Assignment.__table__), rows)
+
+    # one UPDATE per distinct increment (almost always just +1)
+    per_trial = Counter(r['trial_id'] for r in rows)
+    by_delta = {}
+    for tid, delta in per_trial.items():
+        by_delta.setdefault(delta, []).append(tid)
+    for delta, tids in by_delta.items():
+        conn.execute(BUMP_COVERAGE_SQL, {'delta': delta, 'tids': tids})
+    return result
+
+
+def _ticket(requests):
+    """A queued batch for the SQLite writer; 'result' or 'error' is set before 'done'."""
+    return {'requests': requests, 'done': threading.Event(),
+            'lock': threading.Lock(), 'abandoned': False}
+
+
+class TrialAllocator:
+    """Hands out trial slots; one instance per process."""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+
+    def reserve(self, requests):
+        """Allocate and commit trials for each SlotRequest.
+
+        Returns [(participant_id, [trial_id, ...]), ...] aligned with
+        `requests`, trial ids in assignment order.
+        """
+        requests = list(requests)
+        if not requests:
+            return []
+        if db.engine.dialect.name == 'postgresql':
+            return self._reserve_locked(requests)
+        return self._reserve_queued(requests)
+
+    # ---------- Postgres: row locks with SKIP LOCKED ----------
+    def _reserve_locked(self, requests):
+        ensure_counters()
+        result = self._try_locked(requests, wait=False)
+        if result is None:
+            # everything cheap is locked by other starts: start over and
+            # wait for the rows, in trial_id order like every other waiter
+            db.session.rollback()
+            result = self._try_locked(requests, wait=True)
+        db.session.commit()
+        return result
+
+    def _try_locked(self, requests, wait):
+        """One attempt in the current transaction; None if SKIP LOCKED left it short."""
+        conn = db.session.connection()
+        dup = _duplicates(conn, requests)
+        claims = design.claim(conn, requests, dup, lock=True)
+        greedy = [r for i, r in enumerate(requests) if i not in dup and i not in claims]
+        need = sum(r.n + len(r.exclude) for r in greedy)
+        rows = []
+        if need:
+            rows = conn.execute(WAIT_COVERAGE_SQL if wait else FREE_COVERAGE_SQL, {'k': need}).fetchall()
+
+        index = CoverageIndex()
+        index.load((r[0], r[1]) for r in rows)
+        chosen = _distribute(index, requests, dup, claims)
+
+        short = sum(r.n for r in greedy) - sum(
+            len(c) for i, c in enumerate(chosen) if c is not None and i not in claims)
+        if short > 0 and not wait:
+            return None
+        result = _write(conn, requests, chosen)
+        design.mark_claimed(conn, claims, result)
+        return result
+
+    # ---------- SQLite: single writer thread ----------
+    def _reserve_queued(self, requests):
+        self._ensure_writer()
+        ticket = _ticket(requests)
+        self._queue.put(ticket)
+        timeout = current_app.config.get('STUDY_ALLOCATOR_TIMEOUT_S', 30)
+        if not ticket['done'].wait(timeout):
+            # the writer holds the lock while it commits, so this either
+            # abandons the ticket before it is written or sees it finish
+            with ticket['lock']:
+                if not ticket['done'].is_set():
+                    ticket['abandoned'] = True
+                    raise TimeoutError('trial allocator did not respond')
+        if 'error' in ticket:
+            raise ticket['error']
+        return ticket['result']
+
+    def _ensure_writer(self):
+        with self._writer_lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(
+                    target=self._run_writer,
+                    args=(current_app._get_current_object(),),
+                    name='trial-allocator', daemon=True)
+                self._writer.start()
+
+    def _run_writer(self, app):
+        batch_max = app.config.get('STUDY_ALLOCATOR_BATCH_MAX', 64)
+        with app.app_context():
+            conn = db.engine.connect()
+            known = None
+            while True:
+                tickets = [self._queue.get()]
+                while len(tickets) < batch_max:
+                    try:
+                        tickets.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                while tickets:
+                    tickets = [t for t in tickets if not t['abandoned']]
+                    if tickets:
+                        known = self._serve(conn, tickets, known)
+                        tickets = [t for t in tickets if not t['done'].is_set()]
+
+    def _serve(self, conn, tickets, known):
+        """Write one batch; leaves tickets abandoned meanwhile undone for a re-run.
+
+        `known` is the coverage version the index was last in step with;
+        returns the version to pass next time.
+        """
+        try:
+            conn.exec_driver_sql('BEGIN IMMEDIATE')
+            # only coverage writers move this version (not submits), so the
+            # O(trials) reload runs only when the index may be stale
+            if coverage_version(conn) != known or not len(coverage_index):
+                ensure_counters(conn, force=True)
+                rows = conn.execute(text(
+                    "SELECT trial_id, n_assigned FROM trial_coverage"
+                )).fetchall()
+                coverage_index.load((r[0], r[1]) for r in rows)
+            requests = [req for t in tickets for req in t['requests']]
+            dup = _duplicates(conn, requests)
+            claims = design.claim(conn, requests, dup)
+            result = _write(conn, requests, _distribute(coverage_index, requests, dup, claims))
+            design.mark_claimed(conn, claims, result)
+            bump_version(conn, COVERAGE_KEY)  # other processes' indexes are stale now
+            version = coverage_version(conn)
+            with ExitStack() as held:
+                for t in tickets:
+                    held.enter_context(t['lock'])
+                if any(t['abandoned'] for t in tickets):
+                    conn.rollback()
+                    coverage_index.load(())  # undo this batch's bumps
+                    return known
+                conn.commit()
+                for t in tickets:
+                    t['result'], result = result[:len(t['requests'])], result[len(t['requests']):]
+                    t['done'].set()
+            return version
+        except Exception as exc:
+            conn.rollback()
+            coverage_index.load(())  # force a reload next batch
+            for t in tickets:
+                t['error'] = exc
+                t['done'].set()
+            return known
+
+allocator = TrialAllocator()
@@ -0,0 +1,224 @@
+"""
+Post-batch analysis of study responses with NumPy.
+
+`load()` reads every response once into flat arrays. `analyze()` then
+reduces them to per-participant sums (np.bincount), so each statistic is a
+ratio of two sums. That means a participant-clustered bootstrap is just a
+matrix product: draw how often each participant is resampled (B x P
+multinomial counts) and compute counts @ numerators / counts @ denominators.
+Resamples are split into chunks and spread over a process pool.
+
+Statistics, per condition:
+  mae, bias                 answer vs. ground-truth severity
+  ai_agreement              answer == AI severity (trials that have one)
+  reveal_rate               share of responses where the AI was revealed
+  *_revealed / *_hidden     mae and ai_agreement split by reveal, and the
+                            revealed - hidden difference as reveal_*_effect
+  reliance curve            ai_agreement by Trial/response ai_confidence bin
+
+    from app.analysis import load, analyze
+    result = analyze(load(), resamples=10000)
+"""
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+StudyData = namedtuple('StudyData', [
+    'participant',   # int index into participant_ids
+    'participant_ids',
+    'condition',     # int index into conditions
+    'conditions',
+    'trial_id', 'answer', 'gt', 'ai', 'revealed', 'ai_confidence', 'rt_ms',
+])
+
+# statistic -> (numerator, denominator) column of the per-participant sums
+RATIOS = {
+    'mae': ('abs_err', 'n'),
+    'bias': ('err', 'n'),
+    'ai_agreement': ('agree', 'n_ai'),
+    'reveal_rate': ('revealed', 'n_resp'),
+    'mae_revealed': ('abs_err_rev', 'n_rev'),
+    'mae_hidden': ('abs_err_hid', 'n_hid'),
+    'ai_agreement_revealed': ('agree_rev', 'n_ai_rev'),
+    'ai_agreement_hidden': ('agree_hid', 'n_ai_hid'),
+}
+EFFECTS = {
+    'reveal_mae_effect': ('mae_revealed', 'mae_hidden'),
+    'reveal_agreement_effect': ('ai_agreement_revealed', 'ai_agreement_hidden'),
+}
+CHUNK = 1000  # resamples per matrix product; bounds memory at CHUNK x P
+
+
+def load(since_id=None):
+    """All scored responses as a StudyData of NumPy arrays (needs an app context)."""
+    from sqlalchemy import select
+    from app import db
+    from app.models import Participant, Response, Trial
+
+    stmt = (select(Response.participant_id, Participant.condition, Response.trial_id,
+                   Response.answer_value, Trial.gt_severity_score, Trial.ai_severity_score,
+                   Response.revealed_ai, Response.ai_confidence, Trial.ai_confidence,
+                   Response.rt_ms)
+            .join(Participant, Participant.id == Response.participant_id)
+            .join(Trial, Trial.id == Response.trial_id)
+            .where(Response.answer_value.is_not(None))
+            .order_by(Response.id))
+    if since_id is not None:
+        stmt = stmt.where(Response.id > since_id)
+    rows = db.session.execute(stmt).all()
+
+    def col(i, dtype=float):
+        return np.array([np.nan if r[i] is None else r[i] for r in rows], dtype=dtype)
+
+    pids, p_idx = np.unique(np.array([r[0] for r in rows], dtype=np.int64), return_inverse=True)
+    conds, c_idx = np.unique(np.array([r[1] or '' for r in rows], dtype=object).astype(str),
+                             return_inverse=True)
+    conf = col(7)
+    trial_conf = col(8)
+    conf = np.where(np.isnan(conf), trial_conf, conf)
+    return StudyData(
+        participant=p_idx, participant_ids=pids,
+        condition=c_idx, conditions=[str(c) for c in conds],
+        trial_id=np.array([r[2] for r in rows], dtype=np.int64),
+        answer=col(3), gt=col(4), ai=col(5),
+        revealed=np.array([bool(r[6]) for r in rows], dtype=bool),
+        ai_confidence=conf, rt_ms=col(9),
+    )
+
+
+def confidence_bins(data, bins):
+    """Bin index (0..bins-1, or -1 when unknown) of each response's AI confidence."""
+    conf = data.ai_confidence
+    idx = np.clip(np.floor(np.nan_to_num(conf, nan=-1.0) * bins).astype(int), -1, bins - 1)
+    return np.where(np.isnan(conf), -1, idx)
+
+
+def participant_sums(data, mask, bins=5):
+    """Per-participant sums over responses in `mask`: {column: array(P)}."""
+    P = len(data.participant_ids)
+    p = data.participant[mask]
+    err = (data.answer - data.gt)[mask]
+    has_gt = ~np.isnan(err)
+    err = np.nan_to_num(err)
+    has_ai = ~np.isnan(data.ai[mask])
+    agree = has_ai & (data.answer[mask] == data.ai[mask])
+    rev = data.revealed[mask]
+
+    def s(weights):
+        return np.bincount(p, weights=weights.astype(float), minlength=P)
+
+    out = {
+        'n_resp': s(np.ones_like(rev)),
+        'n': s(has_gt), 'abs_err': s(np.abs(err)), 'err': s(err),
+        'n_ai': s(has_ai), 'agree': s(agree), 'revealed': s(rev),
+        'n_rev': s(has_gt & rev), 'abs_err_rev': s(np.abs(err) * rev),
+        'n_hid': s(has_gt & ~rev), 'abs_err_hid': s(np.abs(err) * ~rev),
+        'n_ai_rev': s(has_ai & rev), 'agree_rev': s(agree & rev),
+        'n_ai_hid': s(has_ai & ~rev), 'agree_hid': s(agree & ~rev),
+    }
+    b = confidence_bins(data, bins)[mask]
+    for k in range(bins):
+        out[f'n_ai_conf{k}'] = s(has_ai & (b == k))
+        out[f'agree_conf{k}'] = s(agree & (b == k))
+    return out
+
+
+def _ratios(num, den):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(den > 0, num / np.where(den > 0, den, 1), np.nan)
+
+
+def _bootstrap_chunk(num, den, n, seed):
+    """`n` clustered resamples of num/den; num and den are (P, S) arrays."""
+    rng = np.random.default_rng(seed)
+    P = num.shape[0]
+    out = np.empty((n, num.shape[1]))
+    for start in range(0, n, CHUNK):
+        stop = min(n, start + CHUNK)
+        counts = rng.multinomial(P, np.full(P, 1.0 / P), size=stop - start).astype(float)
+        out[start:stop] = _ratios(counts @ num, counts @ den)
+    return out
+
+
+def bootstrap(num, den, resamples, seed=None, pool=None):
+    """(resamples, S) bootstrap draws, in CHUNK-sized parts run on `pool`.
+
+    Each part has its own child seed, so a seeded run draws the same
+    resamples however many workers share the parts.
+    """
+    sizes = [min(CHUNK, resamples - start) for start in range(0, resamples, CHUNK)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    if pool is None or len(sizes) == 1:
+        return np.vstack([_bootstrap_chunk(num, den, n, s) for n, s in zip(sizes, seeds)])
+    return np.vstack(list(pool.map(_bootstrap_chunk, [num] * len(sizes), [den] * len(sizes),
+                                   sizes, seeds)))
+
+
+def _summary(estimate, draws, alpha):
+    lo, hi = (np.nanpercentile(draws, [100 * alpha / 2, 100 * (1 - alpha / 2)])
+              if np.isfinite(draws).any() else (np.nan, np.nan))
+    return {'estimate': _clean(estimate), 'ci_low': _clean(lo), 'ci_high': _clean(hi)}
+
+
+def _clean(v):
+    return None if v is None or not np.isfinite(v) else float(v)
+
+
+def analyze(data, resamples=10000, bins=5, alpha=0.05, seed=None, workers=None):
+    """Point estimates and clustered-bootstrap CIs per condition.
+
+    Conditions are resampled independently, so differences between their
+    draws give CIs for condition contrasts (reported against 'control').
+    `workers` defaults to the CPU count; 1 keeps everything in-process.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and resamples:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return _analyze(data, resamples, bins, alpha, seed, pool)
+    return _analyze(data, resamples, bins, alpha, seed, None)
+
+
+def _analyze(data, resamples, bins, alpha, seed, pool):
+    ratio_names = list(RATIOS) + [f'reliance_conf{k}' for k in range(bins)]
+    ratio_cols = list(RATIOS.values()) + [(f'agree_conf{k}', f'n_ai_conf{k}') for k in range(bins)]
+    result = {'n_responses': int(len(data.answer)), 'resamples': resamples,
+              'confidence_bins': [[k / bins, (k + 1) / bins] for k in range(bins)],
+              'conditions': {}}
+    draws_by_cond, est_by_cond = {}, {}
+    for ci, cond in enumerate(data.conditions):
+        mask = data.condition == ci
+        sums = participant_sums(data, mask, bins)
+        present = sums['n_resp'] > 0  # participants in this condition, with or without GT
+        num = np.column_stack([sums[a][present] for a, _ in ratio_cols])
+        den = np.column_stack([sums[b][present] for _, b in ratio_cols])
+        est = _ratios(num.sum(axis=0), den.sum(axis=0))
+        draws = (bootstrap(num, den, resamples, seed=None if seed is None else seed + ci, pool=pool)
+                 if resamples and present.any() else np.full((1, len(ratio_names)), np.nan))
+        est = dict(zip(ratio_names, est))
+        draws = dict(zip(ratio_names, draws.T))
+        for name, (a, b) in EFFECTS.items():
+            est[name] = est[a] - est[b]
+            draws[name] = draws[a] - draws[b]
+        est_by_cond[cond], draws_by_cond[cond] = est, draws
+
+        rt = data.rt_ms[mask]
+        rt = rt[~np.isnan(rt)]
+        result['conditions'][cond] = {
+            'n_responses': int(mask.sum()),
+            'n_participants': int(present.sum()),
+            'rt_ms': dict(zip(('p50', 'p90', 'p95'),
+                              map(_clean, np.percentile(rt, [50, 90, 95]) if len(rt) else [None] * 3))),
+            'stats': {name: _summary(est[name], draws[name], alpha)
+                      for name in ratio_names + list(EFFECTS)},
+        }
+
+    if 'control' in est_by_cond:
+        result['contrasts_vs_control'] = {
+            cond: {name: _summary(est[name] - est_by_cond['control'][name],
+                                  draws_by_cond[cond][name] - draws_by_cond['control'][name], alpha)
+                   for name in ('mae', 'bias', 'ai_agreement', 'reveal_rate')}
+            for cond, est in est_by_cond.items() if cond != 'control'
+        }
+    return result
@@ -0,0 +1,158 @@
+"""
+Fingerprinted, precompressed static assets for the study pages.
+
+`flask assets-build` copies each file in ASSETS into app/static/dist/ under a
+content-hashed name, writes .gz (and .br when the brotli package is
+installed) next to it, re-encodes the hero banner as WebP at a few widths
+(when Pillow is installed), and records the mapping in dist/manifest.json.
+
+Templates call asset_url('styles/study.css'): with a manifest it points at
+/assets/<hashed name>, served with a one-year immutable Cache-Control and
+the best precompressed variant the client accepts; without one (a fresh
+checkout) it falls back to the plain /static file.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+
+from flask import Blueprint, current_app, request, send_from_directory, url_for
+
+bp = Blueprint('assets', __name__)
+
+ASSETS = ('styles/study.css', 'styles/study_finish.css', 'img/dilemma.jpg')
+HERO = 'img/dilemma.jpg'
+# the banner fills .wrap's content box in study.css: 1160px, or the viewport
+# less 2 * 28px padding and the border on narrower screens
+HERO_SIZES = '(min-width: 1218px) 1160px, calc(100vw - 58px)'
+# WebP widths built for the srcset; the source (702px) caps them, so phones
+# get a smaller file and nothing is upscaled
+HERO_WIDTHS = (480, 702)
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json')
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))  # preferred first
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def dist_dir():
+    return os.path.join(current_app.static_folder, 'dist')
+
+
+def _fingerprinted(name, data):
+    root, ext = os.path.splitext(name)
+    return f'{root}.{hashlib.sha256(data).hexdigest()[:10]}{ext}'
+
+
+def _write(out_dir, name, data):
+    path = os.path.join(out_dir, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def _hero_name(width):
+    return f'{os.path.splitext(HERO)[0]}-{width}w.webp'
+
+
+def _webp_variants(data):
+    """{logical name: WebP bytes} per HERO_WIDTHS width, capped at the source's; {} without Pillow."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return {}
+    from io import BytesIO
+    src = Image.open(BytesIO(data)).convert('RGB')
+    out = {}
+    for width in sorted({min(w, src.width) for w in HERO_WIDTHS}):
+        img = src if width == src.width else src.resize(
+            (width, round(src.height * width / src.width)), Image.LANCZOS)
+        buf = BytesIO()
+        img.save(buf, 'WEBP', quality=80, method=6)
+        out[_hero_name(width)] = buf.getvalue()
+    return out
+
+
+def build(out_dir=None):
+    """Rebuild dist/; returns {logical name: fingerprinted name}."""
+    out_dir = out_dir or dist_dir()
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.makedirs(out_dir)
+
+    sources = {}
+    for name in ASSETS:
+        with open(os.path.join(current_app.static_folder, name), 'rb') as f:
+            sources[name] = f.read()
+    if HERO in sources:
+        sources.update(_webp_variants(sources[HERO]))
+
+    manifest = {}
+    for name, data in sources.items():
+        hashed = _fingerprinted(name, data)
+        _write(out_dir, hashed, data)
+        if name.endswith(COMPRESSIBLE):
+            _write(out_dir, hashed + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+            if brotli is not None:
+                _write(out_dir, hashed + '.br', brotli.compress(data, quality=11))
+        manifest[name] = hashed
+    with open(os.path.join(out_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    _manifest.clear()
+    return manifest
+
+
+_manifest = {}
+
+
+def manifest():
+    if not _manifest:
+        try:
+            with open(os.path.join(dist_dir(), 'manifest.json'), encoding='utf-8') as f:
+                _manifest.update(json.load(f))
+        except FileNotFoundError:
+            pass
+    return _manifest
+
+
+@bp.app_template_global()
+def hero_srcset():
+    """srcset of the built WebP banners, narrowest first ('' before assets-build)."""
+    prefix, suffix = os.path.splitext(HERO)[0] + '-', 'w.webp'
+    widths = sorted(int(name[len(prefix):-len(suffix)]) for name in manifest()
+                    if name.startswith(prefix) and name.endswith(suffix))
+    return ', '.join(f'{asset_url(_hero_name(w))} {w}w' for w in widths)
+
+
+@bp.app_template_global()
+def hero_sizes():
+    return HERO_SIZES
+
+
+@bp.app_template_global()
+def asset_url(name):
+    hashed = manifest().get(name)
+    if hashed is None:
+        return url_for('static', filename=name)
+    return url_for('assets.built_asset', filename=hashed)
+
+
+@bp.route('/assets/<path:filename>')
+def built_asset(filename):
+    """A fingerprinted file from dist/, precompressed when the client allows."""
+    directory = dist_dir()
+    mimetype = mimetypes.guess_type(filename)[0]
+    for encoding, suffix in ENCODINGS:
+        if (encoding in request.accept_encodings
+                and os.path.isfile(os.path.join(directory, filename + suffix))):
+            resp = send_from_directory(directory, filename + suffix, mimetype=mimetype)
+            resp.headers['Content-Encoding'] = encoding
+            break
+    else:
+        resp = send_from_directory(directory, filename, mimetype=mimetype)
+    resp.vary.add('Accept-Encoding')
+    resp.headers['Cache-Control'] = IMMUTABLE
+    return resp
@@ -1,10 +1,14 @@
 import csv
 from pathlib import Path
 import click
-from flask import current_app
-from app import db
+from flask import Blueprint, current_app
+from sqlalchemy import select, text
+from app import db, seeding
 from app.models import Trial
 
+# registered by create_app(cli=True); commands sit at the top level (`flask seed-trials`)
+bp = Blueprint('cli', __name__, cli_group=None)
+
 def _resolve(path_str: str) -> Path:
     p = Path(path_str)
     if p.is_absolute():
@@ -12,32 +16,312 @@ def _resolve(path_str: str) -> Path:
     # repo-relative: app root -> parent -> resources/...
     return Path(current_app.root_path).parent / p
 
-@click.command("import-ai-confidence")
-@click.argument("csv_path")
-def import_ai_confidence(csv_path):
-    """
-    Import ai_confidence for trials.
-    CSV columns: trial_id, ai_confidence (0..1) or ai_confidence_pct (70..100).
-    """
-    p = _resolve(csv_path)
+def _read_confidences(path):
+    """{trial_id: confidence clamped to 0..1} from the CSV, in one pass."""
+    out = {}
     rows = 0
-    updated = 0
-    with p.open(newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
+    with path.open(newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
             rows += 1
-            tid = int(row["trial_id"])
             conf = None
-            if "ai_confidence" in row and row["ai_confidence"]:
+            if row.get("ai_confidence"):
                 conf = float(row["ai_confidence"])
-            elif "ai_confidence_pct" in row and row["ai_confidence_pct"]:
+            elif row.get("ai_confidence_pct"):
                 conf = float(row["ai_confidence_pct"]) / 100.0
             if conf is None:
                 continue
-            trial = Trial.query.get(tid)
-            if not trial:
-                continue
-            trial.ai_confidence = max(0.0, min(1.0, conf))
-            updated += 1
+            out[int(row["trial_id"])] = max(0.0, min(1.0, conf))
+    return rows, out
+
+
+def _preview(ids, limit=20):
+    ids = sorted(ids)
+    more = f" ... (+{len(ids) - limit} more)" if len(ids) > limit else ""
+    return ", ".join(map(str, ids[:limit])) + more
+
+
+@bp.cli.command("seed-trials")
+@click.argument("json_path")
+@click.option("--chunk-size", default=seeding.CHUNK_ROWS, show_default=True)
+def seed_trials(json_path, chunk_size):
+    """Load trials from a JSON file.
+    Expect a list of objects (or JSON Lines); each will be stored in Trial.payload.
+    Re-running upserts on the dilemma's content hash instead of duplicating trials.
+    """
+    inserted, updated = seeding.seed(seeding.json_rows(json_path), chunk_size)
+    print(f"Inserted {inserted} and updated {updated} trials from {json_path}")
+
+
+@bp.cli.command("seed-trials-csv")
+@click.argument("csv_path")
+@click.option("--chunk-size", default=seeding.CHUNK_ROWS, show_default=True)
+def seed_trials_csv(csv_path, chunk_size):
+    """CSV columns: dilemma_text, gt_severity_score, gt_justification, ai_severity_score, ai_justification
+    Safe to re-run: existing dilemmas are updated in place, new ones appended.
+    """
+    inserted, updated = seeding.seed(seeding.csv_rows(csv_path, chunk_size), chunk_size)
+    print(f"Inserted {inserted} and updated {updated} trials from {csv_path}")
+
+
+@bp.cli.command("import-ai-confidence")
+@click.argument("csv_path")
+@click.option("--dry-run", is_flag=True, help="Show what would change without writing.")
+def import_ai_confidence(csv_path, dry_run):
+    """
+    Import ai_confidence for trials.
+    CSV columns: trial_id, ai_confidence (0..1) or ai_confidence_pct (70..100).
+    All matching trials are updated with a single executemany UPDATE.
+    """
+    rows, wanted = _read_confidences(_resolve(csv_path))
+    current = {}
+    ids = list(wanted)
+    for i in range(0, len(ids), 1000):
+        current.update(db.session.execute(
+            select(Trial.id, Trial.ai_confidence).where(Trial.id.in_(ids[i:i + 1000]))
+        ).all())
+    unmatched = [tid for tid in wanted if tid not in current]
+    changes = [{"tid": tid, "conf": conf} for tid, conf in wanted.items()
+               if tid in current and current[tid] != conf]
+
+    if dry_run:
+        for c in changes[:50]:
+            click.echo(f"  trial {c['tid']}: {current[c['tid']]} -> {c['conf']}")
+        if len(changes) > 50:
+            click.echo(f"  ... {len(changes) - 50} more")
+    elif changes:
+        from app.trial_cache import bump_version
+        db.session.execute(text("UPDATE trial SET ai_confidence = :conf WHERE id = :tid"), changes)
+        bump_version()
+        db.session.commit()
+
+    verb = "would update" if dry_run else "updated"
+    click.echo(f"Processed {rows} rows; {verb} {len(changes)} trials "
+               f"({len(current) - len(changes)} unchanged).")
+    if unmatched:
+        click.echo(f"{len(unmatched)} trial ids not found: {_preview(unmatched)}")
+
+
+@bp.cli.command("export-parquet")
+@click.argument("out_dir")
+@click.option("--format", "fmt", type=click.Choice(["parquet", "arrow"]), default="parquet",
+              help="Parquet (compressed) or Arrow IPC (uncompressed, memory-mappable).")
+def export_parquet(out_dir, fmt):
+    """
+    Write responses.<ext> (fact table) and trials.<ext> (dimension table) to OUT_DIR.
+    Join them on trial_id for analysis.
+    """
+    from app.export import write_columnar
+    out = _resolve(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    try:
+        counts = write_columnar(fmt, lambda name: str(out / name))
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Wrote {counts['responses']} responses and {counts['trials']} trials to {out}")
+
+
+@bp.cli.command("study-stats")
+@click.option("--by-trial", is_flag=True, help="Also print per-trial rows.")
+@click.option("--json", "as_json", is_flag=True, help="Print the raw JSON (same as GET /study/stats).")
+def study_stats(by_trial, as_json):
+    """MAE, signed bias, RT percentiles, AI-reveal rate and AI agreement by condition."""
+    from app.stats import compute
+    groups = ("condition", "trial") if by_trial or as_json else ("condition",)
+    stats = compute(groups)
+    if as_json:
+        click.echo(current_app.json.dumps(stats, indent=2))
+        return
+
+    def fmt(v, spec=".3f"):
+        return "-" if v is None else format(v, spec)
+
+    def table(rows, keys):
+        head = keys + ["n", "mae", "bias", "p50_ms", "p90_ms", "p95_ms", "reveal", "ai_agree"]
+        click.echo("\t".join(head))
+        for r in rows:
+            rt = r["rt_ms"]
+            click.echo("\t".join([str(r[k]) for k in keys] + [
+                str(r["n"]), fmt(r["mae"]), fmt(r["bias"]),
+                fmt(rt["p50"], "d"), fmt(rt["p90"], "d"), fmt(rt["p95"], "d"),
+                fmt(r["reveal_rate"]), fmt(r["ai_agreement"]),
+            ]))
+
+    table(stats["by_condition"], ["condition"])
+    if by_trial:
+        click.echo("")
+        table(stats["by_trial"], ["trial_id", "condition"])
+
+
+@bp.cli.command("study-analyze")
+@click.option("--resamples", default=10000, show_default=True, help="Bootstrap resamples per condition.")
+@click.option("--bins", default=5, show_default=True, help="AI-confidence bins for the reliance curve.")
+@click.option("--workers", type=int, default=None, help="Bootstrap processes (default: CPU count).")
+@click.option("--seed", type=int, default=None, help="Seed for reproducible CIs.")
+@click.option("--json", "as_json", is_flag=True, help="Print the full result as JSON.")
+def study_analyze(resamples, bins, workers, seed, as_json):
+    """
+    Per-condition error, AI agreement, reveal effects and reliance vs. AI confidence,
+    with participant-clustered bootstrap 95% CIs.
+    """
+    import time
+    from app.analysis import analyze, load
+    t0 = time.perf_counter()
+    data = load()
+    result = analyze(data, resamples=resamples, bins=bins, seed=seed, workers=workers)
+    elapsed = time.perf_counter() - t0
+    if as_json:
+        click.echo(current_app.json.dumps(result, indent=2))
+        return
+
+    def fmt(v):
+        return "-" if v is None else f"{v:.3f}"
+
+    for cond, res in result["conditions"].items():
+        click.echo(f"== {cond}: {res['n_responses']} responses, {res['n_participants']} participants")
+        for name, s in res["stats"].items():
+            click.echo(f"  {name:<26} {fmt(s['estimate'])}  [{fmt(s['ci_low'])}, {fmt(s['ci_high'])}]")
+    for cond, contrasts in result.get("contrasts_vs_control", {}).items():
+        click.echo(f"== {cond} - control")
+        for name, s in contrasts.items():
+            click.echo(f"  {name:<26} {fmt(s['estimate'])}  [{fmt(s['ci_low'])}, {fmt(s['ci_high'])}]")
+    click.echo(f"({result['n_responses']} responses, {resamples} resamples, {elapsed:.1f}s)")
+
+
+@bp.cli.command("assets-build")
+def assets_build():
+    """
+    Fingerprint study CSS/images into app/static/dist with .gz/.br variants
+    and a WebP hero (brotli and Pillow are optional).
+    """
+    from app.assets import build, dist_dir
+    built = build()
+    for name, hashed in sorted(built.items()):
+        click.echo(f"  {name} -> {hashed}")
+    missing = [pkg for pkg, mod in (("brotli", "brotli"), ("Pillow", "PIL")) if not _importable(mod)]
+    if missing:
+        click.echo(f"(skipped {', '.join(missing)} outputs: pip install {' '.join(missing)})")
+    click.echo(f"Wrote {len(built)} assets to {dist_dir()}")
+
+
+def _importable(module):
+    import importlib.util
+    return importlib.util.find_spec(module) is not None
+
+
+@bp.cli.command("slow-queries")
+@click.option("--limit", default=20, show_default=True, help="Newest captures to show.")
+@click.option("--json", "as_json", is_flag=True, help="Print the raw captures (same as /study/admin/slow-queries).")
+@click.option("--clear", is_flag=True, help="Delete every worker's captures.")
+def slow_queries(limit, as_json, clear):
+    """Slow statements captured by the app (see app/slowlog.py), newest first."""
+    import json
+    from app.slowlog import slowlog
+    if clear:
+        slowlog.clear()
+        click.echo("Cleared slow-query captures")
+        return
+    entries = slowlog.recent(limit)
+    if as_json:
+        click.echo(json.dumps(entries, indent=2))
+        return
+    if not entries:
+        click.echo(f"No slow queries captured in {slowlog.directory()}")
+        return
+    for e in entries:
+        request_ms = f", request {e['request_ms']:.0f} ms" if e.get('request_ms') is not None else ""
+        click.echo(f"{e['at']}  {e.get('method') or ''} {e['route']}  "
+                   f"{e['statement_ms']:.0f} ms{request_ms}  (pid {e['pid']})")
+        click.echo("  " + " ".join(e['statement'].split()))
+        click.echo(f"  params: {e['params']}")
+        for line in e.get('explain') or []:
+            click.echo(f"    {line}")
+        if e.get('explain_error'):
+            click.echo(f"  explain failed: {e['explain_error']}")
+        click.echo("")
+
+
+@bp.cli.command("plan-design")
+@click.option("--participants", type=int, help="Expected participants across all conditions.")
+@click.option("-n", "--per-participant", type=int, default=None,
+              help="Trials per participant (default: STUDY_TRIALS_PER_PARTICIPANT).")
+@click.option("--conditions", default="control,ai", show_default=True, help="Comma-separated conditions.")
+@click.option("--split", default=None, help="Only use trials from this split (default: every trial).")
+@click.option("--seed", type=int, default=None, help="Seed for a reproducible schedule.")
+@click.option("--replace", is_flag=True, help="Delete the unclaimed slots of the current plan first.")
+@click.option("--dry-run", is_flag=True, help="Print the balance summary without writing.")
+@click.option("--status", is_flag=True, help="Show open/claimed slots per condition and exit.")
+def plan_design(participants, per_participant, conditions, split, seed, replace, dry_run, status):
+    """
+    Precompute a balanced schedule (cyclic incomplete blocks, Williams-square
+    orders, each block once per condition) into design_slot. /study/start
+    then claims the next open slot; see app/design.py.
+    """
+    from app import design
+    if status:
+        counts = design.open_counts(db.session)
+        if not counts:
+            click.echo("No design plan stored; /study/start uses the greedy allocator")
+        for condition, (n_open, n_claimed) in counts.items():
+            click.echo(f"  {condition:<10} {n_open} open, {n_claimed} claimed")
+        return
+    if not participants:
+        raise click.UsageError("--participants is required")
+    per_start = current_app.config.get("STUDY_TRIALS_PER_PARTICIPANT", 10)
+    k = per_participant or per_start
+    if k != per_start:
+        click.echo(f"Warning: /study/start asks for {per_start} trials (STUDY_TRIALS_PER_PARTICIPANT); "
+                   f"slots of {k} will not be claimed unless that is changed too", err=True)
+    conds = [c.strip().lower() for c in conditions.split(",") if c.strip()]
+    query = select(Trial.id).order_by(Trial.id)
+    if split:
+        query = query.where(Trial.split == split)
+    trial_ids = db.session.execute(query).scalars().all()
+    try:
+        slots = design.build_schedule(trial_ids, k, conds, participants, seed)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+
+    for condition, b in design.balance(slots).items():
+        click.echo(f"  {condition:<10} {b['slots']} slots over {b['trials']} trials; "
+                   f"per trial {b['per_trial'][0]}-{b['per_trial'][1]}, "
+                   f"per trial+position {b['per_position'][0]}-{b['per_position'][1]}")
+    if dry_run:
+        click.echo(f"(dry run: {len(slots)} slots of {k} trials not written)")
+        return
+    removed = design.clear_open(db.session) if replace else 0
+    written = design.store(db.session, slots, seeding.CHUNK_ROWS)
     db.session.commit()
-    click.echo(f"Processed {rows} rows; updated {updated} trials.")
+    replaced = f", replaced {removed} open slots" if replace else ""
+    click.echo(f"Stored {written} slots of {k} trials from {len(trial_ids)} trials{replaced}")
+
+
+@bp.cli.command("reclaim-assignments")
+@click.option("--idle-minutes", type=float, default=None,
+              help="Idle time before a participant's unanswered trials are released "
+                   "(default: STUDY_RECLAIM_IDLE_S).")
+@click.option("--batch", type=int, default=None, help="Participants per transaction (default: STUDY_RECLAIM_BATCH).")
+@click.option("--every", "every_s", type=float, default=None,
+              help="Keep running, one pass every this many seconds (for a worker/cron-less deploy).")
+@click.option("--dry-run", is_flag=True, help="Count what would be reclaimed without writing.")
+def reclaim_assignments(idle_minutes, batch, every_s, dry_run):
+    """
+    Release unanswered assignments of idle participants back into trial
+    coverage, recording them in reclaimed_assignment; see app/reclaim.py.
+    """
+    from app import reclaim
+    idle_s = idle_minutes * 60 if idle_minutes is not None else current_app.config.get("STUDY_RECLAIM_IDLE_S", 7200)
+    batch = batch or current_app.config.get("STUDY_RECLAIM_BATCH", 500)
+    if every_s:
+        if dry_run:
+            raise click.UsageError("--dry-run and --every don't mix")
+        click.echo(f"Reclaiming after {idle_s / 60:.0f} min idle, every {every_s:.0f}s (Ctrl-C to stop)")
+        reclaim.run_forever(current_app._get_current_object(), idle_s, every_s, batch, log=click.echo)
+        return
+    totals = reclaim.reclaim(db.session, idle_s, batch, dry_run)
+    if totals["journal_rows"]:
+        raise click.ClickException(
+            f"{totals['journal_rows']} buffered rows are not written yet (STUDY_INGEST_DIR); "
+            "reclaiming now could release trials they answer. Try again once the journal is empty.")
+    verb = "Would reclaim" if dry_run else "Reclaimed"
+    click.echo(f"{verb} {totals['assignments']} assignments from {totals['participants']} participants "
+               f"idle > {idle_s / 60:.0f} min; {totals['slots_reopened']} design slots reopened")
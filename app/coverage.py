@@ -0,0 +1,128 @@
+"""
+Coverage-first trial selection.
+
+`trial_coverage` keeps one assignment counter per trial, bumped in the same
+transaction as the Assignment rows it counts (see app.allocator). Workers
+mirror those counters in a CoverageIndex (trial ids bucketed by count), so
+picking the N least-assigned trials never touches the assignment history.
+
+Anything that changes trial_coverage bumps the 'coverage' cache_version in
+the same transaction (the SQLite allocator writer, ensure_counters when it
+adds rows, reclaim). The writer reloads its index only when that version
+moved under it, not on every commit to the database.
+"""
+import random
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import text
+
+from app import db
+from app.trial_cache import bump_version
+
+COVERAGE_KEY = 'coverage'
+
+
+class CoverageIndex:
+    """Trial ids bucketed by assignment count.
+
+    Each bucket is a list plus a position map so members can be moved between
+    buckets and sampled in O(1).
+    """
+
+    def __init__(self):
+        self._buckets = {}   # count -> [tid, ...]
+        self._pos = {}       # tid -> (count, index in bucket)
+        self._lock = threading.Lock()
+        self.loaded_at = 0.0
+
+    def __len__(self):
+        return len(self._pos)
+
+    def load(self, rows):
+        """Replace the index contents with (trial_id, count) rows."""
+        buckets, pos = {}, {}
+        for tid, cnt in rows:
+            bucket = buckets.setdefault(cnt, [])
+            pos[tid] = (cnt, len(bucket))
+            bucket.append(tid)
+        with self._lock:
+            self._buckets, self._pos = buckets, pos
+            self.loaded_at = time.monotonic()
+
+    def pick(self, n, exclude=()):
+        """Up to `n` trial ids with the lowest counts, shuffled within each count."""
+        exclude = set(exclude)
+        chosen = []
+        with self._lock:
+            for cnt in sorted(self._buckets):
+                bucket = self._buckets[cnt]
+                want = n - len(chosen)
+                # over-sample by the excluded ids that could be in this bucket
+                k = min(len(bucket), want + len(exclude))
+                picked = [bucket[i] for i in random.sample(range(len(bucket)), k)]
+                chosen.extend([t for t in picked if t not in exclude][:want])
+                if len(chosen) >= n:
+                    break
+        return chosen
+
+    def bump(self, tids, delta=1):
+        """Move each trial id `delta` buckets up (or down, for releases)."""
+        with self._lock:
+            for tid in tids:
+                if tid not in self._pos:
+                    continue
+                cnt = self._remove(tid)
+                self._add(tid, max(0, cnt + delta))
+
+    def _remove(self, tid):
+        cnt, idx = self._pos.pop(tid)
+        bucket = self._buckets[cnt]
+        last = bucket.pop()
+        if last != tid:
+            bucket[idx] = last
+            self._pos[last] = (cnt, idx)
+        if not bucket:
+            del self._buckets[cnt]
+        return cnt
+
+    def _add(self, tid, cnt):
+        bucket = self._buckets.setdefault(cnt, [])
+        self._pos[tid] = (cnt, len(bucket))
+        bucket.append(tid)
+
+
+coverage_index = CoverageIndex()
+
+
+_counters_checked_at = 0.0
+
+
+def coverage_version(conn):
+    """The 'coverage' cache_version as seen by `conn`'s transaction."""
+    return conn.execute(text(
+        "SELECT version FROM cache_version WHERE name = :name"
+    ), {'name': COVERAGE_KEY}).scalar() or 0
+
+
+def ensure_counters(conn=None, force=False):
+    """Create missing trial_coverage rows (e.g. for freshly seeded trials).
+
+    The anti-join is O(trials), so it runs at most once per
+    STUDY_COVERAGE_REFRESH_S unless forced.
+    """
+    global _counters_checked_at
+    ttl = current_app.config.get('STUDY_COVERAGE_REFRESH_S', 5.0)
+    if not force and time.monotonic() - _counters_checked_at < ttl:
+        return
+    conn = conn or db.session
+    added = conn.execute(text("""
+        INSERT INTO trial_coverage (trial_id, n_assigned)
+        SELECT t.id, (SELECT COUNT(*) FROM assignment a WHERE a.trial_id = t.id)
+        FROM trial t
+        WHERE NOT EXISTS (SELECT 1 FROM trial_coverage c WHERE c.trial_id = t.id)
+    """)).rowcount
+    if added:
+        bump_version(conn, COVERAGE_KEY)
+    _counters_checked_at = time.monotonic()
@@ -0,0 +1,172 @@
+"""
+Precomputed balanced designs (`flask plan-design`).
+
+A plan is a list of design_slot rows, one per expected participant, each
+holding a condition and an ordered block of trial ids. /study/start claims
+the lowest-seq open slot for the participant's condition (one indexed row
+via ix_design_slot_open) instead of asking the coverage index; when no
+slot is open it falls back to the greedy allocator.
+
+Construction, for v trials and blocks of k:
+
+- Trials are shuffled once per round and cut into cyclic windows of k
+  (window g starts at g*k mod v). A round is v/gcd(v, k) windows, after
+  which every trial has appeared exactly k/gcd(v, k) times; the next round
+  reshuffles, so which trials share a block varies round to round.
+- Each window becomes one group: the same trials, in the same order, once
+  per condition. Conditions are claimed separately in seq order, so after
+  any number of groups every trial has been shown equally often in
+  `control` and `ai`, at matching positions.
+- The order inside a window follows a row of a Williams Latin square
+  (rows rotate group to group; k rows, or 2k when k is odd), so positions
+  and immediate predecessors are counterbalanced.
+"""
+import logging
+import math
+import random
+from datetime import datetime
+
+from sqlalchemy import insert, text
+
+from app.models import DesignSlot
+
+log = logging.getLogger(__name__)
+
+# open slots for a condition, lowest seq first; served by the partial index
+# ix_design_slot_open (condition, seq) WHERE participant_id IS NULL
+OPEN_SLOTS_SQL = """
+    SELECT id, trial_ids FROM design_slot
+    WHERE participant_id IS NULL AND condition = :condition
+    ORDER BY seq
+    LIMIT :k
+"""
+
+
+def williams_rows(k):
+    """Rows of a Williams Latin square of order k (2k rows when k is odd)."""
+    if k <= 0:
+        return [[]]
+    first, lo, hi = [0], 1, k - 1
+    while len(first) < k:
+        if len(first) % 2:
+            first.append(lo)
+            lo += 1
+        else:
+            first.append(hi)
+            hi -= 1
+    rows = [[(x + r) % k for x in first] for r in range(k)]
+    if k % 2:
+        rows += [row[::-1] for row in rows]
+    return rows
+
+
+def build_schedule(trial_ids, k, conditions, participants, seed=None):
+    """[(condition, [trial_id, ...]), ...] in claim (seq) order.
+
+    Yields at least `participants` slots, rounded up to whole groups of
+    one slot per condition.
+    """
+    trial_ids = list(trial_ids)
+    v = len(trial_ids)
+    if k < 1 or k > v:
+        raise ValueError(f'need 1 <= trials per participant <= {v} (the pool size), got {k}')
+    if not conditions:
+        raise ValueError('need at least one condition')
+    rng = random.Random(seed)
+    per_round = v // math.gcd(v, k)
+    orders = williams_rows(k)
+    groups = -(-participants // len(conditions))
+
+    slots, perm = [], None
+    for g in range(groups):
+        if g % per_round == 0:
+            perm = trial_ids[:]
+            rng.shuffle(perm)
+        start = (g % per_round) * k
+        window = [perm[(start + j) % v] for j in range(k)]
+        block = [window[j] for j in orders[g % len(orders)]]
+        slots.extend((c, block) for c in conditions)
+    return slots
+
+
+def balance(slots):
+    """Min/max appearances per trial and per (trial, position), by condition."""
+    out = {}
+    for condition in dict.fromkeys(c for c, _ in slots):
+        per_trial, per_pos = {}, {}
+        for c, block in slots:
+            if c != condition:
+                continue
+            for pos, tid in enumerate(block):
+                per_trial[tid] = per_trial.get(tid, 0) + 1
+                per_pos[tid, pos] = per_pos.get((tid, pos), 0) + 1
+        out[condition] = {
+            'slots': sum(1 for c, _ in slots if c == condition),
+            'trials': len(per_trial),
+            'per_trial': (min(per_trial.values(), default=0), max(per_trial.values(), default=0)),
+            'per_position': (min(per_pos.values(), default=0), max(per_pos.values(), default=0)),
+        }
+    return out
+
+
+def store(conn, slots, chunk_size=1000):
+    """Append `slots` after the current highest seq; returns the rows written."""
+    seq = conn.execute(text("SELECT COALESCE(MAX(seq), -1) FROM design_slot")).scalar() + 1
+    now = datetime.utcnow()
+    rows = [{'seq': seq + i, 'condition': c, 'trial_ids': block, 'created_at': now}
+            for i, (c, block) in enumerate(slots)]
+    for i in range(0, len(rows), chunk_size):
+        conn.execute(insert(DesignSlot.__table__), rows[i:i + chunk_size])
+    return len(rows)
+
+
+def clear_open(conn):
+    """Delete unclaimed slots; claimed ones stay as the record of what was served."""
+    return conn.execute(text("DELETE FROM design_slot WHERE participant_id IS NULL")).rowcount
+
+
+def claim(conn, requests, skip=(), lock=False):
+    """{request index: (slot id, [trial_id, ...])} for new participants with an open slot.
+
+    `lock` adds FOR UPDATE SKIP LOCKED (Postgres), so concurrent starts take
+    different slots; on SQLite the allocator's writer already serializes.
+    A slot whose block is not the requested size (a plan stored with another
+    -n) is left open and logged; that request falls back to the greedy pick.
+    """
+    wanted = {}
+    for i, req in enumerate(requests):
+        if i not in skip and isinstance(req.participant, dict):
+            wanted.setdefault(req.participant.get('condition'), []).append(i)
+    claims = {}
+    cols = DesignSlot.__table__.c
+    stmt = text(OPEN_SLOTS_SQL + (' FOR UPDATE SKIP LOCKED' if lock else '')).columns(cols.id, cols.trial_ids)
+    for condition, idx in wanted.items():
+        rows = conn.execute(stmt, {'condition': condition, 'k': len(idx)}).fetchall()
+        for i, (slot_id, tids) in zip(idx, rows):
+            if len(tids) != requests[i].n:
+                log.warning('design_slot %s has %d trials, start wants %d; using the greedy allocator '
+                            '(re-run flask plan-design --replace -n %d)', slot_id, len(tids),
+                            requests[i].n, requests[i].n)
+                continue
+            claims[i] = (slot_id, list(tids))
+    return claims
+
+
+def mark_claimed(conn, claims, result):
+    """Point each claimed slot at the participant the allocator created for it."""
+    now = datetime.utcnow()
+    rows = [{'sid': slot_id, 'pid': result[i][0], 'now': now}
+            for i, (slot_id, _) in claims.items() if result[i][0] is not None]
+    if rows:
+        conn.execute(text(
+            "UPDATE design_slot SET participant_id = :pid, claimed_at = :now WHERE id = :sid"
+        ), rows)
+
+
+def open_counts(conn):
+    """{condition: (open, claimed)} for `flask plan-design --status`."""
+    rows = conn.execute(text("""
+        SELECT condition, SUM(CASE WHEN participant_id IS NULL THEN 1 ELSE 0 END), COUNT(*)
+        FROM design_slot GROUP BY condition ORDER BY condition
+    """)).fetchall()
+    return {r[0]: (int(r[1]), int(r[2]) - int(r[1])) for r in rows}
@@ -0,0 +1,304 @@
+"""
+Streaming export of study responses.
+
+Responses are read with a server-side cursor (`stream_results` +
+`yield_per`) and written out chunk by chunk, so memory stays flat and the
+first bytes leave immediately however many responses exist. Trial fields
+come from the worker's trial cache (app/trial_cache.py), instead of joining
+and hydrating a Trial object for every response.
+
+Incremental polls cursor on response ids, but an id is handed out at
+insert and only becomes visible at commit, so with concurrent writers a
+lower id can appear after a higher one was already exported. snapshot()
+therefore only advances the cursor to responses stored at least
+STUDY_EXPORT_SETTLE_S ago (Response.stored_at, stamped at insert, also for
+write-behind rows); any transaction shorter than that has committed by then.
+Newer responses go out with the next poll. The horizon only holds back
+incremental polls (since_id / since): a full export returns every response
+committed when it runs, and its cursor is the settled one, so the next poll
+may repeat a few of its newest rows (same response_id) but never skips one.
+"""
+import csv
+import zipfile
+from datetime import datetime, timedelta
+from io import BytesIO, StringIO
+
+from flask import current_app
+from sqlalchemy import bindparam, select
+
+from app import db
+from app.models import CacheVersion, Participant, Response, Trial
+from app.trial_cache import VERSION_KEY, trial_cache
+
+CSV_HEADERS = [
+    "response_id", "participant_id", "condition", "trial_id",
+    "answer_value", "rt_ms", "revealed_ai",
+    "gt_severity_score", "gt_justification",
+    "ai_severity_score", "ai_justification", "ai_confidence",
+    "dilemma_text",
+]
+
+CHUNK_ROWS = 1000
+
+
+def _trial_lookup():
+    """trial_id -> (per-trial export fields, payload/trial-level confidence)."""
+    out = {}
+    for tid, entry in trial_cache.all().items():
+        payload, trial_conf = entry.payload, entry.ai_confidence
+        fallback_conf = payload.get("ai_confidence")
+        if fallback_conf is None:
+            fallback_conf = trial_conf
+        out[tid] = ({
+            "gt_severity_score": payload.get("gt_severity_score"),
+            "gt_justification": payload.get("gt_justification"),
+            "ai_severity_score": payload.get("ai_severity_score"),
+            "ai_justification": payload.get("ai_justification"),
+            "dilemma_text": (payload.get("dilemma_text") or "").replace("\n", " ").strip(),
+        }, fallback_conf)
+    return out
+
+
+# newest response stored before :horizon; served by ix_response_stored_at
+SNAPSHOT_SQL = (select(Response.id, Response.stored_at)
+                .where(Response.stored_at <= bindparam('horizon'))
+                .order_by(Response.stored_at.desc())
+                .limit(1))
+
+
+def snapshot(incremental=True):
+    """(cursor id, newest id, Last-Modified, trials version) for the current export.
+
+    The cursor is the newest response stored before the settle horizon (see
+    module docstring). For an incremental poll that is also the newest row
+    exported; a full export is not held back, so newest is the latest
+    stored response. Last-Modified is the later of the newest row's
+    stored_at and the last trial re-seed/import, which changes the exported
+    GT/AI fields.
+    """
+    now = datetime.utcnow()
+    settle = current_app.config.get('STUDY_EXPORT_SETTLE_S', 5)
+    settled = db.session.execute(SNAPSHOT_SQL, {'horizon': now - timedelta(seconds=settle)}).first()
+    newest = settled if incremental else db.session.execute(SNAPSHOT_SQL, {'horizon': now}).first()
+    trials = db.session.execute(
+        select(CacheVersion.version, CacheVersion.updated_at).where(CacheVersion.name == VERSION_KEY)
+    ).first()
+    trials_version, trials_at = (trials.version, trials.updated_at) if trials else (0, None)
+    cursor = settled.id if settled else 0
+    newest_id, stored_at = (newest.id, newest.stored_at) if newest else (0, None)
+    last_modified = max((t for t in (stored_at, trials_at) if t is not None), default=None)
+    return cursor, newest_id, last_modified, trials_version
+
+
+def rows_query(since_id=None, since=None, upto_id=None):
+    """The response query behind iter_rows().
+
+    since_id / since (a datetime, compared with stored_at) skip responses
+    already fetched; upto_id pins the upper end so the caller can hand out a
+    consistent next cursor. A `since`-only poll comes back in stored_at
+    order instead, so it can be served from the stored_at index.
+    """
+    stmt = (select(Response.id, Response.participant_id, Response.trial_id,
+                   Response.answer, Response.rt_ms, Response.revealed_ai,
+                   Response.ai_confidence, Participant.condition)
+            .join(Participant, Participant.id == Response.participant_id)
+            .execution_options(stream_results=True, yield_per=CHUNK_ROWS))
+    if since_id is not None:
+        stmt = stmt.where(Response.id > since_id)
+    if since is not None:
+        stmt = stmt.where(Response.stored_at > since)
+    if upto_id is not None:
+        stmt = stmt.where(Response.id <= upto_id)
+    if since is not None and since_id is None:
+        stmt = stmt.order_by(Response.stored_at.asc(), Response.id.asc())
+    else:
+        stmt = stmt.order_by(Response.id.asc())
+    return stmt
+
+
+def iter_rows(since_id=None, since=None, upto_id=None):
+    """Yield one export dict per response, in response id order (see rows_query)."""
+    trials = _trial_lookup()
+    for r in db.session.execute(rows_query(since_id, since, upto_id)):
+        fields, fallback_conf = trials.get(r.trial_id, ({}, None))
+        ans_val = r.answer.get("value") if isinstance(r.answer, dict) else None
+        # pick the logged confidence when available; otherwise fall back to trial-level/payload
+        ai_conf = r.ai_confidence if r.ai_confidence is not None else fallback_conf
+        yield {
+            "response_id": r.id,
+            "participant_id": r.participant_id,
+            "condition": r.condition,
+            "trial_id": r.trial_id,
+            "answer_value": ans_val,
+            "rt_ms": r.rt_ms,
+            "revealed_ai": bool(r.revealed_ai),
+            "gt_severity_score": fields.get("gt_severity_score"),
+            "gt_justification": fields.get("gt_justification"),
+            "ai_severity_score": fields.get("ai_severity_score"),
+            "ai_justification": fields.get("ai_justification"),
+            "ai_confidence": ai_conf,
+            "dilemma_text": fields.get("dilemma_text", ""),
+        }
+
+
+def _chunked(rows, encode, n=CHUNK_ROWS):
+    buf = []
+    for row in rows:
+        buf.append(encode(row))
+        if len(buf) >= n:
+            yield "".join(buf)
+            buf = []
+    if buf:
+        yield "".join(buf)
+
+
+def stream_csv(rows):
+    sio = StringIO()
+    w = csv.DictWriter(sio, fieldnames=CSV_HEADERS, extrasaction="ignore")
+    w.writeheader()
+    yield sio.getvalue()
+
+    def encode(row):
+        sio.seek(0)
+        sio.truncate()
+        w.writerow(row)
+        return sio.getvalue()
+    yield from _chunked(rows, encode)
+
+
+def stream_ndjson(rows):
+    dumps = current_app.json.dumps
+    yield from _chunked(rows, lambda row: dumps(row) + "\n")
+
+
+def stream_json(rows):
+    """A JSON array, written element by element."""
+    dumps = current_app.json.dumps
+    yield "["
+    first = True
+
+    def encode(row):
+        nonlocal first
+        sep = "" if first else ","
+        first = False
+        return sep + dumps(row)
+    yield from _chunked(rows, encode)
+    yield "]"
+
+
+# ---------- Columnar (Parquet / Arrow IPC) ----------
+# A fact table of responses plus a trial dimension table, so the long
+# dilemma/justification strings are stored once per trial, not per response.
+COLUMNAR_FORMATS = {'parquet': '.parquet', 'arrow': '.arrow'}
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise RuntimeError("Columnar export needs pyarrow: pip install pyarrow") from None
+    return pyarrow
+
+
+def _int_or_none(v):
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return None
+
+
+def response_table(**window):
+    """Responses as an Arrow table, built batch by batch from a streamed cursor.
+
+    `window` is passed through to iter_rows (since_id / since / upto_id).
+    """
+    pa = _require_pyarrow()
+    schema = pa.schema([
+        ("response_id", pa.int64()),
+        ("participant_id", pa.int64()),
+        ("condition", pa.dictionary(pa.int8(), pa.string())),
+        ("trial_id", pa.int64()),
+        ("answer_value", pa.int16()),
+        ("rt_ms", pa.int32()),
+        ("revealed_ai", pa.bool_()),
+        ("ai_confidence", pa.float64()),
+    ])
+    batches = []
+    cols = {name: [] for name in schema.names}
+
+    def flush():
+        if cols["response_id"]:
+            batches.append(pa.RecordBatch.from_pydict(cols, schema=schema))
+            for v in cols.values():
+                v.clear()
+
+    for row in iter_rows(**window):
+        row["answer_value"] = _int_or_none(row["answer_value"])
+        for name in schema.names:
+            cols[name].append(row[name])
+        if len(cols["response_id"]) >= CHUNK_ROWS:
+            flush()
+    flush()
+    return pa.Table.from_batches(batches, schema=schema)
+
+
+def trial_table():
+    """One row per trial with the fields responses used to repeat."""
+    pa = _require_pyarrow()
+    rows = db.session.execute(select(Trial.id, Trial.split, Trial.ai_confidence, Trial.payload))
+    cols = {k: [] for k in ("trial_id", "split", "gt_severity_score", "ai_severity_score",
+                            "ai_confidence", "dilemma_text", "gt_justification", "ai_justification")}
+    for tid, split, trial_conf, payload in rows:
+        payload = payload or {}
+        conf = payload.get("ai_confidence")
+        cols["trial_id"].append(tid)
+        cols["split"].append(split)
+        cols["gt_severity_score"].append(_int_or_none(payload.get("gt_severity_score")))
+        cols["ai_severity_score"].append(_int_or_none(payload.get("ai_severity_score")))
+        cols["ai_confidence"].append(conf if conf is not None else trial_conf)
+        cols["dilemma_text"].append(payload.get("dilemma_text"))
+        cols["gt_justification"].append(payload.get("gt_justification"))
+        cols["ai_justification"].append(payload.get("ai_justification"))
+    schema = pa.schema([
+        ("trial_id", pa.int64()),
+        ("split", pa.dictionary(pa.int8(), pa.string())),
+        ("gt_severity_score", pa.int16()),
+        ("ai_severity_score", pa.int16()),
+        ("ai_confidence", pa.float64()),
+        ("dilemma_text", pa.string()),
+        ("gt_justification", pa.string()),
+        ("ai_justification", pa.string()),
+    ])
+    return pa.Table.from_pydict(cols, schema=schema)
+
+
+def write_columnar(fmt, sink_for, **window):
+    """Write responses + trials in `fmt`; `sink_for(name)` gives a path or file."""
+    _require_pyarrow()
+    tables = {"responses": response_table(**window), "trials": trial_table()}
+    for name, table in tables.items():
+        sink = sink_for(name + COLUMNAR_FORMATS[fmt])
+        if fmt == "parquet":
+            import pyarrow.parquet as pq
+            pq.write_table(table, sink, compression="zstd", use_dictionary=True)
+        else:
+            import pyarrow.feather as feather
+            # uncompressed IPC can be memory-mapped straight into pandas/polars
+            feather.write_feather(table, sink, compression="uncompressed")
+    return {name: t.num_rows for name, t in tables.items()}
+
+
+def columnar_zip(fmt, **window):
+    """Both tables zipped for download (already compressed, so stored as-is)."""
+    members = []
+
+    def sink_for(name):
+        members.append((name, BytesIO()))
+        return members[-1][1]
+
+    write_columnar(fmt, sink_for, **window)
+    buf = BytesIO()
+    with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_STORED) as zf:
+        for name, member in members:
+            zf.writestr(name, member.getvalue())
+    return buf.getvalue()
@@ -0,0 +1,405 @@
+"""
+Write-behind ingestion for /study/submit and /study/event.
+
+With STUDY_INGEST_MODE=buffered a request is validated, appended to an
+on-disk journal segment and to a bounded in-memory queue, and acknowledged
+straight away. A background thread bulk-inserts queued Response/AIEvent rows
+whenever STUDY_INGEST_BATCH rows are waiting or STUDY_INGEST_FLUSH_MS has
+passed, then deletes the journal segments it has fully written.
+
+Each worker keeps its own segments under STUDY_INGEST_DIR and holds an
+flock on them. On start-up a worker replays any segment it can lock (left
+behind by a crashed or restarted worker), so delivery is at-least-once;
+replayed responses that already exist for (participant, trial) are skipped
+by the unique index on response. gunicorn workers start their buffer at
+boot (start_buffered(), from gunicorn_conf.py), so orphaned rows are written
+even if no buffered request ever reaches that worker; elsewhere the buffer
+starts with the first buffered request.
+
+Once STUDY_INGEST_QUEUE_MAX rows are waiting to be committed, enqueue()
+raises BufferFull and the route answers 429 with a Retry-After header.
+
+Rows are checked before they are accepted (id ranges, string lengths, and
+check_refs() for unknown participants/trials), but if the database still
+rejects a batch with an IntegrityError or DataError, the flusher retries it
+row by row and appends the rows that fail again to
+STUDY_INGEST_DIR/dead-letter.ndjson (logged, never retried), so one bad row
+cannot hold up the queue. Other errors (database down) retry the batch.
+"""
+import atexit
+import fcntl
+import glob
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import DataError, IntegrityError
+
+from app import db
+from app.models import AIEvent, Participant, Response
+from app.stats import answer_value
+from app.trial_cache import trial_cache
+
+log = logging.getLogger(__name__)
+
+
+class BufferFull(Exception):
+    """STUDY_INGEST_QUEUE_MAX rows are already waiting to be written."""
+
+
+# ---------- request -> row ----------
+INT_MAX = 2 ** 31 - 1  # Integer columns are int4 on Postgres
+EVENT_TYPE_MAX = AIEvent.__table__.c.event_type.type.length
+DEAD_LETTER = 'dead-letter.ndjson'  # not *.jsonl, so never replayed
+
+
+def _int(value, name, low=-INT_MAX - 1):
+    value = int(value)
+    if not low <= value <= INT_MAX:
+        raise ValueError(f'{name} out of range')
+    return value
+
+
+def response_row(d):
+    """Column values for a Response from a /study/submit body.
+
+    Raises KeyError/TypeError/ValueError for a body the table would reject.
+    """
+    return {
+        'participant_id': _int(d['participant_id'], 'participant_id', 1),
+        'trial_id': _int(d['trial_id'], 'trial_id', 1),
+        'answer': d.get('answer'),
+        'answer_value': answer_value(d.get('answer')),
+        'correct': None,
+        'rt_ms': _int(d.get('rt_ms') or 0, 'rt_ms'),
+        'revealed_ai': bool(d.get('revealed_ai', False)),
+        'ai_confidence': (float(d['ai_confidence']) if d.get('ai_confidence') is not None else None),
+        'created_at': datetime.utcnow(),
+    }
+
+
+def event_row(d):
+    """Column values for an AIEvent from a /study/event body (errors as response_row)."""
+    event_type = d.get('event_type')
+    if event_type is not None and (not isinstance(event_type, str) or len(event_type) > EVENT_TYPE_MAX):
+        raise ValueError(f'event_type must be a string of at most {EVENT_TYPE_MAX} characters')
+    return {
+        'participant_id': _int(d['participant_id'], 'participant_id', 1),
+        'trial_id': _int(d['trial_id'], 'trial_id', 1),
+        'event_type': event_type,
+        'payload': d.get('payload'),
+        'created_at': datetime.utcnow(),
+    }
+
+
+_known_participants = set()  # ids check_refs() has already seen in the DB
+KNOWN_PARTICIPANTS_MAX = 100000
+
+
+def check_refs(rows):
+    """Raise ValueError unless every row's participant and trial exist.
+
+    Called before rows are buffered, where a foreign-key error would only
+    surface in the flusher. Trials come from the trial cache; participants
+    are looked up once per worker and remembered.
+    """
+    pids = {r['participant_id'] for r in rows} - _known_participants
+    if pids:
+        found = set(db.session.execute(select(Participant.id).where(Participant.id.in_(pids))).scalars())
+        if len(_known_participants) > KNOWN_PARTICIPANTS_MAX:
+            _known_participants.clear()
+        _known_participants.update(found)
+        if pids - found:
+            raise ValueError(f'unknown participant_id {min(pids - found)}')
+    tids = {r['trial_id'] for r in rows}
+    missing = tids - set(trial_cache.get_many(list(tids)))
+    if missing:
+        raise ValueError(f'unknown trial_id {min(missing)}')
+
+
+MODELS = {'response': Response, 'event': AIEvent}
+
+
+def _encode(kind, row):
+    row = dict(row, created_at=row['created_at'].isoformat())
+    return json.dumps([kind, row], separators=(',', ':')) + '\n'
+
+
+def _dead_letter_line(kind, row, exc):
+    row = dict(row, created_at=row['created_at'].isoformat())
+    error = str(getattr(exc, 'orig', exc)).splitlines()[0][:500]
+    return json.dumps({'kind': kind, 'row': row, 'error': error,
+                       'at': datetime.utcnow().isoformat()}, separators=(',', ':'), default=str) + '\n'
+
+
+def _decode(line):
+    kind, row = json.loads(line)
+    row['created_at'] = datetime.fromisoformat(row['created_at'])
+    if kind == 'response' and 'answer_value' not in row:  # journaled before the column existed
+        row['answer_value'] = answer_value(row.get('answer'))
+    return kind, row
+
+
+_ON_CONFLICT_INSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+def response_insert():
+    """INSERT for Response rows that leaves an existing (participant, trial) answer alone."""
+    table = Response.__table__
+    make = _ON_CONFLICT_INSERTS.get(db.engine.dialect.name)
+    if make is None:
+        return insert(table)
+    return make(table).on_conflict_do_nothing()
+
+
+def bulk_insert(items):
+    """Insert [(kind, row), ...] with one executemany per table."""
+    by_kind = {}
+    for kind, row in items:
+        by_kind.setdefault(kind, []).append(row)
+    for kind, rows in by_kind.items():
+        if rows:
+            stmt = response_insert() if kind == 'response' else insert(MODELS[kind])
+            db.session.execute(stmt, rows)
+
+
+def insert_isolating(items):
+    """bulk_insert + commit; if the database rejects the batch, go row by row.
+
+    Returns [(kind, row, exc), ...] for rows the database rejects on their
+    own (IntegrityError/DataError). Any other error propagates, so the
+    caller retries the whole batch.
+    """
+    try:
+        bulk_insert(items)
+        db.session.commit()
+        return []
+    except (IntegrityError, DataError) as exc:
+        db.session.rollback()
+        if len(items) == 1:
+            return [(*items[0], exc)]
+    dead = []
+    for kind, row in items:
+        try:
+            bulk_insert([(kind, row)])
+            db.session.commit()
+        except (IntegrityError, DataError) as exc:
+            db.session.rollback()
+            dead.append((kind, row, exc))
+    return dead
+
+
+def journal_dir(app):
+    return app.config.get('STUDY_INGEST_DIR') or os.path.join(app.instance_path, 'ingest')
+
+
+def journal_depth(app=None):
+    """Rows in every worker's journal that are not committed yet.
+
+    A segment is deleted once all of its rows are written, so whatever is
+    on disk is still pending (or waiting for replay after a crash).
+    """
+    depth = 0
+    for path in glob.glob(os.path.join(journal_dir(app or current_app), '*.jsonl')):
+        try:
+            with open(path, encoding='utf-8') as f:
+                depth += sum(1 for line in f if line.strip())
+        except FileNotFoundError:
+            pass  # flushed and removed meanwhile
+    return depth
+
+
+class _Segment:
+    """One append-only journal file, flocked by the worker that owns it."""
+
+    def __init__(self, path):
+        self.path = path
+        # locked before it gets its *.jsonl name, so a replaying worker
+        # never takes a fresh segment for an orphan
+        self.fh = open(path + '.new', 'a', encoding='utf-8')
+        fcntl.flock(self.fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        os.rename(path + '.new', path)
+        self.pending = 0
+        self.sealed = False
+
+    def remove(self):
+        self.fh.close()
+        os.unlink(self.path)
+
+
+class IngestBuffer:
+    """Bounded queue + journal + flusher thread; one per worker process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queue = None
+        self._segment = None
+        self._segments = []
+        self._seq = 0
+        self._thread = None
+        self._app = None
+        self.depth = 0  # rows accepted but not yet committed
+
+    def enqueue(self, kind, row):
+        self.enqueue_many(kind, [row])
+
+    def enqueue_many(self, kind, rows):
+        """Accept all of `rows` or none of them."""
+        self._ensure_started()
+        with self._lock:
+            if self.depth + len(rows) > self._max_depth:
+                raise BufferFull()
+            seg = self._segment
+            for row in rows:
+                self._queue.put_nowait((seg, kind, row))
+            self.depth += len(rows)
+            seg.pending += len(rows)
+            seg.fh.write(''.join(_encode(kind, row) for row in rows))
+            seg.fh.flush()
+            if self._app.config.get('STUDY_INGEST_FSYNC', False):
+                os.fsync(seg.fh.fileno())
+
+    # ---------- lifecycle ----------
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            app = self._app = current_app._get_current_object()
+            self._dir = journal_dir(app)
+            os.makedirs(self._dir, exist_ok=True)
+            self._queue = queue.Queue()
+            self._max_depth = app.config.get('STUDY_INGEST_QUEUE_MAX', 5000)
+            self._replay()
+            self._rotate()
+            self._thread = threading.Thread(target=self._run, name='ingest-flusher', daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def _rotate(self):
+        """Start a new journal segment (caller holds the lock)."""
+        if self._segment is not None:
+            self._segment.sealed = True
+        self._seq += 1
+        path = os.path.join(self._dir, f'{os.getpid()}-{int(time.time())}-{self._seq}.jsonl')
+        self._segment = _Segment(path)
+        self._segments.append(self._segment)
+
+    def _replay(self):
+        """Insert rows from segments no live worker holds a lock on."""
+        for path in sorted(glob.glob(os.path.join(self._dir, '*.jsonl'))):
+            try:
+                fh = open(path, 'r+', encoding='utf-8')
+                fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                continue  # owned by a running worker
+            with fh:
+                items = [_decode(line) for line in fh if line.strip()]
+                if items:
+                    with self._app.app_context():
+                        dead = insert_isolating(items)
+                    self._dead_letter(dead)
+                    log.info('replayed %d buffered rows from %s', len(items) - len(dead), path)
+                os.unlink(path)
+
+    def _dead_letter(self, dead):
+        """Append rows the database rejected to the dead-letter file and log them."""
+        if not dead:
+            return
+        path = os.path.join(self._dir, DEAD_LETTER)
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(''.join(_dead_letter_line(kind, row, exc) for kind, row, exc in dead))
+        for kind, row, exc in dead:
+            log.error('ingest: %s row for participant %s / trial %s rejected (%s); moved to %s',
+                      kind, row.get('participant_id'), row.get('trial_id'),
+                      str(getattr(exc, 'orig', exc)).splitlines()[0][:200], path)
+
+    # ---------- flushing ----------
+    def _take_batch(self, block):
+        batch_max = self._app.config.get('STUDY_INGEST_BATCH', 500)
+        window = self._app.config.get('STUDY_INGEST_FLUSH_MS', 200) / 1000.0
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=window) if block else self._queue.get_nowait())
+        except queue.Empty:
+            return batch
+        deadline = time.monotonic() + window
+        while len(batch) < batch_max:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not block:
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except queue.Empty:
+                    break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        with self._app.app_context():
+            dead = insert_isolating([(kind, row) for _, kind, row in batch])
+        self._dead_letter(dead)
+        with self._lock:
+            for seg, _, _ in batch:
+                seg.pending -= 1
+            self.depth -= len(batch)
+            current = self._segment
+            seg_max = self._app.config.get('STUDY_INGEST_SEGMENT_BYTES', 1 << 20)
+            if current.fh.tell() and (not current.pending or current.fh.tell() > seg_max):
+                self._rotate()
+            for seg in [s for s in self._segments if s.sealed and not s.pending]:
+                self._segments.remove(seg)
+                seg.remove()
+
+    def _run(self):
+        retry = []
+        while True:
+            batch = retry or self._take_batch(block=True)
+            if not batch:
+                continue
+            try:
+                self._write(batch)
+                retry = []
+            except Exception:
+                log.exception('ingest flush of %d rows failed; retrying', len(batch))
+                retry = batch
+                time.sleep(1.0)
+
+    def flush(self):
+        """Write everything queued right now (used at exit and by tests)."""
+        if self._queue is None:
+            return
+        while True:
+            batch = self._take_batch(block=False)
+            if not batch:
+                return
+            self._write(batch)
+
+
+ingest_buffer = IngestBuffer()
+
+
+def buffered():
+    return current_app.config.get('STUDY_INGEST_MODE', 'direct') == 'buffered'
+
+
+def start_buffered(app):
+    """Replay orphaned journal segments and start the flusher now, if `app` buffers.
+
+    Called once per worker process after it has forked; never in a
+    preloading master, whose threads and flocks would not survive the fork.
+    """
+    with app.app_context():
+        if buffered():
+            ingest_buffer._ensure_started()
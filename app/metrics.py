@@ -0,0 +1,282 @@
+"""
+Request and database metrics, exposed in Prometheus text format at /metrics.
+
+For every request the hooks below record, labelled by route rule and method:
+
+  study_request_duration_seconds   wall time until the response is returned
+  study_request_sql_statements     statements executed by the request
+  study_request_sql_seconds        time spent in those statements
+  study_db_commit_seconds          time in session.commit() (flush + COMMIT)
+
+SQL is timed with engine cursor events and commits with session events.
+Work done outside a request (the allocator's SQLite writer thread, the
+ingest flusher) is counted under route="<background>". The pool checkout
+numbers from app/pool.py are exported alongside.
+
+Each gunicorn worker keeps its numbers in memory and rewrites
+STUDY_METRICS_DIR/metrics-<pid>.json at most every STUDY_METRICS_FLUSH_S;
+/metrics sums the files of every worker, so a scrape that lands on any
+worker sees the whole deployment. gunicorn_conf.py clears the directory
+when the master starts. With STUDY_ADMIN_TOKEN set, scrapes must send it
+(app/admin.py).
+"""
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Blueprint, current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from app.admin import require_admin
+from app.pool import WAIT_BUCKETS, meter as pool_meter
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+BACKGROUND = '<background>'
+
+bp = Blueprint('metrics', __name__)
+
+HISTOGRAMS = {
+    'study_request_duration_seconds': ('Request latency by route.', LATENCY_BUCKETS),
+    'study_request_sql_statements': ('SQL statements executed per request.', COUNT_BUCKETS),
+    'study_request_sql_seconds': ('Time spent in SQL per request.', LATENCY_BUCKETS),
+    'study_db_commit_seconds': ('Session commit time (flush + COMMIT).', LATENCY_BUCKETS),
+    'study_db_pool_wait_seconds': ('Connection pool checkout wait.', WAIT_BUCKETS),
+}
+COUNTERS = {
+    'study_requests_total': 'Requests by route, method and status.',
+    'study_background_sql_statements_total': 'SQL statements executed outside requests.',
+    'study_background_sql_seconds_total': 'Time spent in SQL outside requests.',
+    'study_db_pool_connects_total': 'New database connections opened.',
+    'study_db_pool_timeouts_total': 'Pool checkouts that timed out.',
+}
+GAUGES = {
+    'study_db_pool_in_use': 'Connections checked out, summed over workers.',
+    'study_db_pool_capacity': 'pool_size + max_overflow, summed over workers.',
+}
+
+
+class Registry:
+    """One process's histograms and counters, keyed by (name, labels)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}  # (name, labels) -> [per-bucket counts..., overflow, sum]
+        self.counters = {}    # (name, labels) -> value
+
+    def observe(self, name, labels, value):
+        buckets = HISTOGRAMS[name][1]
+        key = (name, labels)
+        with self._lock:
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = [0] * (len(buckets) + 1) + [0.0]
+            h[bisect_left(buckets, value)] += 1
+            h[-1] += value
+
+    def inc(self, name, labels, value=1):
+        key = (name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def dump(self):
+        """JSON-able snapshot, with this process's pool numbers folded in."""
+        with self._lock:
+            hists = [[n, list(l), list(h)] for (n, l), h in self.histograms.items()]
+            counters = [[n, list(l), v] for (n, l), v in self.counters.items()]
+        pool = pool_meter.totals()
+        if pool['checkouts'] or pool['connects']:
+            hists.append(['study_db_pool_wait_seconds', [], pool['wait_hist'] + [pool['wait_total']]])
+        counters += [['study_db_pool_connects_total', [], pool['connects']],
+                     ['study_db_pool_timeouts_total', [], pool['timeouts']]]
+        gauges = [['study_db_pool_in_use', [], pool['in_use']],
+                  ['study_db_pool_capacity', [], pool['capacity']]]
+        return {'pid': os.getpid(), 'histograms': hists, 'counters': counters, 'gauges': gauges}
+
+
+registry = Registry()
+_flushed_at = 0.0
+
+
+def metrics_dir():
+    return current_app.config.get('STUDY_METRICS_DIR') or os.path.join(current_app.instance_path, 'metrics')
+
+
+def flush(force=False):
+    """Rewrite this worker's metrics file (rate-limited unless forced)."""
+    global _flushed_at
+    now = time.monotonic()
+    if not force and now - _flushed_at < current_app.config.get('STUDY_METRICS_FLUSH_S', 1.0):
+        return
+    _flushed_at = now
+    directory = metrics_dir()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'metrics-{os.getpid()}.json')
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(registry.dump(), f, separators=(',', ':'))
+    os.replace(tmp, path)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def collect():
+    """Every worker's numbers summed: ({name: {labels: histogram}}, {name: {labels: value}}).
+
+    Counters and histograms of exited workers are kept (they only ever grow);
+    their gauges are dropped.
+    """
+    flush(force=True)
+    hists, scalars = {}, {}
+    for path in glob.glob(os.path.join(metrics_dir(), 'metrics-*.json')):
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue  # a worker is mid-rewrite or the file was removed
+        for name, labels, h in data['histograms']:
+            acc = hists.setdefault(name, {}).setdefault(tuple(map(tuple, labels)), [0] * len(h))
+            for i, v in enumerate(h):
+                acc[i] += v
+        live = _alive(data['pid'])
+        for name, labels, v in data['counters'] + (data['gauges'] if live else []):
+            series = scalars.setdefault(name, {})
+            key = tuple(map(tuple, labels))
+            series[key] = series.get(key, 0) + v
+    return hists, scalars
+
+
+def _labels(pairs, extra=()):
+    pairs = list(pairs) + list(extra)
+    if not pairs:
+        return ''
+    esc = lambda v: str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+    return '{' + ','.join(f'{k}="{esc(v)}"' for k, v in pairs) + '}'
+
+
+def render():
+    """Prometheus text exposition (format 0.0.4) of collect()."""
+    hists, scalars = collect()
+    out = []
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        if name not in hists:
+            continue
+        out += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+        for labels, h in sorted(hists[name].items()):
+            cumulative = 0
+            for le, n in zip(buckets, h):
+                cumulative += n
+                out.append(f'{name}_bucket{_labels(labels, [("le", le)])} {cumulative}')
+            count = cumulative + h[len(buckets)]
+            out.append(f'{name}_bucket{_labels(labels, [("le", "+Inf")])} {count}')
+            out.append(f'{name}_sum{_labels(labels)} {h[-1]}')
+            out.append(f'{name}_count{_labels(labels)} {count}')
+    for kind, specs in (('counter', COUNTERS), ('gauge', GAUGES)):
+        for name, help_text in specs.items():
+            if name not in scalars:
+                continue
+            out += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            out += [f'{name}{_labels(labels)} {v}' for labels, v in sorted(scalars[name].items())]
+    return '\n'.join(out) + '\n'
+
+
+# ---------- Hooks ----------
+_statement_callbacks = []
+
+
+def on_statement(callback):
+    """Also call callback(conn, statement, parameters, executemany, seconds) for every timed statement.
+
+    Lets app/slowlog.py share these cursor hooks instead of timing everything twice.
+    """
+    _statement_callbacks.append(callback)
+    return callback
+
+
+def _current():
+    """The running request's [sql statements, sql seconds, commit seconds], or None."""
+    return g.get('_metrics') if has_request_context() else None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('_metrics_t0', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('_metrics_t0')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    stats = _current()
+    if stats is None:
+        registry.inc('study_background_sql_statements_total', ())
+        registry.inc('study_background_sql_seconds_total', (), elapsed)
+    else:
+        stats[0] += 1
+        stats[1] += elapsed
+    for callback in _statement_callbacks:
+        callback(conn, statement, parameters, executemany, elapsed)
+
+
+@event.listens_for(Session, 'before_commit')
+def _before_commit(session):
+    session.info['_metrics_commit_t0'] = time.perf_counter()
+
+
+@event.listens_for(Session, 'after_commit')
+def _after_commit(session):
+    t0 = session.info.pop('_metrics_commit_t0', None)
+    if t0 is None:
+        return
+    elapsed = time.perf_counter() - t0
+    stats = _current()
+    if stats is not None:
+        stats[2] += elapsed
+    else:
+        registry.observe('study_db_commit_seconds', (('route', BACKGROUND),), elapsed)
+
+
+@bp.before_app_request
+def _start_request():
+    g._metrics_t0 = time.perf_counter()
+    g._metrics = [0, 0.0, 0.0]
+
+
+@bp.after_app_request
+def _finish_request(resp):
+    t0 = g.pop('_metrics_t0', None)
+    stats = g.pop('_metrics', None)
+    if t0 is None or request.endpoint == 'metrics.metrics_view':
+        return resp
+    route = request.url_rule.rule if request.url_rule else '<unmatched>'
+    labels = (('route', route), ('method', request.method))
+    registry.observe('study_request_duration_seconds', labels, time.perf_counter() - t0)
+    registry.observe('study_request_sql_statements', labels, stats[0])
+    registry.observe('study_request_sql_seconds', labels, stats[1])
+    if stats[2]:
+        registry.observe('study_db_commit_seconds', labels[:1], stats[2])
+    registry.inc('study_requests_total', labels + (('status', resp.status_code),))
+    flush()
+    return resp
+
+
+@bp.route('/metrics')
+def metrics_view():
+    """Prometheus text for every worker. Needs the admin token when STUDY_ADMIN_TOKEN is set."""
+    require_admin()
+    return current_app.response_class(render(), mimetype='text/plain; version=0.0.4')
@@ -6,6 +6,10 @@ from app import db  # db is created in app/__init__.py
 
 class Participant(db.Model):
     __tablename__ = 'participant'
+    # /study/start resumes by (workerId, assignmentId); NULLs (no MTurk ids) are not constrained
+    __table_args__ = (
+        db.Index('ux_participant_worker_assignment', 'worker_id', 'assignment_id', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     condition = db.Column(db.String(16), nullable=False)  # 'control' or 'ai'
@@ -16,29 +20,94 @@ class Participant(db.Model):
 
 class Trial(db.Model):
     __tablename__ = 'trial'
+    # seeding upserts on this, so re-running seed-trials* is idempotent
+    __table_args__ = (
+        db.Index('ux_trial_content_hash', 'content_hash', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     payload = db.Column(JSONType, nullable=False)  # stores dilemma_text, gt, ai fields
+    content_hash = db.Column(db.String(64), nullable=True)  # sha256 of the dilemma, see app/seeding.py
     split = db.Column(db.String(32), default='all', index=True)
     ai_confidence = db.Column(db.Float, nullable=True)   # 0..1
+    # typed copies of payload scores so stats don't have to parse JSON
+    gt_severity_score = db.Column(db.Integer, nullable=True)
+    ai_severity_score = db.Column(db.Integer, nullable=True)
+
+
+class TrialCoverage(db.Model):
+    """Running assignment count per trial, bumped alongside each Assignment insert."""
+    __tablename__ = 'trial_coverage'
+    trial_id = db.Column(db.Integer, db.ForeignKey('trial.id'), primary_key=True)
+    n_assigned = db.Column(db.Integer, nullable=False, default=0, index=True)
+
+
+class CacheVersion(db.Model):
+    """Counter bumped when cached data changes (e.g. trials; see app/trial_cache.py)."""
+    __tablename__ = 'cache_version'
+    name = db.Column(db.String(32), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=True)  # last bump; export Last-Modified
 
 
 class Assignment(db.Model):
     __tablename__ = 'assignment'
+    # /study/next and /study/extend read a participant's block in order
+    __table_args__ = (
+        db.Index('ix_assignment_participant_order', 'participant_id', 'order_idx'),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    participant_id = db.Column(db.Integer, db.ForeignKey('participant.id'), index=True, nullable=False)
+    participant_id = db.Column(db.Integer, db.ForeignKey('participant.id'), nullable=False)
     trial_id = db.Column(db.Integer, db.ForeignKey('trial.id'), index=True, nullable=False)
     order_idx = db.Column(db.Integer, default=0)
 
+class DesignSlot(db.Model):
+    """One participant's precomputed block from `flask plan-design` (see app/design.py)."""
+    __tablename__ = 'design_slot'
+    # /study/start claims the lowest open seq for its condition
+    __table_args__ = (
+        db.Index('ix_design_slot_open', 'condition', 'seq',
+                 sqlite_where=db.text('participant_id IS NULL'),
+                 postgresql_where=db.text('participant_id IS NULL')),
+        # partial too, so the planner can't mistake it for a way to find the NULLs
+        db.Index('ux_design_slot_participant', 'participant_id', unique=True,
+                 sqlite_where=db.text('participant_id IS NOT NULL'),
+                 postgresql_where=db.text('participant_id IS NOT NULL')),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    seq = db.Column(db.Integer, nullable=False, unique=True)
+    condition = db.Column(db.String(16), nullable=False)
+    trial_ids = db.Column(JSONType, nullable=False)  # ordered block
+    participant_id = db.Column(db.Integer, db.ForeignKey('participant.id'), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    claimed_at = db.Column(db.DateTime, nullable=True)
+
+class ReclaimedAssignment(db.Model):
+    """An unanswered Assignment released by `flask reclaim-assignments` (see app/reclaim.py)."""
+    __tablename__ = 'reclaimed_assignment'
+    id = db.Column(db.Integer, primary_key=True)
+    participant_id = db.Column(db.Integer, db.ForeignKey('participant.id'), index=True, nullable=False)
+    trial_id = db.Column(db.Integer, db.ForeignKey('trial.id'), nullable=False)
+    order_idx = db.Column(db.Integer)
+    last_activity_at = db.Column(db.DateTime)  # newest of start / response / AI event
+    reclaimed_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
 class Response(db.Model):
     __tablename__ = 'response'
+    # one answer per (participant, trial): retried submits become no-ops
+    __table_args__ = (
+        db.Index('ux_response_participant_trial', 'participant_id', 'trial_id', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    participant_id = db.Column(db.Integer, db.ForeignKey('participant.id'), index=True, nullable=False)
+    participant_id = db.Column(db.Integer, db.ForeignKey('participant.id'), nullable=False)
     trial_id = db.Column(db.Integer, db.ForeignKey('trial.id'), index=True, nullable=False)
     answer = db.Column(JSONType)     # { "value": 1..5 }
+    answer_value = db.Column(db.Integer, nullable=True)  # answer["value"], extracted on write
     correct = db.Column(db.Boolean)  # keep null; we’ll analyze offline vs GT
     rt_ms = db.Column(db.Integer)
     revealed_ai = db.Column(db.Boolean, default=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)  # when answered (buffered: queued)
+    # when the row was inserted; the export cursor (a buffered row is inserted after created_at)
+    stored_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     ai_confidence = db.Column(db.Float, nullable=True)   # 0..1 actually shown on that trial
 
 
@@ -0,0 +1,146 @@
+"""
+Database connection pool sizing and metering.
+
+engine_options() turns the DB_* settings in config.py into
+SQLALCHEMY_ENGINE_OPTIONS. Pools are sized per gunicorn worker: one
+connection per request thread plus the allocator/ingest background
+threads, capped so WEB_CONCURRENCY workers stay under DB_MAX_CONNECTIONS.
+With DB_PGBOUNCER=1 the app keeps no pool of its own (NullPool), leaving
+pooling to PgBouncer in transaction mode.
+
+MeteredQueuePool records how long each checkout waited (including opening a
+new connection, i.e. the TLS handshake) and how close the pool is to
+exhaustion; pool_stats() returns them for /study/pool.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from sqlalchemy import exc
+from sqlalchemy.pool import NullPool, QueuePool
+
+# checkout wait buckets, seconds (upper bounds)
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+BACKGROUND_THREADS = 2  # trial allocator writer + ingest flusher
+
+
+class PoolMeter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.checkouts = 0
+        self.connects = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.wait_hist = [0] * (len(WAIT_BUCKETS) + 1)
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.capacity = None
+
+    def checkout(self, waited, in_use, capacity):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            self.wait_hist[bisect_left(WAIT_BUCKETS, waited)] += 1
+            self.in_use = in_use
+            self.peak_in_use = max(self.peak_in_use, in_use)
+            self.capacity = capacity
+
+    def checkin(self, in_use):
+        with self._lock:
+            self.in_use = in_use
+
+    def totals(self):
+        """Raw counters for app/metrics.py: checkouts, connects, timeouts, in_use, capacity,
+        per-bucket wait counts (last is overflow) and total wait seconds."""
+        with self._lock:
+            return dict(checkouts=self.checkouts, connects=self.connects, timeouts=self.timeouts,
+                        in_use=self.in_use, capacity=self.capacity or 0,
+                        wait_hist=list(self.wait_hist), wait_total=self.wait_total)
+
+    def snapshot(self):
+        with self._lock:
+            cap = self.capacity
+            return {
+                'pid': os.getpid(),
+                'checkouts': self.checkouts,
+                'connects': self.connects,
+                'timeouts': self.timeouts,
+                'wait_avg_ms': 1000 * self.wait_total / self.checkouts if self.checkouts else None,
+                'wait_max_ms': 1000 * self.wait_max,
+                'wait_histogram_ms': dict(zip([f'le_{int(b * 1000)}' for b in WAIT_BUCKETS] + ['inf'],
+                                              self.wait_hist)),
+                'in_use': self.in_use,
+                'peak_in_use': self.peak_in_use,
+                'capacity': cap,
+                'saturation': self.in_use / cap if cap else None,
+                'peak_saturation': self.peak_in_use / cap if cap else None,
+            }
+
+
+meter = PoolMeter()
+
+
+class MeteredQueuePool(QueuePool):
+    """QueuePool that reports checkout waits and saturation to `meter`."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except exc.TimeoutError:
+            with meter._lock:
+                meter.timeouts += 1
+            raise
+        meter.checkout(time.perf_counter() - start, self.checkedout(), self.size() + self._max_overflow)
+        return conn
+
+    def _do_return_conn(self, record):
+        super()._do_return_conn(record)
+        meter.checkin(self.checkedout())
+
+    def _create_connection(self):
+        with meter._lock:
+            meter.connects += 1
+        return super()._create_connection()
+
+
+def engine_options(config):
+    """SQLALCHEMY_ENGINE_OPTIONS for `config` (see the DB_* settings in config.py)."""
+    uri = config.get('SQLALCHEMY_DATABASE_URI') or ''
+    if uri in ('sqlite://', 'sqlite:///:memory:'):
+        return {}  # in-memory SQLite must keep its single shared connection
+    options = {
+        'pool_pre_ping': config.get('DB_POOL_PRE_PING', True),
+        'pool_recycle': config.get('DB_POOL_RECYCLE', 1800),
+    }
+    if config.get('DB_PGBOUNCER'):
+        options['poolclass'] = NullPool
+        return options
+
+    workers = max(1, config.get('WEB_CONCURRENCY') or 1)
+    threads = max(1, config.get('GUNICORN_THREADS') or 1)
+    size = config.get('DB_POOL_SIZE') or threads + BACKGROUND_THREADS
+    overflow = config.get('DB_MAX_OVERFLOW')
+    overflow = threads if overflow is None else overflow
+    budget = config.get('DB_MAX_CONNECTIONS')
+    if budget:
+        per_worker = max(1, budget // workers)
+        size = min(size, per_worker)
+        overflow = max(0, min(overflow, per_worker - size))
+    options.update(
+        poolclass=MeteredQueuePool,
+        pool_size=size,
+        max_overflow=overflow,
+        pool_timeout=config.get('DB_POOL_TIMEOUT', 10),
+    )
+    return options
+
+
+def pool_stats():
+    return meter.snapshot()
@@ -0,0 +1,183 @@
+"""
+Abandoned-assignment reclamation (`flask reclaim-assignments`).
+
+A participant is idle once nothing of theirs (the start itself, a Response,
+an AIEvent) is newer than STUDY_RECLAIM_IDLE_S. Their unanswered Assignment
+rows are deleted, trial_coverage is decremented to match, and each released
+slot is written to reclaimed_assignment. The allocator's coverage index
+picks the change up on its next reload (the writer thread watches the
+'coverage' cache_version; Postgres reads trial_coverage per start).
+
+If the participant never answered anything and held a design_slot
+(`flask plan-design`), the slot is reopened for the next start with its
+condition. Partly answered slots stay claimed; their unanswered trials go
+back to the greedy pool with the rest.
+
+The delete re-checks for a response in the same statement, so a submit that
+lands while the job runs keeps its assignment. Submits still sitting in the
+write-behind journal (STUDY_INGEST_MODE=buffered) are invisible to that
+check, so a pass is skipped while any journal holds rows.
+
+Each batch that releases something bumps the 'assignments' cache version;
+workers notice within STUDY_TRIAL_CACHE_TTL_S and rebuild their cached
+trial queues from the assignment table, so released trials stop being
+served to a participant who comes back.
+"""
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy import DateTime, Integer, bindparam, column, insert, text
+
+from app.coverage import COVERAGE_KEY
+from app.ingest import journal_depth
+from app.models import ReclaimedAssignment
+from app.trial_cache import bump_version
+from app.trial_queue import ASSIGNMENTS_KEY
+
+# participants past `after` with an unanswered assignment and no activity
+# since `cutoff`, with their latest activity timestamps
+IDLE_SQL = text("""
+    SELECT p.id, p.created_at,
+           (SELECT MAX(r.created_at) FROM response r WHERE r.participant_id = p.id) AS last_response,
+           (SELECT MAX(e.created_at) FROM ai_event e WHERE e.participant_id = p.id) AS last_event
+    FROM participant p
+    WHERE p.id > :after AND p.created_at < :cutoff
+      AND EXISTS (
+        SELECT 1 FROM assignment a
+        LEFT JOIN response r ON r.trial_id = a.trial_id AND r.participant_id = a.participant_id
+        WHERE a.participant_id = p.id AND r.id IS NULL)
+      AND NOT EXISTS (SELECT 1 FROM response r WHERE r.participant_id = p.id AND r.created_at >= :cutoff)
+      AND NOT EXISTS (SELECT 1 FROM ai_event e WHERE e.participant_id = p.id AND e.created_at >= :cutoff)
+    ORDER BY p.id
+    LIMIT :batch
+""").columns(column('id', Integer), column('created_at', DateTime),
+             column('last_response', DateTime), column('last_event', DateTime))
+
+UNANSWERED_SQL = text("""
+    SELECT a.participant_id, a.trial_id
+    FROM assignment a
+    LEFT JOIN response r ON r.trial_id = a.trial_id AND r.participant_id = a.participant_id
+    WHERE a.participant_id IN :pids AND r.id IS NULL
+""").bindparams(bindparam('pids', expanding=True))
+
+DELETE_SQL = text("""
+    DELETE FROM assignment
+    WHERE participant_id IN :pids
+      AND NOT EXISTS (SELECT 1 FROM response r
+                      WHERE r.participant_id = assignment.participant_id
+                        AND r.trial_id = assignment.trial_id)
+    RETURNING participant_id, trial_id, order_idx
+""").bindparams(bindparam('pids', expanding=True))
+
+# coverage never goes below zero, even if counters drifted
+RELEASE_SQL = text("""
+    UPDATE trial_coverage
+    SET n_assigned = CASE WHEN n_assigned > :delta THEN n_assigned - :delta ELSE 0 END
+    WHERE trial_id IN :tids
+""").bindparams(bindparam('tids', expanding=True))
+
+_UNTOUCHED_SLOTS = """
+    WHERE participant_id IN :pids
+      AND NOT EXISTS (SELECT 1 FROM response r WHERE r.participant_id = design_slot.participant_id)
+"""
+REOPEN_SQL = text(
+    "UPDATE design_slot SET participant_id = NULL, claimed_at = NULL" + _UNTOUCHED_SLOTS
+).bindparams(bindparam('pids', expanding=True))
+REOPENABLE_SQL = text(
+    "SELECT COUNT(*) FROM design_slot" + _UNTOUCHED_SLOTS
+).bindparams(bindparam('pids', expanding=True))
+
+
+def idle_participants(conn, cutoff, after=0, batch=500):
+    """[(participant_id, last activity), ...] for one page of idle participants."""
+    rows = conn.execute(IDLE_SQL, {'after': after, 'cutoff': cutoff, 'batch': batch}).fetchall()
+    return [(r.id, max(t for t in (r.created_at, r.last_response, r.last_event) if t is not None))
+            for r in rows]
+
+
+def reclaim_batch(conn, idle, now):
+    """Release the unanswered slots of `idle` participants; caller commits.
+
+    Returns (assignments released, design slots reopened).
+    """
+    last_seen = dict(idle)
+    pids = list(last_seen)
+    deleted = conn.execute(DELETE_SQL, {'pids': pids}).fetchall()
+    if not deleted:
+        return 0, 0
+    conn.execute(insert(ReclaimedAssignment.__table__), [
+        {'participant_id': pid, 'trial_id': tid, 'order_idx': order_idx,
+         'last_activity_at': last_seen[pid], 'reclaimed_at': now}
+        for pid, tid, order_idx in deleted
+    ])
+
+    # one UPDATE per distinct decrement, as in the allocator
+    by_delta = {}
+    for tid, delta in Counter(r[1] for r in deleted).items():
+        by_delta.setdefault(delta, []).append(tid)
+    for delta, tids in by_delta.items():
+        conn.execute(RELEASE_SQL, {'delta': delta, 'tids': tids})
+
+    reopened = conn.execute(REOPEN_SQL, {'pids': sorted({r[0] for r in deleted})}).rowcount
+    bump_version(conn, ASSIGNMENTS_KEY)  # workers drop their cached queues
+    bump_version(conn, COVERAGE_KEY)     # and the allocator reloads its index
+    return len(deleted), reopened
+
+
+def reclaim(session, idle_s, batch=500, dry_run=False):
+    """One pass over every idle participant, committing per batch.
+
+    Returns {'participants', 'assignments', 'slots_reopened', 'journal_rows'};
+    with `dry_run`, the counts that would be reclaimed and nothing is
+    written. While the ingest journal holds rows nothing is reclaimed and
+    'journal_rows' says how many.
+    """
+    now = datetime.utcnow()
+    cutoff = now - timedelta(seconds=idle_s)
+    totals = {'participants': 0, 'assignments': 0, 'slots_reopened': 0, 'journal_rows': journal_depth()}
+    if totals['journal_rows']:
+        return totals
+    after = 0
+    while True:
+        conn = session.connection()
+        idle = idle_participants(conn, cutoff, after, batch)
+        if not idle:
+            break
+        after = idle[-1][0]
+        if dry_run:
+            pids = [pid for pid, _ in idle]
+            released = len(conn.execute(UNANSWERED_SQL, {'pids': pids}).fetchall())
+            reopened = conn.execute(REOPENABLE_SQL, {'pids': pids}).scalar()
+            session.rollback()
+        else:
+            released, reopened = reclaim_batch(conn, idle, now)
+            session.commit()
+        totals['participants'] += len(idle)
+        totals['assignments'] += released
+        totals['slots_reopened'] += reopened
+    return totals
+
+
+def run_forever(app, idle_s, every_s, batch=500, log=print):
+    """Reclaim every `every_s` seconds until interrupted (`--every`)."""
+    from app import db
+    with app.app_context():
+        while True:
+            started = time.monotonic()
+            try:
+                totals = reclaim(db.session, idle_s, batch)
+                stamp = datetime.utcnow().isoformat(timespec='seconds') + 'Z'
+                if totals['journal_rows']:
+                    app.logger.warning('reclaim-assignments: skipped, %d buffered rows not yet written',
+                                       totals['journal_rows'])
+                    log(f"{stamp} skipped: {totals['journal_rows']} buffered rows not yet written")
+                else:
+                    log(f"{stamp} reclaimed {totals['assignments']} assignments from "
+                        f"{totals['participants']} participants, reopened {totals['slots_reopened']} design slots")
+            except Exception:
+                db.session.rollback()
+                app.logger.exception('reclaim-assignments pass failed')
+            finally:
+                db.session.remove()
+            time.sleep(max(0.0, every_s - (time.monotonic() - started)))
@@ -1,245 +1,340 @@
-from flask import render_template, request, jsonify
-from sqlalchemy import func, text
-from app import app, db
-from app.models import Participant, Trial, Assignment, Response, AIEvent
+import gzip
+from datetime import datetime
+from flask import Blueprint, abort, current_app, render_template, request, jsonify
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import AIEvent
+from app.allocator import ASSIGNED_SQL, allocator, duplicate_start, SlotRequest
+from app import trial_queue
+from app.trial_cache import trial_cache
+from app.ingest import BufferFull, buffered, check_refs, event_row, ingest_buffer, response_insert, response_row
+
+bp = Blueprint('study', __name__)
 
 # ---------- Study entry / instructions ----------
-@app.route('/study', methods=['GET'])
+@bp.route('/study', methods=['GET'])
 def study_index():
     return render_template('study_instructions.html')
 
 # ---------- Start: create participant + initial block ----------
-@app.route('/study/start', methods=['POST'])
+@bp.route('/study/start', methods=['POST'])
 def study_start():
     data = request.get_json(force=True)
     condition = (data.get('condition') or 'control').lower()
-    p = Participant(
+    worker_id, assignment_id = data.get('workerId'), data.get('assignmentId')
+    resumable = worker_id is not None and assignment_id is not None
+
+    # a reload or retried start for the same MTurk assignment picks up the
+    # existing participant and whatever is left of its block
+    if resumable:
+        resumed = _resume(worker_id, assignment_id)
+        if resumed is not None:
+            return resumed
+
+    new_participant = dict(
         condition=condition,
-        worker_id=data.get('workerId'),
-        assignment_id=data.get('assignmentId'),
+        worker_id=worker_id,
+        assignment_id=assignment_id,
         hit_id=data.get('hitId'),
+        created_at=datetime.utcnow(),
     )
-    db.session.add(p)
-    db.session.flush()  # p.id now available
-
-    # coverage-first: prefer trials with the lowest assignment count
-    N = app.config.get('STUDY_TRIALS_PER_PARTICIPANT', 10)
-    subq = db.session.query(
-        Trial.id.label('tid'),
-        func.count(Assignment.id).label('cnt')
-    ).outerjoin(
-        Assignment, Trial.id == Assignment.trial_id
-    ).group_by(Trial.id).subquery()
-
-    rows = db.session.query(subq.c.tid, subq.c.cnt).all()
-    if not rows:
+
+    # coverage-first: prefer trials with the lowest assignment count.
+    # The allocator creates the participant and its block in one transaction.
+    N = current_app.config.get('STUDY_TRIALS_PER_PARTICIPANT', 10)
+    try:
+        [(pid, chosen)] = allocator.reserve([SlotRequest(new_participant, N)])
+    except IntegrityError as e:
+        db.session.rollback()
+        if not duplicate_start(e):
+            raise
+        # a concurrent start for the same assignment committed first
+        chosen = None
+    except TimeoutError:
+        # the allocator is backed up; the ticket was abandoned, nothing was written
+        return _busy()
+    if chosen is None and resumable:
+        # duplicate start: the allocator skipped it, or it lost the race above
+        return _resume(worker_id, assignment_id) or _busy()
+    if not chosen:
         return jsonify({'error': 'No trials loaded in DB. Run: flask seed-trials-csv resources/dilemma_combined.csv'}), 400
 
-    min_cnt = min(r.cnt for r in rows)
-    import random
-    candidates = [r.tid for r in rows if r.cnt == min_cnt]
-    random.shuffle(candidates)
-    chosen = candidates[:N] if len(candidates) >= N else list(candidates)
-    if len(chosen) < N:
-        remaining = N - len(chosen)
-        for c in sorted(set(r.cnt for r in rows if r.cnt > min_cnt)):
-            pool = [r.tid for r in rows if r.cnt == c and r.tid not in chosen]
-            random.shuffle(pool)
-            take = min(remaining, len(pool))
-            chosen.extend(pool[:take])
-            remaining = N - len(chosen)
-            if remaining <= 0:
-                break
-
-    for idx, tid in enumerate(chosen):
-        db.session.add(Assignment(participant_id=p.id, trial_id=tid, order_idx=idx))
+    trial_queue.prime(pid, chosen)
+    return jsonify({'participant_id': pid, 'condition': condition, 'n_trials': len(chosen)}), 200
+
+def _resume(worker_id, assignment_id):
+    found = trial_queue.resume(worker_id, assignment_id)
     db.session.commit()
-    return jsonify({'participant_id': p.id, 'condition': condition, 'n_trials': len(chosen)}), 200
+    if found is None:
+        return None
+    pid, condition, tids = found
+    return jsonify({'participant_id': pid, 'condition': condition, 'n_trials': len(tids), 'resumed': True}), 200
 
 # ---------- Next trial ----------
-@app.route('/study/next', methods=['GET'])
+@bp.route('/study/next', methods=['GET'])
 def study_next():
     pid = int(request.args['participant_id'])
-    # find next assigned trial without a response
-    q = text("""
-        SELECT a.trial_id
-        FROM assignment a
-        LEFT JOIN response r ON r.trial_id = a.trial_id AND r.participant_id = a.participant_id
-        WHERE a.participant_id = :pid AND r.id IS NULL
-        ORDER BY a.order_idx ASC
-        LIMIT 1
-    """)
-    row = db.session.execute(q, {'pid': pid}).first()
-    if not row:
+    after = request.args.get('after', type=int)  # trial the client just submitted
+    tid = trial_queue.next_trial(pid, after)
+    entry = trial_cache.get(tid) if tid is not None else None
+    if entry is None:
         return ('', 204)
-    trial = Trial.query.get(row[0])
-    return jsonify({'trial_id': trial.id, 'payload': trial.payload})
+    # same bytes jsonify would produce, with the payload encoded once per worker
+    body = b'{"payload":%s,"trial_id":%d}\n' % (entry.payload_json, tid)
+    return current_app.response_class(body, mimetype='application/json')
+
+# ---------- Whole remaining block in one response ----------
+@bp.route('/study/block', methods=['GET'])
+def study_block():
+    """
+    GET /study/block?participant_id=..[&after=trial_id]
+    All of the participant's remaining trials, in order, gzipped when the
+    client accepts it, so the run page never waits on the network between trials.
+    """
+    pid = int(request.args['participant_id'])
+    after = request.args.get('after', type=int)
+    tids = trial_queue.remaining(pid, after)
+    entries = trial_cache.get_many(tids)
+    trials = b','.join(b'{"order":%d,"payload":%s,"trial_id":%d}' % (i, entries[tid].payload_json, tid)
+                       for i, tid in enumerate(t for t in tids if t in entries))
+    body = b'{"participant_id":%d,"trials":[%s]}\n' % (pid, trials)
+    resp = current_app.response_class(body, mimetype='application/json')
+    resp.headers['Cache-Control'] = 'no-store'
+    return _gzipped(resp)
+
+def _gzipped(resp):
+    resp.vary.add('Accept-Encoding')
+    if 'gzip' not in request.accept_encodings or resp.content_length is None or resp.content_length < 512:
+        return resp
+    resp.set_data(gzip.compress(resp.get_data(), compresslevel=6))
+    resp.headers['Content-Encoding'] = 'gzip'
+    return resp
 
 # ---------- Submit response (LOG ai_confidence here) ----------
-@app.route('/study/submit', methods=['POST'])
+@bp.route('/study/submit', methods=['POST'])
 def study_submit():
     d = request.get_json(force=True)
     # answer is stored as JSON in your model; keep that behavior
-    r = Response(
-        participant_id=int(d['participant_id']),
-        trial_id=int(d['trial_id']),
-        answer=d.get('answer'),
-        correct=None,
-        rt_ms=int(d.get('rt_ms') or 0),
-        revealed_ai=bool(d.get('revealed_ai', False)),
-        ai_confidence=(float(d.get('ai_confidence')) if d.get('ai_confidence') is not None else None)  # <-- fixed
-    )
-    db.session.add(r)
+    try:
+        row = response_row(d)
+    except (KeyError, TypeError, ValueError) as e:
+        return _bad(e)
+    if buffered():
+        return _enqueue('response', row)
+    # a retried submit for the same trial is acknowledged but not stored twice
+    inserted = db.session.execute(response_insert(), row).rowcount
     db.session.commit()
-    return jsonify({'ok': True})
+    return jsonify({'ok': True, 'duplicate': not inserted})
 
 # ---------- Log AI UI events ----------
-@app.route('/study/event', methods=['POST'])
+@bp.route('/study/event', methods=['POST'])
 def study_event():
     d = request.get_json(force=True)
-    e = AIEvent(
-        participant_id=int(d['participant_id']),
-        trial_id=int(d['trial_id']),
-        event_type=d.get('event_type'),
-        payload=d.get('payload')
-    )
-    db.session.add(e)
+    try:
+        row = event_row(d)
+    except (KeyError, TypeError, ValueError) as e:
+        return _bad(e)
+    if buffered():
+        return _enqueue('event', row)
+    db.session.add(AIEvent(**row))
     db.session.commit()
     return jsonify({'ok': True})
 
+# ---------- Log a batch of AI UI events (client beacon) ----------
+@bp.route('/study/events', methods=['POST'])
+def study_events():
+    """
+    POST /study/events with {"events": [{participant_id, trial_id, event_type, payload}, ...]}
+    (or a bare list). Sent by navigator.sendBeacon, so the body may arrive as text/plain.
+    """
+    d = request.get_json(force=True, silent=True)
+    items = d.get('events') if isinstance(d, dict) else d
+    if not isinstance(items, list):
+        return jsonify({'ok': False, 'error': 'expected a list of events'}), 400
+    try:
+        rows = [event_row(e) for e in items]
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'ok': False, 'error': 'bad event'}), 400
+    if not rows:
+        return jsonify({'ok': True, 'count': 0})
+    if buffered():
+        try:
+            check_refs(rows)
+            ingest_buffer.enqueue_many('event', rows)
+        except ValueError:
+            return jsonify({'ok': False, 'error': 'bad event'}), 400
+        except BufferFull:
+            return _busy()
+        return jsonify({'ok': True, 'queued': True, 'count': len(rows)}), 202
+    db.session.execute(insert(AIEvent), rows)
+    db.session.commit()
+    return jsonify({'ok': True, 'count': len(rows)})
+
+def _busy():
+    retry_after = current_app.config.get('STUDY_INGEST_RETRY_AFTER_S', 2)
+    resp = jsonify({'ok': False, 'error': 'busy', 'retry_after': retry_after})
+    resp.headers['Retry-After'] = str(retry_after)
+    return resp, 429
+
+def _bad(e):
+    return jsonify({'ok': False, 'error': str(e) if isinstance(e, ValueError) else 'bad request'}), 400
+
+def _enqueue(kind, row):
+    """Hand a validated row to the write-behind buffer, or push back."""
+    try:
+        check_refs([row])
+        ingest_buffer.enqueue(kind, row)
+    except ValueError as e:
+        return _bad(e)
+    except BufferFull:
+        return _busy()
+    return jsonify({'ok': True, 'queued': True}), 202
+
 # ---------- Run + Finish screens ----------
-@app.route('/study/run', methods=['GET'])
+@bp.route('/study/run', methods=['GET'])
 def study_run():
     return render_template('study_run.html')
 
-@app.route('/study/finish', methods=['GET'])
+@bp.route('/study/finish', methods=['GET'])
 def study_finish():
     return render_template('study_finish.html')
 
 # ---------- Export ----------
-from io import StringIO
-import csv
-from flask import Response as FlaskResponse, jsonify
-from app.models import Response as RespModel, Participant as PartModel, Trial as TrialModel
+from flask import Response as FlaskResponse, stream_with_context
+from app import export
+
+EXPORT_FORMATS = {
+    'csv': (export.stream_csv, 'text/csv', 'study_export.csv'),
+    'json': (export.stream_json, 'application/json', None),
+    'ndjson': (export.stream_ndjson, 'application/x-ndjson', 'study_export.ndjson'),
+}
 
-@app.route('/study/export', methods=['GET'])
+@bp.route('/study/export', methods=['GET'])
 def study_export():
     """
-    GET /study/export?format=csv|json
-    Exports one row per response with GT/AI fields from the trial payload.
+    GET /study/export?format=csv|json|ndjson|parquet|arrow[&since_id=N][&since=ISO-8601]
+    csv/json/ndjson: one row per response with GT/AI fields from the trial
+    payload, streamed from a server-side cursor.
+    parquet/arrow: a zip of responses + trials tables (see app/export.py).
+
+    X-Next-Since-Id carries the cursor for the next incremental poll; it lags
+    new responses by STUDY_EXPORT_SETTLE_S so none is skipped (app/export.py).
+    Only incremental polls stop at that cursor; a full export has every
+    committed response.
+    `since` compares against the time a response was stored. ETag and
+    Last-Modified follow the cursor and the trials version (re-seeds and
+    import-ai-confidence change exported fields), so an unchanged poll gets
+    a 304 without running the export query.
     """
     fmt = (request.args.get('format') or 'csv').lower()
+    since_id = request.args.get('since_id', type=int)
+    since = request.args.get('since') or None
+    if since:
+        try:
+            since = datetime.fromisoformat(since.replace('Z', '+00:00')).replace(tzinfo=None)
+        except ValueError:
+            return jsonify({'error': 'since must be an ISO-8601 timestamp'}), 400
 
-    q = (db.session.query(RespModel, PartModel, TrialModel)
-         .join(PartModel, PartModel.id == RespModel.participant_id)
-         .join(TrialModel, TrialModel.id == RespModel.trial_id)
-         .order_by(RespModel.id.asc()))
-
-    rows = []
-    for r, p, t in q.all():
-        payload = t.payload or {}
-        ans_val = (r.answer or {}).get("value") if isinstance(r.answer, dict) else None
-        # pick the logged confidence when available; otherwise fall back to trial-level/payload
-        ai_conf = r.ai_confidence
-        if ai_conf is None:
-            ai_conf = payload.get("ai_confidence")
-        if ai_conf is None and hasattr(t, "ai_confidence"):
-            ai_conf = t.ai_confidence
-
-        rows.append({
-            "response_id": r.id,
-            "participant_id": r.participant_id,
-            "condition": p.condition,
-            "trial_id": r.trial_id,
-            "answer_value": ans_val,
-            "rt_ms": r.rt_ms,
-            "revealed_ai": bool(r.revealed_ai),
-            "gt_severity_score": payload.get("gt_severity_score"),
-            "gt_justification": payload.get("gt_justification"),
-            "ai_severity_score": payload.get("ai_severity_score"),
-            "ai_justification": payload.get("ai_justification"),
-            "ai_confidence": ai_conf,  # <-- now exported
-            "dilemma_text": (payload.get("dilemma_text") or "").replace("\n", " ").strip(),
-        })
-
-    if fmt == "json":
-        return jsonify(rows)
-
-    # include ai_confidence in CSV headers
-    headers = [
-        "response_id","participant_id","condition","trial_id",
-        "answer_value","rt_ms","revealed_ai",
-        "gt_severity_score","gt_justification",
-        "ai_severity_score","ai_justification","ai_confidence",
-        "dilemma_text"
-    ]
-    sio = StringIO()
-    w = csv.DictWriter(sio, fieldnames=headers, extrasaction="ignore")
-    w.writeheader()
-    w.writerows(rows)
-    return FlaskResponse(
-        sio.getvalue(),
-        mimetype="text/csv",
-        headers={"Content-Disposition": "attachment; filename=study_export.csv"}
-    )
+    incremental = since_id is not None or since is not None
+    cursor, newest, last_modified, trials_version = export.snapshot(incremental)
+    etag = f"{fmt}-{newest}-t{trials_version}-{since_id or ''}-{request.args.get('since') or ''}"
+    if request.if_none_match.contains_weak(etag) or (
+            not request.if_none_match and last_modified and request.if_modified_since
+            and last_modified.replace(microsecond=0) <= request.if_modified_since.replace(tzinfo=None)):
+        resp = FlaskResponse(status=304)
+    else:
+        window = dict(since_id=since_id, since=since, upto_id=cursor if incremental else None)
+        if fmt in export.COLUMNAR_FORMATS:
+            try:
+                body = export.columnar_zip(fmt, **window)
+            except RuntimeError as e:
+                return jsonify({'error': str(e)}), 501
+            resp = FlaskResponse(
+                body,
+                mimetype="application/zip",
+                headers={"Content-Disposition": f"attachment; filename=study_export_{fmt}.zip"},
+            )
+        else:
+            writer, mimetype, filename = EXPORT_FORMATS.get(fmt, EXPORT_FORMATS['csv'])
+            headers = {"Content-Disposition": f"attachment; filename={filename}"} if filename else {}
+            resp = FlaskResponse(
+                stream_with_context(writer(export.iter_rows(**window))),
+                mimetype=mimetype,
+                headers=headers,
+            )
+    resp.set_etag(etag, weak=True)
+    if last_modified:
+        resp.last_modified = last_modified
+    resp.headers['X-Next-Since-Id'] = str(max(cursor, since_id or 0))
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
+
+# ---------- Live accuracy stats ----------
+from app import stats as study_stats
+
+@bp.route('/study/stats', methods=['GET'])
+def study_stats_view():
+    """
+    GET /study/stats
+    MAE, signed bias, RT percentiles, AI-reveal rate and AI agreement,
+    by condition and by (trial, condition). Cached per worker; see app/stats.py.
+    """
+    result = study_stats.cached()
+    etag = f"stats-{result['as_of_response_id']}-t{result['trials_version']}"
+    if request.if_none_match.contains_weak(etag):
+        resp = FlaskResponse(status=304)
+    else:
+        resp = jsonify(result)
+    resp.set_etag(etag, weak=True)
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
+
+# ---------- Connection pool metrics (this worker) ----------
+from app.admin import require_admin
+from app.pool import pool_stats
+
+@bp.route('/study/pool', methods=['GET'])
+def study_pool():
+    """Checkout wait times and saturation of this worker's DB pool; see app/pool.py.
+
+    Needs the admin token when STUDY_ADMIN_TOKEN is set.
+    """
+    require_admin()
+    stats = pool_stats()
+    stats['options'] = {k: (v.__name__ if isinstance(v, type) else v)
+                        for k, v in current_app.config['SQLALCHEMY_ENGINE_OPTIONS'].items()}
+    return jsonify(stats)
 
 # ---------- Extend block ----------
-@app.route('/study/extend', methods=['POST'])
+@bp.route('/study/extend', methods=['POST'])
 def study_extend():
     """Assign another block of N trials to an existing participant."""
     data = request.get_json(force=True)
     pid = int(data['participant_id'])
 
-    N = app.config.get('STUDY_TRIALS_PER_PARTICIPANT', 10)
+    N = current_app.config.get('STUDY_TRIALS_PER_PARTICIPANT', 10)
 
-    rows = db.session.execute(text("""
-        WITH assigned_to_participant AS (
-            SELECT trial_id FROM assignment WHERE participant_id = :pid
-        )
-        SELECT t.id AS tid, COALESCE(COUNT(a.id), 0) AS cnt
-        FROM trial t
-        LEFT JOIN assignment a ON a.trial_id = t.id
-        WHERE t.id NOT IN (SELECT trial_id FROM assigned_to_participant)
-        GROUP BY t.id
-    """), {'pid': pid}).fetchall()
+    assigned = db.session.execute(ASSIGNED_SQL, {'pid': pid}).fetchall()
+    start_idx = max((r.order_idx or 0 for r in assigned), default=-1) + 1
+    db.session.commit()  # release the read before handing off to the allocator
 
-    if not rows:
+    req = SlotRequest(pid, N, exclude=[r.trial_id for r in assigned], start_idx=start_idx)
+    try:
+        [(_, chosen)] = allocator.reserve([req])
+    except TimeoutError:
+        return _busy()
+    if not chosen:
         return jsonify({'ok': False, 'error': 'no-unassigned-trials'}), 400
 
-    import random
-    min_cnt = min(r.cnt for r in rows) if rows else 0
-    candidates = [r.tid for r in rows if r.cnt == min_cnt]
-    random.shuffle(candidates)
-    chosen = candidates[:N] if len(candidates) >= N else list(candidates)
-    if len(chosen) < N:
-        remaining = N - len(chosen)
-        for c in sorted({r.cnt for r in rows if r.cnt > min_cnt}):
-            pool = [r.tid for r in rows if r.cnt == c and r.tid not in chosen]
-            random.shuffle(pool)
-            take = min(remaining, len(pool))
-            chosen.extend(pool[:take])
-            remaining = N - len(chosen)
-            if remaining <= 0:
-                break
-
-    max_ord = db.session.execute(text("""
-        SELECT COALESCE(MAX(order_idx), -1) FROM assignment WHERE participant_id = :pid
-    """), {'pid': pid}).scalar()
-    start_idx = (max_ord + 1) if max_ord is not None else 0
-
-    for i, tid in enumerate(chosen):
-        db.session.add(Assignment(participant_id=pid, trial_id=tid, order_idx=start_idx + i))
-    db.session.commit()
-
+    trial_queue.materialize(pid)
     return jsonify({'ok': True, 'added': len(chosen)})
 
 # ---------- AI suggestion payload (includes confidence) ----------
-@app.get('/api/trials/<int:trial_id>/ai')
+@bp.get('/api/trials/<int:trial_id>/ai')
 def api_trial_ai(trial_id):
-    trial = Trial.query.get_or_404(trial_id)
-    payload = {
-        "ai_score": int(trial.ai_severity_score),
-        "ai_justification": trial.ai_justification or "",
-        "ai_confidence": (trial.ai_confidence if hasattr(trial, "ai_confidence") and trial.ai_confidence is not None else 0.75)
-    }
-    return jsonify(payload)
+    entry = trial_cache.get(trial_id)
+    if entry is None:
+        abort(404)
+    # ai_score / ai_justification from the payload; ai_confidence defaults to 0.75
+    return current_app.response_class(entry.ai_json, mimetype='application/json')
@@ -0,0 +1,162 @@
+"""
+Streaming, idempotent trial seeding for `flask seed-trials` / `seed-trials-csv`.
+
+Input is read a chunk at a time (a JSON array is decoded element by element,
+CSV goes through pandas' chunked reader) and each chunk is written with one
+executemany upsert keyed on Trial.content_hash. Re-running a seed command
+therefore inserts new dilemmas and refreshes changed ones in place, without
+touching trial ids, assignments or responses.
+"""
+import hashlib
+import json
+from itertools import islice
+
+from sqlalchemy import insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import db
+from app.coverage import ensure_counters
+from app.models import Trial
+from app.stats import trial_scores
+from app.trial_cache import bump_version
+
+CHUNK_ROWS = 1000
+# refreshed on re-seed; ai_confidence is owned by import-ai-confidence
+UPDATE_COLUMNS = ('payload', 'split', 'gt_severity_score', 'ai_severity_score')
+
+_UPSERT_INSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+def content_hash(payload):
+    """sha256 of the dilemma text (whitespace-normalised), else of the whole payload."""
+    text = payload.get('dilemma_text')
+    if text is not None:
+        key = ' '.join(str(text).split())
+    else:
+        key = json.dumps(payload, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def trial_row(payload, split=None):
+    """Column values for a Trial built from `payload`."""
+    return dict(
+        payload=payload,
+        split=split or payload.get('split', 'all'),
+        content_hash=content_hash(payload),
+        **trial_scores(payload),
+    )
+
+
+def iter_json_items(fh, block=1 << 16):
+    """Objects from a JSON array (or JSON Lines) file, decoded one at a time."""
+    decoder = json.JSONDecoder()
+    buf = fh.read(block).lstrip()
+    in_array = buf.startswith('[')
+    if in_array:
+        buf = buf[1:]
+    eof = False
+    while True:
+        buf = buf.lstrip()
+        if in_array and buf.startswith(','):
+            buf = buf[1:].lstrip()
+        if in_array and buf.startswith(']'):
+            return
+        try:
+            if not buf:
+                raise ValueError('need more input')
+            obj, end = decoder.raw_decode(buf)
+        except ValueError:
+            if eof:
+                if buf:
+                    raise
+                return
+            more = fh.read(block)
+            eof = not more
+            buf += more
+            continue
+        yield obj
+        buf = buf[end:]
+
+
+def chunked(iterable, n=CHUNK_ROWS):
+    it = iter(iterable)
+    while True:
+        chunk = list(islice(it, n))
+        if not chunk:
+            return
+        yield chunk
+
+
+def upsert_trials(rows):
+    """Insert-or-refresh one chunk of trial rows; returns (inserted, updated)."""
+    by_hash = {r['content_hash']: r for r in rows}  # last duplicate in a chunk wins
+    rows = list(by_hash.values())
+    existing = set(db.session.execute(
+        select(Trial.content_hash).where(Trial.content_hash.in_(list(by_hash)))
+    ).scalars())
+    table = Trial.__table__
+    make = _UPSERT_INSERTS.get(db.engine.dialect.name)
+    if make is None:
+        new = [r for r in rows if r['content_hash'] not in existing]
+        if new:
+            db.session.execute(insert(table), new)
+        return len(new), 0
+    stmt = make(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['content_hash'],
+        set_={c: stmt.excluded[c] for c in UPDATE_COLUMNS},
+    )
+    db.session.execute(stmt, rows)
+    return len(rows) - len(existing), len(existing)
+
+
+def seed(rows, chunk_rows=CHUNK_ROWS):
+    """Upsert an iterable of trial rows chunk by chunk; returns (inserted, updated)."""
+    inserted = updated = 0
+    for chunk in chunked(rows, chunk_rows):
+        i, u = upsert_trials(chunk)
+        if i or u:
+            bump_version()  # workers' trial caches are stale
+        db.session.commit()
+        inserted += i
+        updated += u
+    ensure_counters(force=True)  # trial_coverage rows for the new trials
+    db.session.commit()
+    return inserted, updated
+
+
+def json_rows(path):
+    with open(path, 'r', encoding='utf-8') as fh:
+        for obj in iter_json_items(fh):
+            yield trial_row(obj)
+
+
+def csv_rows(path, chunk_rows=CHUNK_ROWS):
+    """Trial rows from the dilemma CSV, parsed chunk by chunk with pandas.
+
+    Columns: dilemma_text, gt_severity_score, gt_justification,
+    ai_severity_score, ai_justification.
+    """
+    import pandas as pd
+
+    for df in pd.read_csv(path, chunksize=chunk_rows):
+        n = len(df)
+
+        def text_col(name):
+            if name not in df:
+                return [''] * n
+            return df[name].fillna('').astype(str).tolist()
+
+        ai = (pd.to_numeric(df['ai_severity_score'], errors='coerce').tolist()
+              if 'ai_severity_score' in df else [None] * n)
+        for text, gt, gt_just, ai_score, ai_just in zip(
+                df['dilemma_text'].astype(str).tolist(),
+                df['gt_severity_score'].astype(int).tolist(),
+                text_col('gt_justification'), ai, text_col('ai_justification')):
+            yield trial_row({
+                "dilemma_text": text,
+                "gt_severity_score": gt,
+                "gt_justification": gt_just,
+                "ai_severity_score": None if ai_score is None or pd.isna(ai_score) else int(ai_score),
+                "ai_justification": ai_just,
+            }, split='all')
@@ -0,0 +1,216 @@
+"""
+Slow-query capture.
+
+When a request takes longer than STUDY_SLOW_QUERY_MS, its slowest SQL
+statement is logged with the route, the request and statement durations and
+its bind parameters (strings redacted to their length unless
+STUDY_SLOW_QUERY_REDACT=0). Outside requests any single statement over the
+threshold is captured under route "<background>". Statements are timed by
+the cursor hooks in app/metrics.py (see on_statement).
+
+A background thread then asks the database for the statement's plan
+(EXPLAIN QUERY PLAN on SQLite, EXPLAIN on Postgres; neither executes it),
+reusing a plan for the same SQL for STUDY_SLOW_QUERY_EXPLAIN_TTL_S, and adds
+the entry to a ring buffer of the last STUDY_SLOW_QUERY_BUFFER captures. Each
+worker persists its ring as STUDY_SLOW_QUERY_DIR/slow-<pid>.json, so
+`flask slow-queries` and GET /study/admin/slow-queries see every worker's
+captures, including from workers that have since exited.
+"""
+import glob
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from flask import Blueprint, current_app, g, has_request_context, jsonify, request
+
+from app.admin import require_admin
+from app.metrics import on_statement
+
+BACKGROUND = '<background>'
+EXPLAIN = {'sqlite': 'EXPLAIN QUERY PLAN ', 'postgresql': 'EXPLAIN '}
+EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+
+_local = threading.local()  # .explaining: skip our own EXPLAIN statements
+
+bp = Blueprint('slowlog', __name__)
+
+
+def redact(params):
+    """Bind parameters with string/bytes values replaced by their type and length."""
+
+    def one(v):
+        if isinstance(v, (str, bytes)):
+            return f'<{type(v).__name__} len={len(v)}>'
+        if isinstance(v, (list, tuple)):
+            return [one(x) for x in v]
+        if isinstance(v, dict):
+            return {k: one(x) for k, x in v.items()}
+        if v is None or isinstance(v, (bool, int, float)):
+            return v
+        return f'<{type(v).__name__}>'
+    return one(params)
+
+
+class SlowLog:
+    def __init__(self):
+        self.app = None
+        self.threshold_s = None
+        self.redact = True
+        self._ring = None
+        self._queue = queue.Queue(maxsize=100)
+        self._thread = None
+        self._plans = {}  # statement -> (explained_at, plan lines)
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.threshold_s = app.config.get('STUDY_SLOW_QUERY_MS', 500) / 1000.0
+        self.redact = app.config.get('STUDY_SLOW_QUERY_REDACT', True)
+        self._ring = deque(maxlen=app.config.get('STUDY_SLOW_QUERY_BUFFER', 100))
+
+    def directory(self):
+        app = self.app or current_app
+        return app.config.get('STUDY_SLOW_QUERY_DIR') or os.path.join(app.instance_path, 'slow_queries')
+
+    def capture(self, engine, entry, statement, parameters):
+        """Queue a capture for EXPLAIN + storage; dropped if the explainer is backed up."""
+        self.app.logger.warning('slow query on %s: %.0f ms (request %.0f ms): %s',
+                           entry['route'], entry['statement_ms'], entry['request_ms'] or 0,
+                           ' '.join(statement.split())[:300])
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='slow-query-explainer', daemon=True)
+                self._thread.start()
+        try:
+            self._queue.put_nowait((engine, entry, statement, parameters))
+        except queue.Full:
+            pass
+
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                engine, entry, statement, parameters = self._queue.get()
+                try:
+                    entry['explain'] = self._explain(engine, statement, parameters)
+                except Exception as exc:
+                    entry['explain'] = None
+                    entry['explain_error'] = repr(exc)[:300]
+                self._ring.append(entry)
+                self._persist()
+
+    def _explain(self, engine, statement, parameters):
+        prefix = EXPLAIN.get(engine.dialect.name)
+        if prefix is None or not statement.lstrip().upper().startswith(EXPLAINABLE):
+            return None
+        ttl = self.app.config.get('STUDY_SLOW_QUERY_EXPLAIN_TTL_S', 300)
+        cached = self._plans.get(statement)
+        if cached and time.monotonic() - cached[0] < ttl:
+            return cached[1]
+        _local.explaining = True
+        try:
+            with engine.connect() as conn:
+                rows = conn.exec_driver_sql(prefix + statement, parameters).fetchall()
+                conn.rollback()
+        finally:
+            _local.explaining = False
+        if engine.dialect.name == 'sqlite':  # (id, parent, notused, detail)
+            plan = [r[-1] for r in rows]
+        else:
+            plan = [r[0] for r in rows]
+        self._plans[statement] = (time.monotonic(), plan)
+        return plan
+
+    def _persist(self):
+        directory = self.directory()
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'slow-{os.getpid()}.json')
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(list(self._ring), f, default=str)
+        os.replace(tmp, path)
+
+    def recent(self, limit=50):
+        """Newest captures first, across every worker's file."""
+        entries = []
+        for path in glob.glob(os.path.join(self.directory(), 'slow-*.json')):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    entries.extend(json.load(f))
+            except (OSError, ValueError):
+                continue
+        entries.sort(key=lambda e: e['at'], reverse=True)
+        return entries[:limit]
+
+    def clear(self):
+        for path in glob.glob(os.path.join(self.directory(), 'slow-*.json')):
+            os.remove(path)
+        if self._ring is not None:
+            self._ring.clear()
+
+
+slowlog = SlowLog()
+bp.record_once(lambda state: slowlog.init_app(state.app))
+
+
+def _entry(route, method, request_s, statement_s, statement, params, executemany):
+    return {
+        'at': datetime.utcnow().isoformat(timespec='milliseconds') + 'Z',
+        'pid': os.getpid(),
+        'route': route,
+        'method': method,
+        'request_ms': None if request_s is None else round(request_s * 1000, 1),
+        'statement_ms': round(statement_s * 1000, 1),
+        'statement': statement,
+        'params': redact(params) if slowlog.redact else params,
+        'executemany': executemany,
+    }
+
+
+# ---------- Hooks ----------
+@on_statement  # timed by app/metrics.py's cursor hooks
+def _observe_statement(conn, statement, parameters, executemany, elapsed):
+    if slowlog.app is None or getattr(_local, 'explaining', False):
+        return
+    if has_request_context():
+        slowest = g.get('_slowest')
+        if slowest is None or elapsed > slowest[0]:
+            g._slowest = (elapsed, conn.engine, statement, parameters, executemany)
+    elif elapsed >= slowlog.threshold_s:
+        params = parameters[0] if executemany and parameters else parameters
+        slowlog.capture(conn.engine, _entry(BACKGROUND, None, None, elapsed, statement, params, executemany),
+                        statement, params)
+
+
+@bp.before_app_request
+def _start_request():
+    g._slowlog_t0 = time.perf_counter()
+
+
+@bp.teardown_app_request
+def _finish_request(exc):
+    t0 = g.pop('_slowlog_t0', None)
+    slowest = g.pop('_slowest', None)
+    if t0 is None or slowest is None:
+        return
+    elapsed = time.perf_counter() - t0
+    if elapsed < slowlog.threshold_s:
+        return
+    statement_s, engine, statement, parameters, executemany = slowest
+    route = request.url_rule.rule if request.url_rule else '<unmatched>'
+    params = parameters[0] if executemany and parameters else parameters
+    slowlog.capture(engine, _entry(route, request.method, elapsed, statement_s, statement, params,
+                                   executemany), statement, params)
+
+
+# ---------- Admin view ----------
+@bp.route('/study/admin/slow-queries', methods=['GET'])
+def study_slow_queries():
+    """Recent slow-query captures from every worker. Needs the admin token when STUDY_ADMIN_TOKEN is set."""
+    require_admin()
+    limit = request.args.get('limit', 50, type=int)
+    return jsonify({'threshold_ms': current_app.config.get('STUDY_SLOW_QUERY_MS', 500),
+                    'queries': slowlog.recent(limit)})
@@ -0,0 +1,165 @@
+"""
+Study accuracy statistics for /study/stats and `flask study-stats`.
+
+Everything is computed in SQL over the typed score columns
+(Response.answer_value, Trial.gt_severity_score / ai_severity_score), so
+the same queries run on SQLite and Postgres and never parse JSON per row.
+RT percentiles are nearest-rank, picked with window functions so only a
+handful of rows per group come back.
+
+Results are cached per worker and keyed on the newest response id and the
+trials cache_version (a re-seed or import-ai-confidence changes GT/AI
+scores): repeated reads while a study runs cost two primary-key lookups,
+and the aggregates are recomputed at most every STUDY_STATS_TTL_S seconds.
+"""
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import text
+
+from app import db
+from app.trial_cache import VERSION_KEY
+
+PERCENTILES = (50, 90, 95)
+
+# group key expressions; the values are fixed strings, never user input
+GROUPS = {
+    'condition': ('p.condition',),
+    'trial': ('r.trial_id', 'p.condition'),
+}
+
+
+def _int(v):
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return None
+
+
+def answer_value(answer):
+    """The typed Response.answer_value for an answer like {"value": 3}."""
+    return _int(answer.get('value')) if isinstance(answer, dict) else None
+
+
+def trial_scores(payload):
+    """Typed Trial score columns from a trial payload."""
+    payload = payload or {}
+    return {
+        'gt_severity_score': _int(payload.get('gt_severity_score')),
+        'ai_severity_score': _int(payload.get('ai_severity_score')),
+    }
+
+
+def _float(v):
+    return float(v) if v is not None else None
+
+
+def _aggregates(conn, keys):
+    cols = ', '.join(keys)
+    rows = conn.execute(text(f"""
+        SELECT {cols},
+               COUNT(*) AS n,
+               COUNT(DISTINCT r.participant_id) AS n_participants,
+               AVG(ABS(r.answer_value - t.gt_severity_score)) AS mae,
+               AVG(r.answer_value - t.gt_severity_score) AS bias,
+               AVG(CASE WHEN r.revealed_ai THEN 1.0 ELSE 0.0 END) AS reveal_rate,
+               AVG(CASE WHEN t.ai_severity_score IS NULL THEN NULL
+                        WHEN r.answer_value = t.ai_severity_score THEN 1.0
+                        ELSE 0.0 END) AS ai_agreement
+        FROM response r
+        JOIN participant p ON p.id = r.participant_id
+        JOIN trial t ON t.id = r.trial_id
+        WHERE r.answer_value IS NOT NULL
+        GROUP BY {cols}
+        ORDER BY {cols}
+    """)).mappings().all()
+    out = {}
+    for row in rows:
+        key = tuple(row[k.split('.')[1]] for k in keys)
+        out[key] = {
+            'n': row['n'],
+            'n_participants': row['n_participants'],
+            'mae': _float(row['mae']),
+            'bias': _float(row['bias']),
+            'reveal_rate': _float(row['reveal_rate']),
+            'ai_agreement': _float(row['ai_agreement']),
+            'rt_ms': {f'p{q}': None for q in PERCENTILES},
+        }
+    return out
+
+
+def _rt_percentiles(conn, keys):
+    """{group key: {q: rt_ms}} using nearest rank: row ceil(q/100 * n)."""
+    cols = ', '.join(keys)
+    names = [k.split('.')[1] for k in keys]
+    # integer arithmetic stands in for CEIL, which SQLite may not have
+    ranks = ' OR '.join(f'rn = (cnt * {q} + 99) / 100' for q in PERCENTILES)
+    rows = conn.execute(text(f"""
+        SELECT {', '.join(names)}, rn, cnt, rt_ms FROM (
+            SELECT {cols}, r.rt_ms,
+                   ROW_NUMBER() OVER (PARTITION BY {cols} ORDER BY r.rt_ms) AS rn,
+                   COUNT(*) OVER (PARTITION BY {cols}) AS cnt
+            FROM response r
+            JOIN participant p ON p.id = r.participant_id
+            JOIN trial t ON t.id = r.trial_id
+            WHERE r.answer_value IS NOT NULL AND r.rt_ms IS NOT NULL
+        ) ranked
+        WHERE {ranks}
+    """)).mappings().all()
+    out = {}
+    for row in rows:
+        key = tuple(row[n] for n in names)
+        for q in PERCENTILES:
+            if row['rn'] == (row['cnt'] * q + 99) // 100:
+                out.setdefault(key, {})[q] = row['rt_ms']
+    return out
+
+
+# newest response: the as-of marker and the cache check; served by the primary key
+AS_OF_SQL = text("SELECT MAX(id) FROM response")
+
+
+def _cache_key(conn):
+    """(newest response id, trials cache_version) the stats were computed at."""
+    as_of = conn.execute(AS_OF_SQL).scalar() or 0
+    trials = conn.execute(text(
+        "SELECT version FROM cache_version WHERE name = :name"
+    ), {'name': VERSION_KEY}).scalar() or 0
+    return as_of, trials
+
+
+def compute(groups=('condition', 'trial')):
+    """Fresh stats straight from the database."""
+    conn = db.session.connection()
+    as_of, trials = _cache_key(conn)
+    result = {'as_of_response_id': as_of, 'trials_version': trials,
+              'computed_at': datetime.utcnow().isoformat()}
+    for group in groups:
+        keys = GROUPS[group]
+        stats = _aggregates(conn, keys)
+        for key, pcts in _rt_percentiles(conn, keys).items():
+            if key in stats:
+                stats[key]['rt_ms'].update({f'p{q}': v for q, v in pcts.items()})
+        names = [k.split('.')[1] for k in keys]
+        result[f'by_{group}'] = [dict(zip(names, key), **s) for key, s in stats.items()]
+    return result
+
+
+_cache = {'key': None, 'checked_at': 0.0, 'value': None}
+_cache_lock = threading.Lock()
+
+
+def cached():
+    """compute(), reused until responses or trials change and the TTL has passed."""
+    ttl = current_app.config.get('STUDY_STATS_TTL_S', 10)
+    with _cache_lock:
+        if _cache['value'] is not None and time.monotonic() - _cache['checked_at'] < ttl:
+            return _cache['value']
+        key = _cache_key(db.session)
+        if _cache['value'] is None or key != _cache['key']:
+            _cache['value'] = compute()
+            _cache['key'] = (_cache['value']['as_of_response_id'], _cache['value']['trials_version'])
+        _cache['checked_at'] = time.monotonic()
+        return _cache['value']
@@ -0,0 +1,120 @@
+"""
+Per-worker cache of trial payloads, pre-encoded as JSON bytes.
+
+Trials don't change while a study runs, so /study/next, /study/block,
+/study/export and /api/trials/<id>/ai read them from here: serving a payload
+is a dict lookup plus a byte write, with no query and no re-serialisation.
+
+Entries are loaded lazily (one IN query for whatever is missing). Anything
+that rewrites trials (seed-trials*, import-ai-confidence) calls
+bump_version() in the same transaction; each worker compares the stored
+version at most every STUDY_TRIAL_CACHE_TTL_S seconds and drops its entries
+when it moved.
+"""
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import select, text
+
+from app import db
+from app.models import Trial
+
+VERSION_KEY = 'trials'
+
+# payload: the decoded dict; payload_json / ai_json: bytes ready to send
+TrialEntry = namedtuple('TrialEntry', 'trial_id payload payload_json ai_confidence ai_json')
+
+
+def bump_version(session=None, name=VERSION_KEY):
+    """Invalidate every worker's trial cache (call inside the writing transaction).
+
+    Other per-worker caches keep their own counter under another `name`.
+    """
+    session = session or db.session
+    params = {'name': name, 'now': datetime.utcnow()}
+    bumped = session.execute(text(
+        "UPDATE cache_version SET version = version + 1, updated_at = :now WHERE name = :name"
+    ), params).rowcount
+    if not bumped:
+        session.execute(text(
+            "INSERT INTO cache_version (name, version, updated_at) VALUES (:name, 1, :now)"
+        ), params)
+
+
+def _entry(tid, payload, trial_conf):
+    def dumps(obj):  # compact and key-sorted, like jsonify
+        return current_app.json.dumps(obj, separators=(',', ':'))
+    payload = payload or {}
+    conf = trial_conf if trial_conf is not None else payload.get('ai_confidence')
+    ai = {
+        'ai_score': payload.get('ai_severity_score'),
+        'ai_justification': payload.get('ai_justification') or '',
+        'ai_confidence': conf if conf is not None else 0.75,
+    }
+    return TrialEntry(tid, payload, dumps(payload).encode(), trial_conf, (dumps(ai) + '\n').encode())
+
+
+class TrialCache:
+    def __init__(self):
+        self._entries = {}
+        self._complete = False  # every trial loaded (for exports)
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _check_version(self):
+        ttl = current_app.config.get('STUDY_TRIAL_CACHE_TTL_S', 5.0)
+        now = time.monotonic()
+        if now - self._checked_at < ttl:
+            return
+        version = db.session.execute(text(
+            "SELECT version FROM cache_version WHERE name = :name"
+        ), {'name': VERSION_KEY}).scalar() or 0
+        with self._lock:
+            if version != self._version:
+                self._entries = {}
+                self._complete = False
+                self._version = version
+            self._checked_at = now
+
+    def _load(self, stmt):
+        rows = db.session.execute(stmt)
+        loaded = {tid: _entry(tid, payload, conf) for tid, payload, conf in rows}
+        with self._lock:
+            self._entries.update(loaded)
+        return loaded
+
+    def get_many(self, tids):
+        """{trial_id: TrialEntry} for the ids that exist."""
+        self._check_version()
+        entries = self._entries
+        missing = [t for t in tids if t not in entries]
+        if missing and not self._complete:
+            self._load(select(Trial.id, Trial.payload, Trial.ai_confidence)
+                       .where(Trial.id.in_(missing)))
+            entries = self._entries
+        return {t: entries[t] for t in tids if t in entries}
+
+    def get(self, tid):
+        return self.get_many([tid]).get(tid)
+
+    def all(self):
+        """Every trial, loading the whole table once per version."""
+        self._check_version()
+        if not self._complete:
+            self._load(select(Trial.id, Trial.payload, Trial.ai_confidence))
+            with self._lock:
+                self._complete = True
+        return self._entries
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+            self._complete = False
+            self._checked_at = 0.0
+
+
+trial_cache = TrialCache()
@@ -0,0 +1,210 @@
+"""
+Per-participant trial queues for /study/next.
+
+/study/start and /study/extend store each participant's remaining trial ids
+(in order) plus a cursor. /study/next then advances the cursor past the
+trial the client just answered and picks the next trial without touching
+the database (payloads come from app.trial_cache). The DB is only consulted after a cache miss (another
+worker, a restart, an eviction) or when a queue runs dry, in case
+/study/extend was handled by a different worker.
+
+Without `after` (a page reload, an older client) the cursor cannot know
+what was answered, so a cached queue first checks its current trial against
+the response table (one unique-index probe) and is rebuilt if it was.
+
+The store is pluggable through STUDY_QUEUE_BACKEND ("module:Class", built
+with the app config); anything with get/set/delete works. Queues are
+mutated after get() and always written back with set(), so a backend that
+stores copies (pickled in Redis, say) sees every advance.
+
+Each queue remembers the 'assignments' cache_version it was built at.
+`flask reclaim-assignments` bumps that version when it deletes assignments,
+and a queue built before the bump is rebuilt from the DB on its next use
+(the version is re-read at most every STUDY_TRIAL_CACHE_TTL_S seconds).
+"""
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+from flask import current_app
+from sqlalchemy import text
+from werkzeug.utils import import_string
+
+from app import db
+from app.trial_cache import trial_cache
+
+ASSIGNMENTS_KEY = 'assignments'
+
+
+class LRUBackend:
+    """Thread-safe in-process LRU keyed by participant id."""
+
+    def __init__(self, config=None):
+        self.maxsize = (config or {}).get('STUDY_QUEUE_CACHE_SIZE', 10000)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class ParticipantQueue:
+    """Remaining trial ids for one participant and a cursor into them."""
+    __slots__ = ('trial_ids', 'cursor', 'version')
+
+    def __init__(self, trial_ids, cursor=0, version=None):
+        self.trial_ids = array('l', trial_ids)
+        self.cursor = cursor
+        self.version = version
+
+    def advance_past(self, trial_id):
+        """Move the cursor beyond `trial_id` if it is still ahead of us."""
+        ids = self.trial_ids
+        if self.cursor < len(ids) and ids[self.cursor] == trial_id:
+            self.cursor += 1
+            return
+        try:
+            self.cursor = ids.index(trial_id, self.cursor) + 1
+        except ValueError:
+            pass  # already behind the cursor
+
+    def current(self):
+        if self.cursor < len(self.trial_ids):
+            return self.trial_ids[self.cursor]
+        return None
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                spec = current_app.config.get('STUDY_QUEUE_BACKEND', 'app.trial_queue:LRUBackend')
+                _backend = import_string(spec)(current_app.config)
+    return _backend
+
+
+_version = None
+_checked_at = 0.0
+
+
+def assignments_version():
+    """The 'assignments' cache_version, re-read at most every STUDY_TRIAL_CACHE_TTL_S."""
+    global _version, _checked_at
+    now = time.monotonic()
+    if _version is None or now - _checked_at >= current_app.config.get('STUDY_TRIAL_CACHE_TTL_S', 5.0):
+        _version = db.session.execute(text(
+            "SELECT version FROM cache_version WHERE name = :name"
+        ), {'name': ASSIGNMENTS_KEY}).scalar() or 0
+        _checked_at = now
+    return _version
+
+
+def prime(pid, trial_ids):
+    """Cache a freshly assigned, unanswered block for `pid`."""
+    trial_cache.get_many(trial_ids)  # warm the payloads too
+    backend().set(pid, ParticipantQueue(trial_ids, version=assignments_version()))
+
+
+# assigned trials without a response, in order; served by
+# ix_assignment_participant_order + ux_response_participant_trial
+UNANSWERED_SQL = text("""
+    SELECT a.trial_id
+    FROM assignment a
+    LEFT JOIN response r ON r.trial_id = a.trial_id AND r.participant_id = a.participant_id
+    WHERE a.participant_id = :pid AND r.id IS NULL
+    ORDER BY a.order_idx ASC
+""")
+
+
+def materialize(pid):
+    """Rebuild `pid`'s queue from the DB: assigned trials without a response."""
+    version = assignments_version()
+    rows = db.session.execute(UNANSWERED_SQL, {'pid': pid}).fetchall()
+    q = ParticipantQueue([r[0] for r in rows], version=version)
+    backend().set(pid, q)
+    return q
+
+
+# the participant behind an MTurk (worker, assignment) pair and its block, in
+# one round trip; served by ux_participant_worker_assignment +
+# ix_assignment_participant_order + ux_response_participant_trial
+RESUME_SQL = text("""
+    SELECT p.id, p.condition, a.trial_id, r.id
+    FROM participant p
+    LEFT JOIN assignment a ON a.participant_id = p.id
+    LEFT JOIN response r ON r.trial_id = a.trial_id AND r.participant_id = p.id
+    WHERE p.worker_id = :worker_id AND p.assignment_id = :assignment_id
+    ORDER BY a.order_idx ASC
+""")
+
+
+def resume(worker_id, assignment_id):
+    """(pid, condition, unanswered trial ids) for a returning participant, or None."""
+    rows = db.session.execute(RESUME_SQL, {'worker_id': worker_id, 'assignment_id': assignment_id}).fetchall()
+    if not rows:
+        return None
+    pid, condition = rows[0][0], rows[0][1]
+    tids = [r[2] for r in rows if r[2] is not None and r[3] is None]
+    prime(pid, tids)
+    return pid, condition, tids
+
+
+# is the trial at the cursor already answered? served by ux_response_participant_trial
+ANSWERED_SQL = text("SELECT 1 FROM response WHERE participant_id = :pid AND trial_id = :tid")
+
+
+def _queue_for(pid, after=None):
+    q = backend().get(pid)
+    fresh = q is None or q.version != assignments_version()
+    if fresh:
+        q = materialize(pid)
+    if after is not None:
+        q.advance_past(after)
+    elif not fresh and q.current() is not None and db.session.execute(
+            ANSWERED_SQL, {'pid': pid, 'tid': q.current()}).first():
+        fresh = True
+        q = materialize(pid)
+    if q.current() is None and not fresh:
+        # the block may have been extended through another worker
+        q = materialize(pid)
+        if after is not None:
+            q.advance_past(after)
+    backend().set(pid, q)
+    return q
+
+
+def next_trial(pid, after=None):
+    """Trial id to show `pid` next, or None when the block is done.
+
+    `after` is the trial the client last submitted, so the cursor can move
+    past it without a write on /study/submit; without it the cached cursor
+    is checked against the DB.
+    """
+    return _queue_for(pid, after).current()
+
+
+def remaining(pid, after=None):
+    """Trial ids still to show `pid`, in order."""
+    q = _queue_for(pid, after)
+    return q.trial_ids[q.cursor:].tolist()
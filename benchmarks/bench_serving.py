@@ -0,0 +1,109 @@
+"""
+Sustained-throughput benchmark for comparing gunicorn serving modes.
+
+Keeps --concurrency clients requesting a cheap page (GET /study, the
+instructions page) for --duration seconds while --slow-clients sockets
+dribble /study/submit bodies at --slow-bps bytes per second, the way a
+participant on a bad connection does. Reports sustained req/s and latency
+for the fast clients; run it once per mode against the same database and
+compare.
+
+    GUNICORN_WORKER_CLASS=sync   gunicorn -c gunicorn_conf.py wsgi:app &
+    python benchmarks/bench_serving.py --url http://127.0.0.1:8000 --slow-clients 8
+    GUNICORN_WORKER_CLASS=gevent gunicorn -c gunicorn_conf.py wsgi:app &
+    python benchmarks/bench_serving.py --url http://127.0.0.1:8000 --slow-clients 8
+"""
+import argparse
+import socket
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = min(len(values) - 1, max(0, int(round(q / 100.0 * (len(values) - 1)))))
+    return values[k]
+
+
+def slow_submit(host, port, path, bps, stop):
+    """Upload one /study/submit body at `bps` bytes/s; returns when sent or stopped."""
+    body = b' ' * 2048  # not valid JSON: the server reads it all, answers 400, writes nothing
+    head = (f"POST {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n").encode()
+    step = max(1, bps // 10)
+    try:
+        with socket.create_connection((host, port), timeout=10) as s:
+            s.sendall(head)
+            for i in range(0, len(body), step):
+                if stop.is_set():
+                    return
+                s.sendall(body[i:i + step])
+                time.sleep(0.1)
+            s.recv(1024)
+    except OSError:
+        pass
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument('--url', default='http://127.0.0.1:8000')
+    ap.add_argument('--path', default='/study')
+    ap.add_argument('-c', '--concurrency', type=int, default=16)
+    ap.add_argument('-d', '--duration', type=float, default=20.0)
+    ap.add_argument('--slow-clients', type=int, default=0)
+    ap.add_argument('--slow-bps', type=int, default=200)
+    ap.add_argument('--timeout', type=float, default=10.0)
+    args = ap.parse_args()
+
+    parsed = urllib.parse.urlsplit(args.url)
+    stop = threading.Event()
+    lock = threading.Lock()
+    latencies, errors = [], []
+
+    def slow_loop():
+        while not stop.is_set():
+            slow_submit(parsed.hostname, parsed.port or 80, '/study/submit', args.slow_bps, stop)
+
+    def fast_loop():
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            try:
+                with urllib.request.urlopen(args.url + args.path, timeout=args.timeout) as res:
+                    res.read()
+            except Exception as exc:
+                with lock:
+                    errors.append(repr(exc))
+                continue
+            with lock:
+                latencies.append((time.perf_counter() - t0) * 1000.0)
+
+    slow = [threading.Thread(target=slow_loop, daemon=True) for _ in range(args.slow_clients)]
+    for t in slow:
+        t.start()
+    time.sleep(1.0 if slow else 0)  # let the slow uploads occupy their workers first
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for _ in range(args.concurrency):
+            pool.submit(fast_loop)
+        time.sleep(args.duration)
+        stop.set()
+    wall = time.perf_counter() - t0
+
+    print(f"mode          {args.concurrency} clients on {args.path}, "
+          f"{args.slow_clients} slow uploads at {args.slow_bps} B/s, {args.duration:.0f}s")
+    print(f"throughput    {len(latencies)} ok, {len(errors)} failed -> {len(latencies) / wall:.1f} req/s")
+    print(f"latency ms    p50={percentile(latencies, 50):.1f} "
+          f"p95={percentile(latencies, 95):.1f} p99={percentile(latencies, 99):.1f} "
+          f"max={max(latencies, default=0):.1f}")
+    if errors:
+        print("first error:", errors[0])
+
+
+if __name__ == '__main__':
+    main()
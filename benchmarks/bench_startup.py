@@ -0,0 +1,133 @@
+"""
+Startup benchmark: cold-import time and per-worker memory under gunicorn.
+
+1. Imports --target (module:attr) in --runs fresh interpreters and reports
+   the median wall time to a ready WSGI app, plus the slowest imports from
+   `python -X importtime` for the last run.
+2. Starts gunicorn with --workers workers (and --preload when asked), sends
+   a few requests so every worker has served, and reads each worker's RSS,
+   PSS and private (USS) memory from /proc/<pid>/smaps_rollup. With
+   --preload the app is imported once in the master and workers share those
+   pages copy-on-write, which shows up as PSS/USS well below RSS.
+
+    python benchmarks/bench_startup.py --target wsgi:app --workers 4
+    python benchmarks/bench_startup.py --target wsgi:app --workers 4 --preload
+
+Linux only (reads /proc).
+"""
+import argparse
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_ms(target):
+    module, attr = target.split(':')
+    code = ("import time; t0 = time.perf_counter(); "
+            f"import {module}; getattr({module}, {attr!r}); "
+            "print((time.perf_counter() - t0) * 1000)")
+    out = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(target, n=10):
+    """Largest cumulative imports pulled in by the target module and the app package."""
+    module = target.split(':')[0]
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                         cwd=ROOT, capture_output=True, text=True, check=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        m = re.match(r'import time:\s+\d+ \|\s+(\d+) \| ( *)(\S+)', line)
+        if m and len(m.group(2)) <= 4 and m.group(3) not in (module, 'app'):
+            rows.append((int(m.group(1)) / 1000.0, m.group(3)))
+    return sorted(rows, reverse=True)[:n]
+
+
+def memory_kb(pid):
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            m = re.match(r'(\w+):\s+(\d+) kB', line)
+            if m:
+                fields[m.group(1)] = int(m.group(2))
+    return {
+        'rss': fields.get('Rss', 0),
+        'pss': fields.get('Pss', 0),
+        'uss': fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0),
+    }
+
+
+def children(pid):
+    with open(f'/proc/{pid}/task/{pid}/children') as f:
+        return [int(p) for p in f.read().split()]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def worker_memory(target, workers, preload, requests=50):
+    port = free_port()
+    cmd = [sys.executable, '-m', 'gunicorn', '-w', str(workers), '-b', f'127.0.0.1:{port}', target]
+    if preload:
+        cmd.insert(3, '--preload')
+    t0 = time.perf_counter()
+    server = subprocess.Popen(cmd, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        url = f'http://127.0.0.1:{port}/study'
+        while True:
+            try:
+                urllib.request.urlopen(url, timeout=2).read()
+                break
+            except OSError:
+                if time.perf_counter() - t0 > 60:
+                    raise SystemExit('gunicorn did not come up')
+                time.sleep(0.05)
+        ready_ms = (time.perf_counter() - t0) * 1000
+        for _ in range(requests):
+            urllib.request.urlopen(url, timeout=5).read()
+        time.sleep(0.5)
+        pids = children(server.pid)
+        return ready_ms, memory_kb(server.pid), [memory_kb(p) for p in pids]
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument('--target', default='wsgi:app', help='module:attr of the WSGI app')
+    ap.add_argument('--runs', type=int, default=5)
+    ap.add_argument('-w', '--workers', type=int, default=4)
+    ap.add_argument('--preload', action='store_true')
+    args = ap.parse_args()
+
+    times = [import_ms(args.target) for _ in range(args.runs)]
+    print(f"cold import   {args.target}: median {statistics.median(times):.0f} ms "
+          f"(min {min(times):.0f}, max {max(times):.0f}, {args.runs} runs)")
+    for ms, name in slowest_imports(args.target):
+        print(f"  {ms:8.1f} ms  {name}")
+
+    ready_ms, master, workers = worker_memory(args.target, args.workers, args.preload)
+    mode = 'preload' if args.preload else 'no preload'
+    print(f"gunicorn      {args.workers} workers, {mode}: first response after {ready_ms:.0f} ms")
+    print(f"  master      rss={master['rss'] / 1024:.1f} MB pss={master['pss'] / 1024:.1f} MB "
+          f"uss={master['uss'] / 1024:.1f} MB")
+    for i, m in enumerate(workers):
+        print(f"  worker {i}    rss={m['rss'] / 1024:.1f} MB pss={m['pss'] / 1024:.1f} MB "
+              f"uss={m['uss'] / 1024:.1f} MB")
+    total_pss = (master['pss'] + sum(m['pss'] for m in workers)) / 1024
+    print(f"  total pss   {total_pss:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
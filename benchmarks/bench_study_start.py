@@ -0,0 +1,100 @@
+"""
+Stress benchmark for POST /study/start.
+
+Fires N simultaneous starts at a running server, then reads the study DB
+(the same DATABASE_URL / app.db the server uses) to report how evenly the
+new assignments landed across trials.
+
+    gunicorn -w 4 --threads 8 wsgi:app &
+    python benchmarks/bench_study_start.py --url http://127.0.0.1:8000 -n 1000
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def coverage_snapshot():
+    from app import create_app, db
+    with create_app(cli=False).app_context():
+        counts = dict(db.session.execute(db.text("""
+            SELECT t.id, COUNT(a.id) FROM trial t
+            LEFT JOIN assignment a ON a.trial_id = t.id
+            GROUP BY t.id
+        """)).fetchall())
+        counters = dict(db.session.execute(db.text(
+            "SELECT trial_id, n_assigned FROM trial_coverage"
+        )).fetchall())
+    return counts, counters
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = min(len(values) - 1, max(0, int(round(q / 100.0 * (len(values) - 1)))))
+    return values[k]
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument('--url', default='http://127.0.0.1:5000')
+    ap.add_argument('-n', '--requests', type=int, default=1000)
+    ap.add_argument('-c', '--concurrency', type=int, default=1000)
+    ap.add_argument('--condition', default='control')
+    args = ap.parse_args()
+
+    before, _ = coverage_snapshot()
+    body = json.dumps({'condition': args.condition}).encode()
+    gate = threading.Barrier(min(args.concurrency, args.requests))
+    latencies, errors = [], []
+
+    def fire(i):
+        try:
+            gate.wait(timeout=30)
+        except threading.BrokenBarrierError:
+            pass
+        req = urllib.request.Request(args.url + '/study/start', data=body,
+                                     headers={'Content-Type': 'application/json'})
+        t0 = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req, timeout=120) as res:
+                res.read()
+        except Exception as exc:
+            errors.append(repr(exc))
+            return
+        latencies.append((time.perf_counter() - t0) * 1000.0)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(fire, range(args.requests)))
+    wall = time.perf_counter() - t0
+
+    after, counters = coverage_snapshot()
+    added = [after[t] - before.get(t, 0) for t in after]
+    drift = sum(1 for t in after if counters.get(t, 0) != after[t])
+
+    print(f"requests      {args.requests} ({len(errors)} failed) in {wall:.2f}s "
+          f"-> {len(latencies) / wall:.1f} req/s")
+    print(f"latency ms    p50={percentile(latencies, 50):.1f} "
+          f"p95={percentile(latencies, 95):.1f} p99={percentile(latencies, 99):.1f} "
+          f"max={max(latencies, default=0):.1f}")
+    print(f"coverage      trials={len(after)} min={min(after.values(), default=0)} "
+          f"max={max(after.values(), default=0)} "
+          f"variance={statistics.pvariance(after.values()) if after else 0:.3f}")
+    print(f"this run      added min={min(added, default=0)} max={max(added, default=0)} "
+          f"variance={statistics.pvariance(added) if added else 0:.3f}")
+    print(f"counter drift {drift} trials where trial_coverage != COUNT(assignment)")
+    if errors:
+        print("first error:", errors[0])
+
+
+if __name__ == '__main__':
+    main()
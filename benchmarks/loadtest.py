@@ -0,0 +1,299 @@
+"""
+End-to-end load test: virtual participants replaying the /study flow.
+
+Each virtual participant does what templates/study_run.html does: POST
+/study/start, one GET /study/block for the whole block, then per trial
+think -> (in the ai condition, sometimes reveal the AI, which queues an
+'ai_shown' event) -> think -> queue the answer. Queued answers go to
+/study/submit one at a time in the background, like the page's submit
+queue; queued events go to /study/events in batches with each submit and
+every 5 s. At the end of the block both queues are drained, as the page
+does before /study/finish. Think times are log-normal around --think-ms.
+Up to --concurrency participants are active at once; starts are spread
+over --ramp seconds.
+
+Reports throughput, p50/p95/p99 latency per endpoint, and how evenly the
+run's assignments and responses landed across trials (read from the same
+DATABASE_URL / app.db the server uses). Needs httpx.
+
+    gunicorn -c gunicorn_conf.py wsgi:app &
+    python benchmarks/loadtest.py --url http://127.0.0.1:8000 -p 200 -c 50 --think-ms 1500
+
+or let it start (and stop) gunicorn itself with --serve.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+ENDPOINTS = ('start', 'block', 'submit', 'events')
+EVENT_FLUSH_S = 5.0  # the run page's setInterval(flushEvents, 5000)
+
+
+def coverage_snapshot():
+    """({trial_id: assignments}, {trial_id: responses}) straight from the study DB."""
+    from app import create_app, db
+    with create_app(cli=False).app_context():
+        assigned = dict(db.session.execute(db.text("""
+            SELECT t.id, COUNT(a.id) FROM trial t
+            LEFT JOIN assignment a ON a.trial_id = t.id
+            GROUP BY t.id
+        """)).fetchall())
+        answered = dict(db.session.execute(db.text(
+            "SELECT trial_id, COUNT(*) FROM response GROUP BY trial_id"
+        )).fetchall())
+    return assigned, answered
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = min(len(values) - 1, max(0, int(round(q / 100.0 * (len(values) - 1)))))
+    return values[k]
+
+
+def balance(before, after):
+    added = [after.get(t, 0) - before.get(t, 0) for t in after]
+    return {
+        'trials': len(added),
+        'min': min(added, default=0),
+        'max': max(added, default=0),
+        'variance': statistics.pvariance(added) if added else 0.0,
+    }
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.retries = 0
+        self.first_error = None
+
+    async def call(self, name, send, retries=5):
+        """Time one request; 429s are retried after Retry-After like the run page does."""
+        for _ in range(retries + 1):
+            t0 = time.perf_counter()
+            try:
+                res = await send()
+            except Exception as exc:
+                self.errors[name] += 1
+                self.first_error = self.first_error or f'{name}: {exc!r}'
+                return None
+            self.latencies[name].append((time.perf_counter() - t0) * 1000.0)
+            if res.status_code != 429:
+                break
+            self.retries += 1
+            await asyncio.sleep(float(res.headers.get('Retry-After', 1)))
+        if res.status_code >= 400:
+            self.errors[name] += 1
+            self.first_error = self.first_error or f'{name}: HTTP {res.status_code} {res.text[:200]}'
+            return None
+        return res
+
+
+class RunPage:
+    """One participant's study_run.html: a background submit queue and batched events."""
+
+    def __init__(self, client, rec):
+        self.client, self.rec = client, rec
+        self.pending, self.events = [], []
+        self.failed = False
+        self._flushing = None
+        self._ticker = asyncio.ensure_future(self._tick())
+
+    def submit(self, body):
+        """Queue an answer and move on; it is sent in the background."""
+        self.pending.append(body)
+        self.flush_submits()
+        asyncio.ensure_future(self.flush_events())
+
+    def flush_submits(self):
+        """One sender at a time, in answer order (the page's flushSubmits)."""
+        if self._flushing is None or self._flushing.done():
+            self._flushing = asyncio.ensure_future(self._send_submits())
+        return self._flushing
+
+    async def _send_submits(self):
+        while self.pending:
+            body = self.pending[0]
+            if await self.rec.call('submit', lambda: self.client.post('/study/submit', json=body)) is None:
+                self.failed = True
+            self.pending.pop(0)
+
+    async def flush_events(self):
+        if not self.events:
+            return
+        batch, self.events = self.events, []
+        if await self.rec.call('events', lambda: self.client.post('/study/events', json={'events': batch})) is None:
+            self.failed = True
+
+    async def _tick(self):
+        while True:
+            await asyncio.sleep(EVENT_FLUSH_S)
+            await self.flush_events()
+
+    async def finish(self):
+        """Drain both queues, as the page does before /study/finish."""
+        await asyncio.gather(self.flush_submits(), self.flush_events())
+        self._ticker.cancel()
+        return not self.failed
+
+
+async def participant(client, rec, args, rng, n):
+    think = lambda: rng.lognormvariate(0, 0.5) * args.think_ms / 1000.0
+    condition = 'ai' if rng.random() < args.ai_share else 'control'
+    res = await rec.call('start', lambda: client.post('/study/start', json={
+        'condition': condition, 'workerId': f'LOAD{n:06d}',
+        'assignmentId': uuid.uuid4().hex, 'hitId': args.hit_id}))
+    if res is None:
+        return False
+    pid = res.json()['participant_id']
+    res = await rec.call('block', lambda: client.get('/study/block', params={'participant_id': pid}))
+    if res is None:
+        return False
+
+    page = RunPage(client, rec)
+    for trial in res.json()['trials']:
+        tid = trial['trial_id']
+        await asyncio.sleep(think())
+        revealed = condition == 'ai' and rng.random() < args.reveal_share
+        if revealed:
+            page.events.append({
+                'participant_id': pid, 'trial_id': tid, 'event_type': 'ai_shown',
+                'payload': {'ai_severity_score': trial['payload'].get('ai_severity_score'),
+                            'ai_justification': trial['payload'].get('ai_justification') or ''}})
+        started = time.perf_counter()
+        await asyncio.sleep(think())
+        page.submit({
+            'participant_id': pid, 'trial_id': tid,
+            'answer': {'value': rng.randint(1, 5)}, 'correct': None,
+            'rt_ms': int((time.perf_counter() - started) * 1000), 'revealed_ai': revealed})
+    return await page.finish()
+
+
+async def run(args):
+    try:
+        import httpx
+    except ImportError:
+        sys.exit('loadtest.py needs httpx: pip install httpx')
+
+    rec = Recorder()
+    rng = random.Random(args.seed)
+    gate = asyncio.Semaphore(args.concurrency)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    outcomes = []
+
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        async def one(n):
+            await asyncio.sleep(args.ramp * n / max(1, args.participants))
+            async with gate:
+                outcomes.append(await participant(client, rec, args, random.Random(rng.random()), n))
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one(n) for n in range(args.participants)))
+        wall = time.perf_counter() - t0
+    return rec, outcomes, wall
+
+
+def wait_ready(url, timeout=30.0):
+    import urllib.request
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url + '/study', timeout=2):
+                return
+        except OSError:
+            time.sleep(0.3)
+    raise SystemExit(f'server at {url} did not come up')
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument('--url', default='http://127.0.0.1:8000')
+    ap.add_argument('-p', '--participants', type=int, default=100)
+    ap.add_argument('-c', '--concurrency', type=int, default=50, help='participants active at once')
+    ap.add_argument('--ramp', type=float, default=10.0, help='seconds over which participants arrive')
+    ap.add_argument('--think-ms', type=float, default=1500.0, help='median pause before each action')
+    ap.add_argument('--ai-share', type=float, default=0.5, help='fraction in the ai condition')
+    ap.add_argument('--reveal-share', type=float, default=0.6, help='ai trials where the AI is shown')
+    ap.add_argument('--hit-id', default='LOADTEST')
+    ap.add_argument('--timeout', type=float, default=30.0)
+    ap.add_argument('--seed', type=int, default=0)
+    ap.add_argument('--serve', action='store_true',
+                    help='start gunicorn -c gunicorn_conf.py on --url\'s port for the run')
+    ap.add_argument('--no-db', action='store_true', help='skip the coverage report (server DB not reachable)')
+    ap.add_argument('--json', dest='as_json', action='store_true')
+    args = ap.parse_args()
+
+    server = None
+    if args.serve:
+        from urllib.parse import urlsplit
+        env = dict(os.environ, PORT=str(urlsplit(args.url).port or 8000))
+        server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn_conf.py', 'wsgi:app'],
+                                  cwd=ROOT, env=env)
+        wait_ready(args.url)
+    try:
+        before = None if args.no_db else coverage_snapshot()
+        rec, outcomes, wall = asyncio.run(run(args))
+        after = None if args.no_db else coverage_snapshot()
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    total = sum(len(v) for v in rec.latencies.values())
+    report = {
+        'participants': args.participants,
+        'completed': sum(outcomes),
+        'wall_s': wall,
+        'requests': total,
+        'req_per_s': total / wall if wall else 0.0,
+        'retries_429': rec.retries,
+        'endpoints': {
+            name: {
+                'n': len(rec.latencies[name]),
+                'errors': rec.errors[name],
+                'p50_ms': percentile(rec.latencies[name], 50),
+                'p95_ms': percentile(rec.latencies[name], 95),
+                'p99_ms': percentile(rec.latencies[name], 99),
+                'max_ms': max(rec.latencies[name], default=0.0),
+            } for name in ENDPOINTS if rec.latencies[name] or rec.errors[name]
+        },
+        'first_error': rec.first_error,
+    }
+    if after is not None:
+        report['assignments'] = balance(before[0], after[0])
+        report['responses'] = balance(before[1], after[1])
+
+    if args.as_json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"participants  {report['completed']}/{args.participants} completed in {wall:.1f}s")
+    print(f"throughput    {total} requests -> {report['req_per_s']:.1f} req/s "
+          f"({rec.retries} retried after 429)")
+    print(f"{'endpoint':<12}{'n':>8}{'errors':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}  (ms)")
+    for name, e in report['endpoints'].items():
+        print(f"{name:<12}{e['n']:>8}{e['errors']:>8}{e['p50_ms']:>9.1f}{e['p95_ms']:>9.1f}"
+              f"{e['p99_ms']:>9.1f}{e['max_ms']:>9.1f}")
+    for key in ('assignments', 'responses'):
+        if key in report:
+            b = report[key]
+            print(f"{key:<13} this run over {b['trials']} trials: min={b['min']} max={b['max']} "
+                  f"variance={b['variance']:.3f}")
+    if rec.first_error:
+        print('first error:', rec.first_error)
+
+
+if __name__ == '__main__':
+    main()
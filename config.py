@@ -16,3 +16,48 @@ class Config:
         SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(basedir, 'app.db')}"
 
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Connection pool (SQLALCHEMY_ENGINE_OPTIONS is built from these in app/pool.py).
+    # Unset DB_POOL_SIZE / DB_MAX_OVERFLOW are derived from GUNICORN_THREADS, and
+    # DB_MAX_CONNECTIONS (the server's limit, minus headroom) is split across WEB_CONCURRENCY workers.
+    WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 1))
+    GUNICORN_THREADS = int(os.environ.get('GUNICORN_THREADS', 1))
+    DB_POOL_SIZE = int(os.environ['DB_POOL_SIZE']) if os.environ.get('DB_POOL_SIZE') else None
+    DB_MAX_OVERFLOW = int(os.environ['DB_MAX_OVERFLOW']) if os.environ.get('DB_MAX_OVERFLOW') else None
+    DB_MAX_CONNECTIONS = int(os.environ.get('DB_MAX_CONNECTIONS', 0))
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))  # seconds; under Render's idle cutoff
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1') == '1'
+    # '1' when DATABASE_URL points at PgBouncer in transaction mode: no app-side pool
+    DB_PGBOUNCER = os.environ.get('DB_PGBOUNCER', '0') == '1'
+
+    # /study/submit + /study/event ingestion: 'direct' (commit per request)
+    # or 'buffered' (journal + background bulk inserts, see app/ingest.py)
+    STUDY_INGEST_MODE = os.environ.get('STUDY_INGEST_MODE', 'direct')
+    STUDY_INGEST_DIR = os.environ.get('STUDY_INGEST_DIR')  # default: instance/ingest
+    STUDY_INGEST_QUEUE_MAX = int(os.environ.get('STUDY_INGEST_QUEUE_MAX', 5000))
+    STUDY_INGEST_BATCH = int(os.environ.get('STUDY_INGEST_BATCH', 500))
+    STUDY_INGEST_FLUSH_MS = int(os.environ.get('STUDY_INGEST_FLUSH_MS', 200))
+    STUDY_INGEST_FSYNC = os.environ.get('STUDY_INGEST_FSYNC', '0') == '1'
+
+    # /study/export: the since_id cursor only covers responses stored this long ago (longer than any
+    # insert transaction), so rows committed out of id order are never skipped; see app/export.py
+    STUDY_EXPORT_SETTLE_S = float(os.environ.get('STUDY_EXPORT_SETTLE_S', 5))
+    # /study/stats: seconds a worker reuses its cached stats before checking for new responses
+    STUDY_STATS_TTL_S = float(os.environ.get('STUDY_STATS_TTL_S', 10))
+    # /metrics: per-worker files summed on scrape (app/metrics.py); default instance/metrics
+    STUDY_METRICS_DIR = os.environ.get('STUDY_METRICS_DIR')
+    STUDY_METRICS_FLUSH_S = float(os.environ.get('STUDY_METRICS_FLUSH_S', 1))
+    # slow-query capture (app/slowlog.py): requests slower than this log their slowest statement + EXPLAIN
+    STUDY_SLOW_QUERY_MS = float(os.environ.get('STUDY_SLOW_QUERY_MS', 500))
+    STUDY_SLOW_QUERY_BUFFER = int(os.environ.get('STUDY_SLOW_QUERY_BUFFER', 100))  # captures kept per worker
+    STUDY_SLOW_QUERY_REDACT = os.environ.get('STUDY_SLOW_QUERY_REDACT', '1') == '1'
+    STUDY_SLOW_QUERY_EXPLAIN_TTL_S = float(os.environ.get('STUDY_SLOW_QUERY_EXPLAIN_TTL_S', 300))
+    STUDY_SLOW_QUERY_DIR = os.environ.get('STUDY_SLOW_QUERY_DIR')  # default instance/slow_queries
+    # required by /metrics, /study/pool and /study/admin/* when set (?token= or a Bearer header)
+    STUDY_ADMIN_TOKEN = os.environ.get('STUDY_ADMIN_TOKEN')
+    # `flask reclaim-assignments`: participants idle this long give back their unanswered trials
+    STUDY_RECLAIM_IDLE_S = float(os.environ.get('STUDY_RECLAIM_IDLE_S', 2 * 3600))
+    STUDY_RECLAIM_BATCH = int(os.environ.get('STUDY_RECLAIM_BATCH', 500))  # participants per transaction
+    # seconds between each worker's check of the trial cache version (app/trial_cache.py)
+    STUDY_TRIAL_CACHE_TTL_S = float(os.environ.get('STUDY_TRIAL_CACHE_TTL_S', 5))
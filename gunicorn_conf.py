@@ -0,0 +1,64 @@
+"""
+gunicorn settings: `gunicorn -c gunicorn_conf.py wsgi:app` (see Procfile).
+
+GUNICORN_WORKER_CLASS picks the serving mode:
+
+  sync     one request per worker at a time (gunicorn's default, the old setup)
+  gthread  GUNICORN_THREADS requests per worker
+  gevent   up to GUNICORN_WORKER_CONNECTIONS requests per worker as greenlets;
+           psycopg2 is made cooperative with psycogreen, so a client slowly
+           uploading a /study/submit body (or a query waiting on Postgres)
+           parks a greenlet instead of pinning the worker
+
+gevent workers ignore GUNICORN_THREADS, but the DB pool is still sized from
+it (app/pool.py): greenlets only hold a connection while they query, and the
+rest queue on the pool for up to DB_POOL_TIMEOUT. SQLite calls are not
+cooperative, so use gevent against Postgres.
+"""
+import glob
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'sync')
+threads = int(os.environ.get('GUNICORN_THREADS', 1 if worker_class == 'sync' else 4))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 500))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = 20
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))  # Render's proxy reuses connections
+accesslog = os.environ.get('GUNICORN_ACCESSLOG')  # e.g. '-' for stdout
+# import the app once in the master so workers share its pages copy-on-write;
+# not with gevent, which has to monkey-patch before the app's imports
+preload_app = os.environ.get('GUNICORN_PRELOAD', '0' if worker_class == 'gevent' else '1') == '1'
+
+# app/pool.py sizes each worker's DB pool from these
+os.environ.setdefault('WEB_CONCURRENCY', str(workers))
+os.environ.setdefault('GUNICORN_THREADS', str(threads))
+
+
+def on_starting(server):
+    # per-worker /metrics files from a previous run (app/metrics.py)
+    directory = os.environ.get('STUDY_METRICS_DIR') or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'instance', 'metrics')
+    for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+        os.remove(path)
+
+
+def post_fork(server, worker):
+    if preload_app:
+        # connections inherited from the master must not be shared across processes
+        from app import db
+        with server.app.wsgi().app_context():
+            db.engine.dispose(close=False)
+
+
+def post_worker_init(worker):
+    if worker_class == 'gevent':
+        # gunicorn has already monkey-patched the stdlib; psycopg2 is C code and
+        # needs its own wait callback to yield to the gevent hub
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+    # STUDY_INGEST_MODE=buffered: replay journal segments a crashed or restarted
+    # worker left behind now, not on this worker's first buffered request
+    from app.ingest import start_buffered
+    start_buffered(worker.wsgi)
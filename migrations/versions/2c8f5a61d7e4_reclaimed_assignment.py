@@ -0,0 +1,41 @@
+"""reclaimed_assignment: slots released from idle participants
+
+Revision ID: 2c8f5a61d7e4
+Revises: 9d4c2e7a1f35
+Create Date: 2025-12-11 09:27:51.640183
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2c8f5a61d7e4'
+down_revision = '9d4c2e7a1f35'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('reclaimed_assignment',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('participant_id', sa.Integer(), nullable=False),
+    sa.Column('trial_id', sa.Integer(), nullable=False),
+    sa.Column('order_idx', sa.Integer(), nullable=True),
+    sa.Column('last_activity_at', sa.DateTime(), nullable=True),
+    sa.Column('reclaimed_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['participant_id'], ['participant.id'], ),
+    sa.ForeignKeyConstraint(['trial_id'], ['trial.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('reclaimed_assignment', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_reclaimed_assignment_participant_id'), ['participant_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_reclaimed_assignment_reclaimed_at'), ['reclaimed_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('reclaimed_assignment', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_reclaimed_assignment_reclaimed_at'))
+        batch_op.drop_index(batch_op.f('ix_reclaimed_assignment_participant_id'))
+
+    op.drop_table('reclaimed_assignment')
@@ -0,0 +1,43 @@
+"""trial coverage counters
+
+Revision ID: 3f1c7a2d9e40
+Revises: b9e32a8bfe18
+Create Date: 2025-11-18 10:04:31.512207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c7a2d9e40'
+down_revision = 'b9e32a8bfe18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('trial_coverage',
+    sa.Column('trial_id', sa.Integer(), nullable=False),
+    sa.Column('n_assigned', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['trial_id'], ['trial.id'], ),
+    sa.PrimaryKeyConstraint('trial_id')
+    )
+    with op.batch_alter_table('trial_coverage', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_trial_coverage_n_assigned'), ['n_assigned'], unique=False)
+
+    # backfill from the existing assignment history
+    op.execute("""
+        INSERT INTO trial_coverage (trial_id, n_assigned)
+        SELECT t.id, COUNT(a.id)
+        FROM trial t
+        LEFT JOIN assignment a ON a.trial_id = t.id
+        GROUP BY t.id
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('trial_coverage', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_trial_coverage_n_assigned'))
+
+    op.drop_table('trial_coverage')
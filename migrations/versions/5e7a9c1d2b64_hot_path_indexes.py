@@ -0,0 +1,61 @@
+"""composite indexes for hot study queries
+
+Revision ID: 5e7a9c1d2b64
+Revises: 8c2d41f7b3a9
+Create Date: 2025-11-24 10:12:45.903311
+
+Adds assignment(participant_id, order_idx), a unique
+response(participant_id, trial_id) and response(created_at). The
+single-column participant_id indexes are prefixes of the new ones and are
+dropped. Duplicate responses for the same (participant, trial), left by
+retried submits, are moved to response_duplicate first (same columns as
+response, not a model) and the count is logged; the earliest answer stays
+in response. Downgrade puts the archived rows back.
+
+"""
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+
+log = logging.getLogger('alembic.runtime.migration')
+
+DUPLICATES = "id NOT IN (SELECT MIN(id) FROM response GROUP BY participant_id, trial_id)"
+
+
+# revision identifiers, used by Alembic.
+revision = '5e7a9c1d2b64'
+down_revision = '8c2d41f7b3a9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(sa.text(f"CREATE TABLE response_duplicate AS SELECT * FROM response WHERE {DUPLICATES}"))
+    moved = op.get_bind().execute(sa.text("SELECT COUNT(*) FROM response_duplicate")).scalar()
+    if moved:
+        log.warning('moved %d duplicate responses (same participant and trial) to response_duplicate', moved)
+    op.execute(sa.text(f"DELETE FROM response WHERE {DUPLICATES}"))
+
+    with op.batch_alter_table('assignment', schema=None) as batch_op:
+        batch_op.create_index('ix_assignment_participant_order', ['participant_id', 'order_idx'], unique=False)
+        batch_op.drop_index(batch_op.f('ix_assignment_participant_id'))
+
+    with op.batch_alter_table('response', schema=None) as batch_op:
+        batch_op.create_index('ux_response_participant_trial', ['participant_id', 'trial_id'], unique=True)
+        batch_op.create_index(batch_op.f('ix_response_created_at'), ['created_at'], unique=False)
+        batch_op.drop_index(batch_op.f('ix_response_participant_id'))
+
+
+def downgrade():
+    with op.batch_alter_table('response', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_response_participant_id'), ['participant_id'], unique=False)
+        batch_op.drop_index(batch_op.f('ix_response_created_at'))
+        batch_op.drop_index('ux_response_participant_trial')
+    cols = ', '.join(c['name'] for c in sa.inspect(op.get_bind()).get_columns('response_duplicate'))
+    op.execute(sa.text(f"INSERT INTO response ({cols}) SELECT {cols} FROM response_duplicate"))
+    op.drop_table('response_duplicate')
+
+    with op.batch_alter_table('assignment', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_assignment_participant_id'), ['participant_id'], unique=False)
+        batch_op.drop_index('ix_assignment_participant_order')
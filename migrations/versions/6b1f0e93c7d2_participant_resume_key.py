@@ -0,0 +1,46 @@
+"""unique (worker_id, assignment_id) for participant resume
+
+Revision ID: 6b1f0e93c7d2
+Revises: d3b85f27e1c6
+Create Date: 2025-12-04 10:12:37.518204
+
+Duplicate starts recorded before this index keep their rows: the oldest
+participant per (worker_id, assignment_id) keeps the key, later copies get
+"~dup<id>" appended to assignment_id so their responses remain attributable.
+Starts without a workerId/assignmentId (NULLs) are not constrained.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6b1f0e93c7d2'
+down_revision = 'd3b85f27e1c6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    conn = op.get_bind()
+    seen = set()
+    rows = []
+    for pid, worker_id, assignment_id in conn.execute(sa.text(
+            "SELECT id, worker_id, assignment_id FROM participant "
+            "WHERE worker_id IS NOT NULL AND assignment_id IS NOT NULL ORDER BY id")):
+        key = (worker_id, assignment_id)
+        if key in seen:
+            suffix = f'~dup{pid}'
+            rows.append({'pid': pid, 'aid': assignment_id[:128 - len(suffix)] + suffix})
+        else:
+            seen.add(key)
+    if rows:
+        conn.execute(sa.text("UPDATE participant SET assignment_id = :aid WHERE id = :pid"), rows)
+
+    with op.batch_alter_table('participant', schema=None) as batch_op:
+        batch_op.create_index('ux_participant_worker_assignment', ['worker_id', 'assignment_id'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('participant', schema=None) as batch_op:
+        batch_op.drop_index('ux_participant_worker_assignment')
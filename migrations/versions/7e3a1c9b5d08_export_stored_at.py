@@ -0,0 +1,41 @@
+"""response.stored_at and cache_version.updated_at for the export cursor
+
+Revision ID: 7e3a1c9b5d08
+Revises: 2c8f5a61d7e4
+Create Date: 2025-12-15 10:41:07.218455
+
+Write-behind rows carry created_at from enqueue time, so `?since=` and
+Last-Modified move to stored_at, stamped at insert. Existing rows are
+backfilled from created_at; the created_at index moves with it.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7e3a1c9b5d08'
+down_revision = '2c8f5a61d7e4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('response', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('stored_at', sa.DateTime(), nullable=True))
+    op.execute(sa.text("UPDATE response SET stored_at = created_at"))
+    with op.batch_alter_table('response', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_response_created_at'))
+        batch_op.create_index(batch_op.f('ix_response_stored_at'), ['stored_at'], unique=False)
+
+    with op.batch_alter_table('cache_version', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('cache_version', schema=None) as batch_op:
+        batch_op.drop_column('updated_at')
+
+    with op.batch_alter_table('response', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_response_stored_at'))
+        batch_op.create_index(batch_op.f('ix_response_created_at'), ['created_at'], unique=False)
+        batch_op.drop_column('stored_at')
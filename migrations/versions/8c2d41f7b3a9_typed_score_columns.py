@@ -0,0 +1,71 @@
+"""typed score columns for stats
+
+Revision ID: 8c2d41f7b3a9
+Revises: 3f1c7a2d9e40
+Create Date: 2025-11-20 14:37:02.118540
+
+"""
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c2d41f7b3a9'
+down_revision = '3f1c7a2d9e40'
+branch_labels = None
+depends_on = None
+
+
+def _int(v):
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return None
+
+
+def _obj(v):
+    if isinstance(v, str):
+        try:
+            return json.loads(v)
+        except ValueError:
+            return None
+    return v if isinstance(v, dict) else None
+
+
+def upgrade():
+    with op.batch_alter_table('trial', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('gt_severity_score', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('ai_severity_score', sa.Integer(), nullable=True))
+
+    with op.batch_alter_table('response', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('answer_value', sa.Integer(), nullable=True))
+
+    # backfill in Python so the JSON handling is the same on SQLite and Postgres
+    conn = op.get_bind()
+    trials = [
+        {'tid': r[0], 'gt': _int((_obj(r[1]) or {}).get('gt_severity_score')),
+         'ai': _int((_obj(r[1]) or {}).get('ai_severity_score'))}
+        for r in conn.execute(sa.text("SELECT id, payload FROM trial"))
+    ]
+    if trials:
+        conn.execute(sa.text(
+            "UPDATE trial SET gt_severity_score = :gt, ai_severity_score = :ai WHERE id = :tid"
+        ), trials)
+
+    responses = [
+        {'rid': r[0], 'v': _int((_obj(r[1]) or {}).get('value'))}
+        for r in conn.execute(sa.text("SELECT id, answer FROM response"))
+    ]
+    if responses:
+        conn.execute(sa.text("UPDATE response SET answer_value = :v WHERE id = :rid"), responses)
+
+
+def downgrade():
+    with op.batch_alter_table('response', schema=None) as batch_op:
+        batch_op.drop_column('answer_value')
+
+    with op.batch_alter_table('trial', schema=None) as batch_op:
+        batch_op.drop_column('ai_severity_score')
+        batch_op.drop_column('gt_severity_score')
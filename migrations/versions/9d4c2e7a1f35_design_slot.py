@@ -0,0 +1,47 @@
+"""design_slot: precomputed balanced trial schedules
+
+Revision ID: 9d4c2e7a1f35
+Revises: 6b1f0e93c7d2
+Create Date: 2025-12-09 14:41:08.902317
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d4c2e7a1f35'
+down_revision = '6b1f0e93c7d2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('design_slot',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('seq', sa.Integer(), nullable=False),
+    sa.Column('condition', sa.String(length=16), nullable=False),
+    sa.Column('trial_ids', sa.JSON(), nullable=False),
+    sa.Column('participant_id', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('claimed_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['participant_id'], ['participant.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('seq')
+    )
+    op.create_index('ix_design_slot_open', 'design_slot', ['condition', 'seq'], unique=False,
+                    sqlite_where=sa.text('participant_id IS NULL'),
+                    postgresql_where=sa.text('participant_id IS NULL'))
+    op.create_index('ux_design_slot_participant', 'design_slot', ['participant_id'], unique=True,
+                    sqlite_where=sa.text('participant_id IS NOT NULL'),
+                    postgresql_where=sa.text('participant_id IS NOT NULL'))
+
+
+def downgrade():
+    op.drop_index('ux_design_slot_participant', table_name='design_slot',
+                  sqlite_where=sa.text('participant_id IS NOT NULL'),
+                  postgresql_where=sa.text('participant_id IS NOT NULL'))
+    op.drop_index('ix_design_slot_open', table_name='design_slot',
+                  sqlite_where=sa.text('participant_id IS NULL'),
+                  postgresql_where=sa.text('participant_id IS NULL'))
+    op.drop_table('design_slot')
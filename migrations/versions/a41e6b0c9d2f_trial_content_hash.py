@@ -0,0 +1,61 @@
+"""trial content hash for idempotent seeding
+
+Revision ID: a41e6b0c9d2f
+Revises: 5e7a9c1d2b64
+Create Date: 2025-11-26 09:21:08.447193
+
+Existing trials are hashed in Python. If the same dilemma was seeded more
+than once, only the oldest copy gets the hash; the rest keep NULL (which the
+unique index allows) so their assignments and responses stay valid.
+
+"""
+import hashlib
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a41e6b0c9d2f'
+down_revision = '5e7a9c1d2b64'
+branch_labels = None
+depends_on = None
+
+
+def _content_hash(payload):
+    # frozen copy of app.seeding.content_hash
+    if isinstance(payload, str):
+        payload = json.loads(payload)
+    payload = payload or {}
+    text = payload.get('dilemma_text')
+    if text is not None:
+        key = ' '.join(str(text).split())
+    else:
+        key = json.dumps(payload, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def upgrade():
+    with op.batch_alter_table('trial', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('content_hash', sa.String(length=64), nullable=True))
+
+    conn = op.get_bind()
+    seen = set()
+    rows = []
+    for tid, payload in conn.execute(sa.text("SELECT id, payload FROM trial ORDER BY id")):
+        h = _content_hash(payload)
+        if h not in seen:
+            seen.add(h)
+            rows.append({'tid': tid, 'h': h})
+    if rows:
+        conn.execute(sa.text("UPDATE trial SET content_hash = :h WHERE id = :tid"), rows)
+
+    with op.batch_alter_table('trial', schema=None) as batch_op:
+        batch_op.create_index('ux_trial_content_hash', ['content_hash'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('trial', schema=None) as batch_op:
+        batch_op.drop_index('ux_trial_content_hash')
+        batch_op.drop_column('content_hash')
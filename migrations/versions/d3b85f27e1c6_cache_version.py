@@ -0,0 +1,29 @@
+"""cache version counters
+
+Revision ID: d3b85f27e1c6
+Revises: a41e6b0c9d2f
+Create Date: 2025-11-28 16:02:54.310772
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3b85f27e1c6'
+down_revision = 'a41e6b0c9d2f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('cache_version',
+    sa.Column('name', sa.String(length=32), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.execute(sa.text("INSERT INTO cache_version (name, version) VALUES ('trials', 0)"))
+
+
+def downgrade():
+    op.drop_table('cache_version')
@@ -0,0 +1,77 @@
+"""
+Shared setup for the behavioural tests: a throwaway app on a SQLite file.
+
+A file (not :memory:) because the allocator writer and the ingest flusher
+use their own connections. Each test gets its own directory for the
+database, the ingest journal, metrics and slow-query files.
+"""
+import shutil
+import tempfile
+import time
+from unittest import mock
+
+from sqlalchemy import insert
+
+from app import create_app, db, ingest, trial_queue
+from app.allocator import TrialAllocator
+from app.coverage import ensure_counters
+from app.models import Participant, Trial
+from app.trial_cache import trial_cache
+from config import Config
+
+
+class AppTestCase:
+    """Mixin for unittest.TestCase: self.app, self.dir; override `config`."""
+    config = {}
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='minisurvey-test-')
+        settings = dict(
+            SQLALCHEMY_DATABASE_URI=f'sqlite:///{self.dir}/test.db',
+            STUDY_INGEST_DIR=f'{self.dir}/ingest',
+            STUDY_METRICS_DIR=f'{self.dir}/metrics',
+            STUDY_SLOW_QUERY_DIR=f'{self.dir}/slow',
+            STUDY_TRIAL_CACHE_TTL_S=0,
+        )
+        settings.update(self.config)
+        self.app = create_app(type('TestConfig', (Config,), settings), cli=False)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        # per-process caches keyed by ids that every test database reuses
+        trial_cache.clear()
+        ingest._known_participants.clear()
+        trial_queue._backend = trial_queue._version = None
+        # routes get their own allocator: its writer thread stays bound to the app it started from
+        self.routes_allocator = mock.patch('app.routes.allocator', TrialAllocator())
+        self.routes_allocator.start()
+
+    def tearDown(self):
+        self.routes_allocator.stop()
+        db.session.remove()
+        db.engine.dispose()
+        self.ctx.pop()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def add_trials(self, n):
+        ids = db.session.execute(insert(Trial).returning(Trial.id),
+                                 [{'payload': {'i': i}} for i in range(n)]).scalars().all()
+        ensure_counters(force=True)
+        db.session.commit()
+        return ids
+
+    def add_participant(self, **values):
+        p = Participant(**{'condition': 'control', **values})
+        db.session.add(p)
+        db.session.commit()
+        return p.id
+
+    def scalar(self, sql, **params):
+        return db.session.execute(db.text(sql), params).scalar()
+
+    def wait_for(self, predicate, timeout=10.0):
+        deadline = time.monotonic() + timeout
+        while not predicate():
+            if time.monotonic() > deadline:
+                self.fail('timed out waiting for background work')
+            time.sleep(0.05)
@@ -0,0 +1,40 @@
+"""
+STUDY_ADMIN_TOKEN on the operational endpoints (app/admin.py).
+"""
+import unittest
+
+from tests.helpers import AppTestCase
+
+TOKEN = 's3cret'
+
+
+class AdminTokenTest(AppTestCase, unittest.TestCase):
+    config = {'STUDY_ADMIN_TOKEN': TOKEN}
+    paths = ['/metrics', '/study/pool', '/study/admin/slow-queries']
+
+    def setUp(self):
+        super().setUp()
+        self.client = self.app.test_client()
+
+    def test_refused_without_the_token(self):
+        for path in self.paths:
+            with self.subTest(path=path):
+                self.assertEqual(self.client.get(path).status_code, 403)
+                self.assertEqual(self.client.get(path, query_string={'token': 'wrong'}).status_code, 403)
+
+    def test_query_token_or_bearer_header(self):
+        for path in self.paths:
+            with self.subTest(path=path):
+                self.assertEqual(self.client.get(path, query_string={'token': TOKEN}).status_code, 200)
+                resp = self.client.get(path, headers={'Authorization': f'Bearer {TOKEN}'})
+                self.assertEqual(resp.status_code, 200)
+
+    def test_open_when_no_token_is_configured(self):
+        self.app.config['STUDY_ADMIN_TOKEN'] = None
+        for path in self.paths:
+            with self.subTest(path=path):
+                self.assertEqual(self.client.get(path).status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
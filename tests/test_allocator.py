@@ -0,0 +1,251 @@
+"""
+Trial allocation on SQLite (app/allocator.py): balanced picks, extensions,
+duplicate starts within a batch, errors, abandoned tickets and when the
+writer reloads its coverage index.
+
+Each test gets its own TrialAllocator, since the writer thread stays bound
+to the app it was started from.
+
+The Postgres path (SKIP LOCKED, then the blocking retry) runs only when
+TEST_POSTGRES_URL points at a scratch database; its tables are created in a
+throwaway schema and dropped afterwards.
+"""
+import os
+import threading
+import unittest
+import uuid
+from unittest import mock
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import IntegrityError
+
+from app import allocator as allocator_mod, db
+from app.allocator import SlotRequest, TrialAllocator, _ticket, duplicate_start
+from app.coverage import COVERAGE_KEY, coverage_index
+from app.models import Response
+from app.trial_cache import bump_version
+from tests.helpers import AppTestCase
+
+
+def new(worker=None, assignment=None, condition='control'):
+    return {'condition': condition, 'worker_id': worker, 'assignment_id': assignment}
+
+
+class AllocatorTestCase(AppTestCase, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.trials = self.add_trials(6)
+        self.allocator = TrialAllocator()
+
+    def assignments(self, pid):
+        return db.session.execute(db.text(
+            "SELECT trial_id, order_idx FROM assignment WHERE participant_id = :pid ORDER BY order_idx"
+        ), {'pid': pid}).fetchall()
+
+    def coverage(self):
+        return dict(db.session.execute(db.text("SELECT trial_id, n_assigned FROM trial_coverage")).fetchall())
+
+
+class ReserveTest(AllocatorTestCase):
+    def test_batch_spreads_trials_evenly(self):
+        result = self.allocator.reserve([SlotRequest(new(), 2) for _ in range(3)])
+        picked = [tid for _, tids in result for tid in tids]
+        self.assertEqual(sorted(picked), sorted(self.trials))
+        self.assertEqual(set(self.coverage().values()), {1})
+
+        # a second round goes back over every trial once more
+        result = self.allocator.reserve([SlotRequest(new(), 3) for _ in range(2)])
+        self.assertEqual(set(self.coverage().values()), {2})
+        self.assertEqual(self.scalar('SELECT COUNT(*) FROM participant'), 5)
+
+    def test_extend_skips_excluded_and_continues_order(self):
+        [(pid, first)] = self.allocator.reserve([SlotRequest(new(), 2)])
+        [(same, more)] = self.allocator.reserve([SlotRequest(pid, 2, exclude=first, start_idx=2)])
+        self.assertEqual(same, pid)
+        self.assertFalse(set(first) & set(more))
+        self.assertEqual(self.assignments(pid), [(t, i) for i, t in enumerate(first + more)])
+
+    def test_duplicate_assignment_in_one_batch_creates_one_participant(self):
+        result = self.allocator.reserve([
+            SlotRequest(new('W1', 'A1'), 2),
+            SlotRequest(new('W1', 'A1'), 2),
+            SlotRequest(new('W2', 'A1'), 2),
+        ])
+        self.assertIsNotNone(result[0][0])
+        self.assertEqual(result[1], (None, None))
+        self.assertIsNotNone(result[2][0])
+        self.assertEqual(self.scalar("SELECT COUNT(*) FROM participant WHERE worker_id = 'W1'"), 1)
+        self.assertEqual(sum(self.coverage().values()), 4)
+
+        # and again once the first one is committed
+        [again] = self.allocator.reserve([SlotRequest(new('W1', 'A1'), 2)])
+        self.assertEqual(again, (None, None))
+
+
+class WriterTest(AllocatorTestCase):
+    def serve(self, tickets):
+        with db.engine.connect() as conn:
+            self.allocator._serve(conn, tickets, None)
+
+    def test_error_reaches_every_ticket_in_the_batch(self):
+        tickets = [_ticket([SlotRequest(new(), 2)]), _ticket([SlotRequest(new(), 1), SlotRequest(new(), 1)])]
+        with mock.patch.object(allocator_mod, '_write', side_effect=RuntimeError('disk full')):
+            self.serve(tickets)
+        for t in tickets:
+            self.assertTrue(t['done'].is_set())
+            self.assertIsInstance(t['error'], RuntimeError)
+        self.assertEqual(self.scalar('SELECT COUNT(*) FROM participant'), 0)
+
+        with mock.patch.object(allocator_mod, '_write', side_effect=RuntimeError('disk full')):
+            with self.assertRaises(RuntimeError):
+                self.allocator.reserve([SlotRequest(new(), 2)])
+
+    def test_ticket_abandoned_mid_batch_is_not_written(self):
+        gone, kept = _ticket([SlotRequest(new('W1', 'A1'), 2)]), _ticket([SlotRequest(new('W2', 'A2'), 2)])
+        mark_claimed = allocator_mod.design.mark_claimed
+
+        def abandon_then_claim(*args):
+            gone['abandoned'] = True  # the caller timed out while the batch was open
+            return mark_claimed(*args)
+
+        with mock.patch.object(allocator_mod.design, 'mark_claimed', abandon_then_claim):
+            self.serve([gone, kept])
+        self.assertFalse(gone['done'].is_set())
+        self.assertFalse(kept['done'].is_set())
+        self.assertEqual(self.scalar('SELECT COUNT(*) FROM participant'), 0)
+
+        self.serve([kept])
+        self.assertEqual(len(kept['result'][0][1]), 2)
+        self.assertEqual(self.scalar("SELECT COUNT(*) FROM participant WHERE worker_id = 'W1'"), 0)
+        self.assertEqual(sum(self.coverage().values()), 2)
+
+    def test_abandoned_ticket_is_skipped_by_the_writer(self):
+        gone = _ticket([SlotRequest(new('W1', 'A1'), 2)])
+        gone['abandoned'] = True
+        self.allocator._queue.put(gone)
+        self.allocator.reserve([SlotRequest(new('W2', 'A2'), 2)])
+        self.assertFalse(gone['done'].is_set())
+        self.assertEqual(self.scalar("SELECT COUNT(*) FROM participant WHERE worker_id = 'W1'"), 0)
+
+    def test_index_reloads_only_when_coverage_version_moves(self):
+        with db.engine.connect() as conn, \
+                mock.patch.object(coverage_index, 'load', wraps=coverage_index.load) as load:
+            first = _ticket([SlotRequest(new(), 2)])
+            known = self.allocator._serve(conn, [first], None)
+            known = self.allocator._serve(conn, [_ticket([SlotRequest(new(), 2)])], known)
+            self.assertEqual(load.call_count, 1)  # its own commits keep the index in step
+            [(pid, chosen)] = first['result']
+
+            # a submit from another connection leaves coverage alone
+            db.session.add(Response(participant_id=pid, trial_id=chosen[0], answer={'value': 1}))
+            db.session.commit()
+            known = self.allocator._serve(conn, [_ticket([SlotRequest(new(), 1)])], known)
+            self.assertEqual(load.call_count, 1)
+
+            # an out-of-band coverage writer (reclaim, seeding) does not
+            bump_version(name=COVERAGE_KEY)
+            db.session.commit()
+            self.allocator._serve(conn, [_ticket([SlotRequest(new(), 1)])], known)
+            self.assertEqual(load.call_count, 2)
+        self.assertEqual(sum(self.coverage().values()), 6)
+
+    def test_timeout_abandons_the_ticket_and_start_returns_429(self):
+        self.app.config['STUDY_ALLOCATOR_TIMEOUT_S'] = 0.01
+        with mock.patch.object(self.allocator, '_ensure_writer'):  # nobody serves the queue
+            with self.assertRaises(TimeoutError):
+                self.allocator.reserve([SlotRequest(new(), 2)])
+        self.assertTrue(self.allocator._queue.get_nowait()['abandoned'])
+
+        with mock.patch('app.routes.allocator', self.allocator), \
+                mock.patch.object(self.allocator, '_ensure_writer'):
+            resp = self.app.test_client().post('/study/start', json={'condition': 'control'})
+        self.assertEqual(resp.status_code, 429)
+        self.assertIn('Retry-After', resp.headers)
+
+
+@unittest.skipUnless(os.environ.get('TEST_POSTGRES_URL'), 'set TEST_POSTGRES_URL to test the Postgres allocator')
+class PostgresAllocatorTest(AllocatorTestCase):
+    def setUp(self):
+        url = os.environ['TEST_POSTGRES_URL']
+        self.schema = 'alloc_test_' + uuid.uuid4().hex[:8]
+        self.admin = create_engine(url)
+        with self.admin.begin() as conn:
+            conn.execute(text(f'CREATE SCHEMA {self.schema}'))
+        scoped = f"{url}{'&' if '?' in url else '?'}options=-csearch_path%3D{self.schema}"
+        self.config = {**self.config, 'SQLALCHEMY_DATABASE_URI': scoped}
+        super().setUp()
+        self.other = create_engine(scoped)
+
+    def tearDown(self):
+        self.other.dispose()
+        super().tearDown()
+        with self.admin.begin() as conn:
+            conn.execute(text(f'DROP SCHEMA {self.schema} CASCADE'))
+        self.admin.dispose()
+
+    def hold(self, conn, tids):
+        """Lock trial_coverage rows in another transaction, like a concurrent start."""
+        conn.execute(text("SELECT trial_id FROM trial_coverage WHERE trial_id = ANY(:t) FOR UPDATE"),
+                     {'t': list(tids)})
+
+    def in_thread(self, fn):
+        out = {}
+
+        def run():
+            with self.app.app_context():
+                try:
+                    out['result'] = fn()
+                except Exception as e:
+                    out['error'] = e
+                finally:
+                    db.session.remove()
+        thread = threading.Thread(target=run)
+        thread.start()
+        return thread, out
+
+    def test_skip_locked_takes_only_free_rows(self):
+        with self.other.connect() as conn:
+            self.hold(conn, self.trials[:4])
+            [(_, chosen)] = self.allocator._try_locked([SlotRequest(new(), 2)], wait=False)
+            self.assertEqual(sorted(chosen), sorted(self.trials[4:]))
+            db.session.rollback()
+
+            # too few free rows: the first attempt gives up instead of waiting
+            self.assertIsNone(self.allocator._try_locked([SlotRequest(new(), 3)], wait=False))
+            db.session.rollback()
+        self.assertEqual(self.scalar('SELECT COUNT(*) FROM participant'), 0)
+
+    def test_short_attempt_waits_for_held_rows(self):
+        with self.other.connect() as conn:
+            self.hold(conn, self.trials)
+            thread, out = self.in_thread(lambda: self.allocator.reserve([SlotRequest(new(), 2)]))
+            thread.join(0.5)
+            self.assertTrue(thread.is_alive())  # blocked behind the held rows
+            conn.rollback()
+        thread.join(10)
+        [(pid, chosen)] = out['result']
+        self.assertEqual(len(chosen), 2)
+        self.assertEqual(sum(self.coverage().values()), 2)
+
+    def test_concurrent_starts_take_disjoint_trials(self):
+        threads = [self.in_thread(lambda: self.allocator.reserve([SlotRequest(new(), 2)])) for _ in range(3)]
+        for thread, _ in threads:
+            thread.join(10)
+        picked = [tid for _, out in threads for _, tids in out['result'] for tid in tids]
+        self.assertEqual(sorted(picked), sorted(self.trials))
+        self.assertEqual(set(self.coverage().values()), {1})
+
+    def test_racing_duplicate_start_is_recognised(self):
+        with self.other.connect() as conn:
+            conn.execute(text(
+                "INSERT INTO participant (condition, worker_id, assignment_id) VALUES ('ai', 'W1', 'A1')"))
+            thread, out = self.in_thread(lambda: self.allocator.reserve([SlotRequest(new('W1', 'A1'), 2)]))
+            thread.join(0.5)  # blocked on the unique index until the other start commits
+            conn.commit()
+        thread.join(10)
+        self.assertIsInstance(out['error'], IntegrityError)
+        self.assertTrue(duplicate_start(out['error']))
+
+
+if __name__ == '__main__':
+    unittest.main()
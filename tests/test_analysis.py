@@ -0,0 +1,95 @@
+"""
+Study analysis (app/analysis.py) on a small fixed dataset: point estimates
+per condition and against control, and seeded bootstrap CIs that do not
+depend on how many worker processes drew them.
+"""
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from app.analysis import CHUNK, StudyData, analyze, bootstrap
+
+nan = np.nan
+
+# (participant, condition, answer, gt, ai, revealed)
+RESPONSES = [
+    (0, 0, 3, 3, 4, False),
+    (0, 0, 4, nan, 4, True),   # no GT: counts for reveal_rate and agreement only
+    (1, 0, 1, 2, nan, False),
+    (2, 1, 5, 3, 5, True),
+    (3, 1, 2, 2, 3, False),
+]
+
+
+def study_data(responses=RESPONSES):
+    col = list(zip(*responses))
+    n = len(responses)
+    return StudyData(
+        participant=np.array(col[0]), participant_ids=np.arange(max(col[0]) + 1) + 10,
+        condition=np.array(col[1]), conditions=['control', 'ai'],
+        trial_id=np.arange(n), answer=np.array(col[2], dtype=float),
+        gt=np.array(col[3], dtype=float), ai=np.array(col[4], dtype=float),
+        revealed=np.array(col[5], dtype=bool), ai_confidence=np.full(n, 0.7),
+        rt_ms=100.0 * np.arange(1, n + 1),
+    )
+
+
+def estimates(result, cond):
+    return {k: v['estimate'] for k, v in result['conditions'][cond]['stats'].items()}
+
+
+class PointEstimateTest(unittest.TestCase):
+    def setUp(self):
+        self.result = analyze(study_data(), resamples=0)
+
+    def test_per_condition(self):
+        control, ai = estimates(self.result, 'control'), estimates(self.result, 'ai')
+        self.assertAlmostEqual(control['mae'], 0.5)
+        self.assertAlmostEqual(control['bias'], -0.5)
+        self.assertAlmostEqual(control['reveal_rate'], 1 / 3)  # over every response, not just GT-scored
+        self.assertAlmostEqual(control['ai_agreement'], 0.5)
+        self.assertAlmostEqual(ai['mae'], 1.0)
+        self.assertAlmostEqual(ai['bias'], 1.0)
+        self.assertAlmostEqual(ai['reveal_rate'], 0.5)
+        self.assertAlmostEqual(ai['ai_agreement'], 0.5)
+        self.assertAlmostEqual(ai['reveal_mae_effect'], 2.0)
+        self.assertEqual(self.result['conditions']['control']['n_participants'], 2)
+        self.assertEqual(self.result['conditions']['control']['n_responses'], 3)
+
+    def test_contrasts_against_control(self):
+        contrast = {k: v['estimate'] for k, v in self.result['contrasts_vs_control']['ai'].items()}
+        self.assertAlmostEqual(contrast['mae'], 0.5)
+        self.assertAlmostEqual(contrast['bias'], 1.5)
+        self.assertAlmostEqual(contrast['reveal_rate'], 0.5 - 1 / 3)
+
+    def test_unresampled_ci_is_empty(self):
+        self.assertIsNone(self.result['conditions']['ai']['stats']['mae']['ci_low'])
+
+
+class BootstrapTest(unittest.TestCase):
+    def test_seeded_draws_do_not_depend_on_the_pool(self):
+        rng = np.random.default_rng(0)
+        num, den = rng.integers(0, 5, (6, 3)).astype(float), np.full((6, 3), 4.0)
+        resamples = 2 * CHUNK + 10
+        alone = bootstrap(num, den, resamples, seed=7)
+        self.assertEqual(alone.shape, (resamples, 3))
+        with ProcessPoolExecutor(max_workers=2) as pool:
+            np.testing.assert_array_equal(alone, bootstrap(num, den, resamples, seed=7, pool=pool))
+        self.assertFalse(np.array_equal(alone, bootstrap(num, den, resamples, seed=8)))
+
+    def test_seeded_cis_match_across_runs_and_worker_counts(self):
+        rng = np.random.default_rng(1)
+        responses = [(p, p % 2, rng.integers(1, 6), rng.integers(1, 6), rng.integers(1, 6), rng.random() < 0.5)
+                     for p in range(40) for _ in range(5)]
+        data = study_data(responses)
+        one = analyze(data, resamples=2500, seed=7, workers=1)
+        self.assertEqual(one, analyze(data, resamples=2500, seed=7, workers=1))
+        self.assertEqual(one, analyze(data, resamples=2500, seed=7, workers=2))
+
+        mae = one['conditions']['control']['stats']['mae']
+        self.assertLessEqual(mae['ci_low'], mae['estimate'])
+        self.assertGreaterEqual(mae['ci_high'], mae['estimate'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+"""
+Built study assets (app/assets.py): WebP banners sized for where the hero
+is actually shown, the srcset the study pages point at them with, and no
+third-party web fonts.
+"""
+import os
+import re
+import unittest
+from io import BytesIO
+from unittest import mock
+
+from app import assets
+from tests.helpers import AppTestCase
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+@unittest.skipIf(Image is None, 'the WebP banners need Pillow')
+class HeroTest(AppTestCase, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        out = os.path.join(self.dir, 'dist')
+        patcher = mock.patch('app.assets.dist_dir', return_value=out)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(assets._manifest.clear)
+        self.manifest = assets.build(out)
+        self.out = out
+
+    def width(self, name):
+        with open(os.path.join(self.out, self.manifest[name]), 'rb') as f:
+            return Image.open(BytesIO(f.read())).size[0]
+
+    def test_variants_stop_at_the_source_width(self):
+        with Image.open(os.path.join(self.app.static_folder, assets.HERO)) as src:
+            source_width = src.size[0]
+        webp = sorted(n for n in self.manifest if n.endswith('.webp'))
+        self.assertEqual(webp, [f'img/dilemma-{w}w.webp' for w in sorted(
+            {min(w, source_width) for w in assets.HERO_WIDTHS})])
+        for name in webp:
+            self.assertEqual(self.width(name), int(re.search(r'-(\d+)w', name).group(1)))
+
+    def test_pages_offer_the_srcset(self):
+        html = self.app.test_client().get('/study').get_data(as_text=True)
+        source = re.search(r'<source type="image/webp" srcset="([^"]+)" sizes="([^"]+)">', html)
+        self.assertIsNotNone(source, html)
+        self.assertEqual([w for _, w in re.findall(r'(/assets/\S+) (\d+)w', source.group(1))],
+                         [str(self.width(n)) for n in sorted(
+                             (n for n in self.manifest if n.endswith('.webp')), key=self.width)])
+        self.assertEqual(source.group(2), assets.HERO_SIZES)
+
+    def test_no_template_loads_web_fonts(self):
+        templates = os.path.join(self.app.root_path, 'templates')
+        for name in os.listdir(templates):
+            with open(os.path.join(templates, name), encoding='utf-8') as f:
+                self.assertNotIn('fonts.googleapis.com', f.read(), name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+"""
+/study/block (app/routes.py): the participant's assigned trials in
+assignment order with their payloads, and gzip when the client accepts it.
+"""
+import gzip
+import json
+import unittest
+
+from app import db
+from app.models import Response
+from tests.helpers import AppTestCase
+
+
+class BlockTest(AppTestCase, unittest.TestCase):
+    config = {'STUDY_TRIALS_PER_PARTICIPANT': 4}
+
+    def setUp(self):
+        super().setUp()
+        self.trials = self.add_trials(6)
+        for tid in self.trials:
+            db.session.execute(db.text("UPDATE trial SET payload = :p WHERE id = :id"),
+                               {'p': json.dumps({'dilemma_text': f'Dilemma {tid}. ' + 'x' * 200}), 'id': tid})
+        db.session.commit()
+        self.client = self.app.test_client()
+        self.pid = self.client.post('/study/start', json={'condition': 'ai'}).get_json()['participant_id']
+        self.assigned = [r[0] for r in db.session.execute(db.text(
+            "SELECT trial_id FROM assignment WHERE participant_id = :pid ORDER BY order_idx"
+        ), {'pid': self.pid})]
+
+    def block(self, headers=None, **params):
+        resp = self.client.get('/study/block', query_string={'participant_id': self.pid, **params},
+                               headers=headers or {})
+        self.assertEqual(resp.status_code, 200)
+        return resp
+
+    def test_holds_the_assigned_trials_in_order(self):
+        body = self.block().get_json()
+        self.assertEqual(body['participant_id'], self.pid)
+        self.assertEqual([t['trial_id'] for t in body['trials']], self.assigned)
+        self.assertEqual([t['order'] for t in body['trials']], [0, 1, 2, 3])
+        for t in body['trials']:
+            self.assertEqual(t['payload']['dilemma_text'][:len(f"Dilemma {t['trial_id']}.")],
+                             f"Dilemma {t['trial_id']}.")
+
+    def test_answered_trials_are_left_out(self):
+        db.session.add(Response(participant_id=self.pid, trial_id=self.assigned[0], answer={'value': 2}))
+        db.session.commit()
+        rest = self.block(after=self.assigned[0]).get_json()['trials']
+        self.assertEqual([t['trial_id'] for t in rest], self.assigned[1:])
+
+    def test_gzip_only_when_accepted(self):
+        plain = self.block()
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertIn('Accept-Encoding', plain.headers['Vary'])
+        self.assertEqual(plain.headers['Cache-Control'], 'no-store')
+
+        zipped = self.block(headers={'Accept-Encoding': 'br;q=1.0, gzip;q=0.8'})
+        self.assertEqual(zipped.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', zipped.headers['Vary'])
+        self.assertLess(len(zipped.get_data()), len(plain.get_data()))
+        self.assertEqual(gzip.decompress(zipped.get_data()), plain.get_data())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+"""
+CoverageIndex (app/coverage.py): picks stay balanced as they are bumped,
+ties are broken at random rather than by trial id, and exclusions and
+releases are honoured.
+"""
+import random
+import unittest
+from collections import Counter
+
+from app.coverage import CoverageIndex
+
+
+def index(counts):
+    idx = CoverageIndex()
+    idx.load(counts.items())
+    return idx
+
+
+class PickTest(unittest.TestCase):
+    def setUp(self):
+        random.seed(3)
+
+    def test_picks_lowest_counts_first(self):
+        idx = index({1: 2, 2: 0, 3: 1, 4: 0, 5: 3})
+        self.assertEqual(sorted(idx.pick(2)), [2, 4])
+        self.assertEqual(sorted(idx.pick(3)), [2, 3, 4])
+        self.assertEqual(sorted(idx.pick(10)), [1, 2, 3, 4, 5])
+
+    def test_repeated_pick_and_bump_stays_balanced(self):
+        counts = Counter({tid: 0 for tid in range(10)})
+        idx = index(counts)
+        for n in (3, 4, 2, 5, 3, 1, 4, 3):
+            chosen = idx.pick(n)
+            self.assertEqual(len(set(chosen)), n)
+            idx.bump(chosen)
+            counts.update(chosen)
+            self.assertLessEqual(max(counts.values()) - min(counts.values()), 1)
+
+    def test_ties_are_broken_at_random(self):
+        idx = index({tid: 0 for tid in range(8)})
+        firsts = Counter(idx.pick(1)[0] for _ in range(400))
+        self.assertEqual(set(firsts), set(range(8)))  # not always the lowest id
+        self.assertLess(max(firsts.values()), 100)
+
+    def test_exclude_is_skipped_even_when_cheapest(self):
+        idx = index({1: 0, 2: 0, 3: 1, 4: 1})
+        for _ in range(20):
+            chosen = idx.pick(2, exclude=[1])
+            self.assertNotIn(1, chosen)
+            self.assertIn(2, chosen)
+            self.assertEqual(len(chosen), 2)
+
+    def test_release_moves_down_but_not_below_zero(self):
+        idx = index({1: 1, 2: 1, 3: 0})
+        idx.bump([1], delta=-1)
+        self.assertEqual(sorted(idx.pick(2)), [1, 3])
+        idx.bump([3, 3], delta=-1)
+        idx.bump([99])  # unknown ids are ignored
+        self.assertEqual(len(idx), 3)
+        self.assertEqual(sorted(idx.pick(2)), [1, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
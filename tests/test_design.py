@@ -0,0 +1,61 @@
+"""
+Precomputed designs (app/design.py): exact balance of a full round, the
+Williams orders, and slots that don't match the requested block size.
+"""
+import unittest
+from collections import Counter
+from datetime import datetime
+
+from app import db, design
+from app.allocator import SlotRequest, TrialAllocator
+from app.design import balance, build_schedule, williams_rows
+from tests.helpers import AppTestCase
+
+
+class ScheduleTest(unittest.TestCase):
+    def test_full_rounds_show_every_trial_equally_per_condition(self):
+        trials = list(range(100, 110))  # v=10, k=4: 5 groups a round, each trial twice
+        slots = build_schedule(trials, 4, ['control', 'ai'], participants=20, seed=7)
+        self.assertEqual(len(slots), 20)
+        for condition in ('control', 'ai'):
+            counts = Counter(t for c, block in slots if c == condition for t in block)
+            self.assertEqual(counts, {t: 4 for t in trials})
+            self.assertTrue(all(len(set(block)) == 4 for c, block in slots if c == condition))
+        # each group is the same block, once per condition
+        self.assertEqual([b for c, b in slots if c == 'control'], [b for c, b in slots if c == 'ai'])
+        for condition, b in balance(slots).items():
+            self.assertEqual((b['slots'], b['trials'], b['per_trial']), (10, 10, (4, 4)), condition)
+
+    def test_partial_round_is_rounded_up_to_whole_groups(self):
+        slots = build_schedule(range(6), 3, ['control', 'ai'], participants=5, seed=1)
+        self.assertEqual(Counter(c for c, _ in slots), {'control': 3, 'ai': 3})
+
+    def test_rejects_blocks_larger_than_the_pool(self):
+        with self.assertRaises(ValueError):
+            build_schedule(range(3), 4, ['control'], participants=1)
+
+    def test_williams_rows_balance_positions_and_predecessors(self):
+        for k in (4, 5):
+            rows = williams_rows(k)
+            self.assertEqual(len(rows), k if k % 2 == 0 else 2 * k)
+            for pos in range(k):
+                self.assertEqual(Counter(r[pos] for r in rows), {x: len(rows) // k for x in range(k)})
+            pairs = Counter((r[i], r[i + 1]) for r in rows for i in range(k - 1))
+            self.assertEqual(set(pairs.values()), {len(rows) // k})
+            self.assertEqual(len(pairs), k * (k - 1))
+
+
+class ClaimTest(AppTestCase, unittest.TestCase):
+    def test_slot_of_the_wrong_size_is_not_claimed(self):
+        trials = self.add_trials(6)
+        design.store(db.session, [('control', trials[:3])])
+        db.session.commit()
+        with self.assertLogs('app.design', 'WARNING'):
+            [(pid, chosen)] = TrialAllocator().reserve(
+                [SlotRequest({'condition': 'control', 'created_at': datetime.utcnow()}, 2)])
+        self.assertEqual(len(chosen), 2)
+        self.assertIsNone(self.scalar('SELECT participant_id FROM design_slot'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+"""
+/study/events (app/routes.py): batched AI UI events, written directly or
+through the write-behind buffer; a bad row rejects the whole batch, and
+navigator.sendBeacon's text/plain body is accepted.
+"""
+import json
+import unittest
+from unittest import mock
+
+from app.ingest import IngestBuffer
+from tests.helpers import AppTestCase
+
+
+class EventsTestCase(AppTestCase, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.trials = self.add_trials(2)
+        self.pid = self.add_participant(condition='ai')
+        self.client = self.app.test_client()
+
+    def event(self, trial_id, event_type='reveal_ai', **extra):
+        return {'participant_id': self.pid, 'trial_id': trial_id, 'event_type': event_type,
+                'payload': {'t': 1}, **extra}
+
+    def events(self):
+        return self.scalar('SELECT COUNT(*) FROM ai_event')
+
+
+class DirectEventsTest(EventsTestCase):
+    def test_valid_batch_is_written(self):
+        resp = self.client.post('/study/events', json={'events': [self.event(t) for t in self.trials]})
+        self.assertEqual(resp.get_json(), {'ok': True, 'count': 2})
+        self.assertEqual(self.events(), 2)
+        self.assertEqual(self.scalar("SELECT payload FROM ai_event LIMIT 1"), '{"t": 1}')
+
+    def test_bare_list_and_empty_batch(self):
+        self.assertEqual(self.client.post('/study/events', json=[self.event(self.trials[0])]).get_json()['count'], 1)
+        self.assertEqual(self.client.post('/study/events', json={'events': []}).get_json(), {'ok': True, 'count': 0})
+        self.assertEqual(self.events(), 1)
+
+    def test_bad_row_rejects_the_batch(self):
+        for bad in ({'trial_id': self.trials[1]},                     # no participant_id
+                    self.event(self.trials[1], participant_id='x'),
+                    self.event(self.trials[1], event_type='e' * 1000)):
+            resp = self.client.post('/study/events', json={'events': [self.event(self.trials[0]), bad]})
+            self.assertEqual(resp.status_code, 400)
+            self.assertEqual(resp.get_json(), {'ok': False, 'error': 'bad event'})
+        self.assertEqual(self.client.post('/study/events', json={'events': 'nope'}).status_code, 400)
+        self.assertEqual(self.client.post('/study/events', data='not json').status_code, 400)
+        self.assertEqual(self.events(), 0)
+
+    def test_send_beacon_text_plain_body(self):
+        body = json.dumps({'events': [self.event(t) for t in self.trials]})
+        resp = self.client.post('/study/events', data=body, content_type='text/plain;charset=UTF-8')
+        self.assertEqual(resp.get_json(), {'ok': True, 'count': 2})
+        self.assertEqual(self.events(), 2)
+
+
+class BufferedEventsTest(EventsTestCase):
+    config = {'STUDY_INGEST_MODE': 'buffered', 'STUDY_INGEST_FLUSH_MS': 20}
+
+    def setUp(self):
+        super().setUp()
+        buffer = mock.patch('app.routes.ingest_buffer', IngestBuffer())
+        buffer.start()
+        self.addCleanup(buffer.stop)
+
+    def test_valid_batch_is_queued_and_flushed(self):
+        body = json.dumps([self.event(t) for t in self.trials])
+        resp = self.client.post('/study/events', data=body, content_type='text/plain')
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(resp.get_json(), {'ok': True, 'queued': True, 'count': 2})
+        self.wait_for(lambda: self.events() == 2)
+
+    def test_unknown_trial_rejects_the_batch(self):
+        resp = self.client.post('/study/events', json=[self.event(self.trials[0]), self.event(999)])
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(self.events(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+"""
+/study/export incremental polling: the settle window behind X-Next-Since-Id,
+full exports that are not held back by it, and the trials version in the
+ETag.
+"""
+import unittest
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+from app import db
+from app.models import Response
+from app.trial_cache import bump_version
+from tests.helpers import AppTestCase
+
+
+class ExportCursorTest(AppTestCase, unittest.TestCase):
+    config = {'STUDY_EXPORT_SETTLE_S': 60}
+
+    def setUp(self):
+        super().setUp()
+        self.trials = self.add_trials(3)
+        self.pid = self.add_participant()
+        self.client = self.app.test_client()
+
+    def add_response(self, trial_id, age_s):
+        stored_at = datetime.utcnow() - timedelta(seconds=age_s)
+        rid = db.session.execute(insert(Response).returning(Response.id), [{
+            'participant_id': self.pid, 'trial_id': trial_id, 'answer': {'value': 1},
+            'created_at': stored_at, 'stored_at': stored_at,
+        }]).scalar()
+        db.session.commit()
+        return rid
+
+    def poll(self, headers=None, **params):
+        resp = self.client.get('/study/export', query_string={'format': 'json', **params},
+                               headers=headers or {})
+        resp.get_data()  # drain and close the streamed body inside the test
+        resp.close()
+        return resp
+
+    def test_cursor_stops_before_unsettled_responses(self):
+        old = self.add_response(self.trials[0], age_s=120)
+        self.add_response(self.trials[1], age_s=1)
+
+        resp = self.poll(since_id=0)
+        self.assertEqual([r['response_id'] for r in resp.get_json()], [old])
+        self.assertEqual(resp.headers['X-Next-Since-Id'], str(old))
+
+    def test_full_export_includes_unsettled_responses(self):
+        recent = self.add_response(self.trials[0], age_s=0)  # right after a submit
+        resp = self.client.get('/study/export')
+        body = resp.get_data(as_text=True)
+        resp.close()
+        self.assertEqual(len(body.splitlines()), 2)  # header + the new row
+        self.assertIn(f'\r\n{recent},{self.pid},', body)
+        self.assertEqual(resp.headers['X-Next-Since-Id'], '0')  # nothing settled to poll from yet
+
+        # the next incremental poll repeats it once it has settled, never skips it
+        db.session.execute(db.text("UPDATE response SET stored_at = :t WHERE id = :id"),
+                           {'t': datetime.utcnow() - timedelta(seconds=90), 'id': recent})
+        db.session.commit()
+        resp = self.poll(since_id=0)
+        self.assertEqual([r['response_id'] for r in resp.get_json()], [recent])
+
+    def test_full_export_etag_follows_new_responses(self):
+        self.add_response(self.trials[0], age_s=120)
+        etag = self.poll().headers['ETag']
+        self.add_response(self.trials[1], age_s=0)
+        self.assertEqual(self.poll(headers={'If-None-Match': etag}).status_code, 200)
+
+    def test_unsettled_response_comes_with_a_later_poll(self):
+        self.add_response(self.trials[0], age_s=120)
+        recent = self.add_response(self.trials[1], age_s=1)
+        cursor = self.poll().headers['X-Next-Since-Id']
+
+        db.session.execute(db.text("UPDATE response SET stored_at = :t WHERE id = :id"),
+                           {'t': datetime.utcnow() - timedelta(seconds=90), 'id': recent})
+        db.session.commit()
+        resp = self.poll(since_id=cursor)
+        self.assertEqual([r['response_id'] for r in resp.get_json()], [recent])
+        self.assertEqual(resp.headers['X-Next-Since-Id'], str(recent))
+
+    def test_unchanged_poll_is_304_until_trials_change(self):
+        self.add_response(self.trials[0], age_s=120)
+        first = self.poll()
+        self.assertEqual(first.status_code, 200)
+        etag = first.headers['ETag']
+
+        again = self.poll(headers={'If-None-Match': etag})
+        self.assertEqual(again.status_code, 304)
+
+        bump_version()
+        db.session.commit()
+        changed = self.poll(headers={'If-None-Match': etag})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed.headers['ETag'], etag)
+
+    def test_if_modified_since_is_ignored_after_trials_change(self):
+        self.add_response(self.trials[0], age_s=120)
+        last_modified = self.poll().headers['Last-Modified']
+        headers = {'If-Modified-Since': last_modified}
+        self.assertEqual(self.poll(headers=headers).status_code, 304)
+
+        bump_version()
+        db.session.commit()
+        self.assertEqual(self.poll(headers=headers).status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+"""
+`flask import-ai-confidence` (app/cli.py): a dry run writes nothing, a real
+import updates Trial.ai_confidence and bumps the trials cache version.
+"""
+import os
+import unittest
+
+from app import db
+from app.cli import import_ai_confidence
+from app.trial_cache import VERSION_KEY
+from tests.helpers import AppTestCase
+
+
+class ImportAIConfidenceTest(AppTestCase, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.trials = self.add_trials(3)
+        db.session.execute(db.text("UPDATE trial SET ai_confidence = 0.5"))
+        db.session.commit()
+        self.csv = os.path.join(self.dir, 'confidence.csv')
+        with open(self.csv, 'w', encoding='utf-8') as f:
+            f.write('trial_id,ai_confidence,ai_confidence_pct\n')
+            f.write(f'{self.trials[0]},0.9,\n')
+            f.write(f'{self.trials[1]},,80\n')
+            f.write(f'{self.trials[2]},0.5,\n')  # unchanged
+            f.write('999,0.7,\n')
+
+    def run_import(self, *args):
+        result = self.app.test_cli_runner().invoke(import_ai_confidence, [self.csv, *args])
+        self.assertEqual(result.exit_code, 0, result.output)
+        db.session.expire_all()
+        return result.output
+
+    def confidences(self):
+        return dict(db.session.execute(db.text("SELECT id, ai_confidence FROM trial")).fetchall())
+
+    def version(self):
+        return self.scalar('SELECT version FROM cache_version WHERE name = :name', name=VERSION_KEY) or 0
+
+    def test_dry_run_writes_nothing(self):
+        output = self.run_import('--dry-run')
+        self.assertIn('would update 2 trials (1 unchanged)', output)
+        self.assertIn(f'trial {self.trials[0]}: 0.5 -> 0.9', output)
+        self.assertIn('1 trial ids not found: 999', output)
+        self.assertEqual(set(self.confidences().values()), {0.5})
+        self.assertEqual(self.version(), 0)
+
+    def test_import_updates_trials_and_bumps_the_cache_version(self):
+        output = self.run_import()
+        self.assertIn('updated 2 trials (1 unchanged)', output)
+        self.assertEqual(self.confidences(), {self.trials[0]: 0.9, self.trials[1]: 0.8, self.trials[2]: 0.5})
+        self.assertEqual(self.version(), 1)
+
+        # nothing left to change: no write, no bump
+        self.assertIn('updated 0 trials (3 unchanged)', self.run_import())
+        self.assertEqual(self.version(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
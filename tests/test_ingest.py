@@ -0,0 +1,184 @@
+"""
+Write-behind ingestion (app/ingest.py): journal replay (also at worker
+boot), backpressure, the flusher's retry of transient errors and its
+dead-lettering of rows the database rejects.
+"""
+import fcntl
+import json
+import os
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from sqlalchemy.exc import OperationalError
+
+from app import ingest
+from app.ingest import BufferFull, IngestBuffer, response_row
+from tests.helpers import AppTestCase
+
+
+class IngestTestCase(AppTestCase, unittest.TestCase):
+    config = {'STUDY_INGEST_MODE': 'buffered', 'STUDY_INGEST_FLUSH_MS': 20}
+
+    def setUp(self):
+        super().setUp()
+        self.trials = self.add_trials(4)
+        self.pid = self.add_participant()
+        self.buffer = IngestBuffer()
+
+    def response(self, trial_id, **extra):
+        return response_row({'participant_id': self.pid, 'trial_id': trial_id,
+                             'answer': {'value': 3}, **extra})
+
+    def responses(self):
+        return self.scalar('SELECT COUNT(*) FROM response')
+
+    def dead_letters(self):
+        path = os.path.join(self.app.config['STUDY_INGEST_DIR'], ingest.DEAD_LETTER)
+        if not os.path.exists(path):
+            return []
+        with open(path, encoding='utf-8') as f:
+            return [json.loads(line) for line in f]
+
+    def write_segment(self, name, items):
+        os.makedirs(self.app.config['STUDY_INGEST_DIR'], exist_ok=True)
+        path = os.path.join(self.app.config['STUDY_INGEST_DIR'], name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(''.join(ingest._encode(kind, row) for kind, row in items))
+        return path
+
+
+class FlushTest(IngestTestCase):
+    def test_rows_are_written_and_journal_removed(self):
+        self.buffer.enqueue_many('response', [self.response(t) for t in self.trials])
+        self.wait_for(lambda: self.buffer.depth == 0)
+        self.assertEqual(self.responses(), 4)
+        self.wait_for(lambda: not [s for s in self.buffer._segments if s.sealed])
+
+    def test_poison_row_is_dead_lettered_and_queue_drains(self):
+        bad = dict(self.response(self.trials[1]), participant_id=None)  # NOT NULL violation
+        self.buffer.enqueue_many('response', [self.response(self.trials[0]), bad, self.response(self.trials[2])])
+        self.wait_for(lambda: self.buffer.depth == 0)
+        self.assertEqual(self.responses(), 2)
+        [dead] = self.dead_letters()
+        self.assertEqual(dead['kind'], 'response')
+        self.assertEqual(dead['row']['trial_id'], self.trials[1])
+
+        # later rows are not stuck behind it
+        self.buffer.enqueue('response', self.response(self.trials[3]))
+        self.wait_for(lambda: self.buffer.depth == 0)
+        self.assertEqual(self.responses(), 3)
+
+    def test_transient_error_retries_the_batch(self):
+        real = ingest.bulk_insert
+        calls = []
+
+        def flaky(items):
+            calls.append(len(items))
+            if len(calls) == 1:
+                raise OperationalError('INSERT', {}, Exception('database is down'))
+            return real(items)
+
+        with mock.patch.object(ingest, 'bulk_insert', flaky):
+            self.buffer.enqueue_many('response', [self.response(t) for t in self.trials[:2]])
+            self.wait_for(lambda: self.buffer.depth == 0)
+        self.assertGreaterEqual(len(calls), 2)
+        self.assertEqual(self.responses(), 2)
+        self.assertEqual(self.dead_letters(), [])
+
+
+class ReplayTest(IngestTestCase):
+    def test_orphaned_segment_is_replayed_on_start(self):
+        poison = dict(self.response(self.trials[2]), participant_id=None)
+        path = self.write_segment('4242-0-1.jsonl', [
+            ('response', self.response(self.trials[0])),
+            ('response', poison),
+            ('event', {'participant_id': self.pid, 'trial_id': self.trials[1],
+                       'event_type': 'ai_shown', 'payload': None, 'created_at': datetime.utcnow()}),
+        ])
+        self.buffer._ensure_started()
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(self.responses(), 1)
+        self.assertEqual(self.scalar('SELECT COUNT(*) FROM ai_event'), 1)
+        self.assertEqual(len(self.dead_letters()), 1)
+
+    def test_replayed_duplicates_are_skipped(self):
+        row = self.response(self.trials[0])
+        self.write_segment('4242-0-1.jsonl', [('response', row), ('response', row)])
+        self.buffer._ensure_started()
+        self.assertEqual(self.responses(), 1)
+        self.assertEqual(self.dead_letters(), [])
+
+    def test_buffered_worker_replays_at_boot(self):
+        path = self.write_segment('4242-0-1.jsonl', [('response', self.response(self.trials[0]))])
+        with mock.patch('app.ingest.ingest_buffer', self.buffer):
+            ingest.start_buffered(self.app)  # gunicorn's post_worker_init, before any request
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(self.responses(), 1)
+        [segment] = self.buffer._segments  # this worker's own, fresh and locked
+        self.assertTrue(segment.path.endswith('.jsonl'))
+        self.assertEqual(os.listdir(self.app.config['STUDY_INGEST_DIR']), [os.path.basename(segment.path)])
+
+    def test_direct_mode_does_not_start_at_boot(self):
+        self.app.config['STUDY_INGEST_MODE'] = 'direct'
+        path = self.write_segment('4242-0-1.jsonl', [('response', self.response(self.trials[0]))])
+        with mock.patch('app.ingest.ingest_buffer', self.buffer):
+            ingest.start_buffered(self.app)
+        self.assertIsNone(self.buffer._thread)
+        self.assertTrue(os.path.exists(path))
+
+    def test_segment_locked_by_a_live_worker_is_left_alone(self):
+        path = self.write_segment('4243-0-1.jsonl', [('response', self.response(self.trials[0]))])
+        with open(path, 'a') as held:
+            fcntl.flock(held, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self.buffer._ensure_started()
+            self.assertTrue(os.path.exists(path))
+            self.assertEqual(self.responses(), 0)
+
+
+class BackpressureTest(IngestTestCase):
+    config = dict(IngestTestCase.config, STUDY_INGEST_QUEUE_MAX=3)
+
+    def test_enqueue_is_all_or_nothing(self):
+        with self.assertRaises(BufferFull):
+            self.buffer.enqueue_many('response', [self.response(t) for t in self.trials])
+        self.assertEqual(self.buffer.depth, 0)
+        self.assertEqual(self.buffer._segment.fh.tell(), 0)  # nothing journaled
+
+    def test_full_buffer_answers_429(self):
+        events = [{'participant_id': self.pid, 'trial_id': t, 'event_type': 'ai_shown'} for t in self.trials]
+        with mock.patch('app.routes.ingest_buffer', self.buffer):
+            resp = self.app.test_client().post('/study/events', json={'events': events})
+        self.assertEqual(resp.status_code, 429)
+        self.assertIn('Retry-After', resp.headers)
+
+
+class ValidationTest(IngestTestCase):
+    def post(self, path, body):
+        with mock.patch('app.routes.ingest_buffer', self.buffer):
+            return self.app.test_client().post(path, json=body)
+
+    def test_unknown_participant_or_trial_is_rejected_before_buffering(self):
+        self.assertEqual(self.post('/study/submit', {'participant_id': self.pid + 99,
+                                                     'trial_id': self.trials[0]}).status_code, 400)
+        self.assertEqual(self.post('/study/submit', {'participant_id': self.pid,
+                                                     'trial_id': 10 ** 6}).status_code, 400)
+        self.assertEqual(self.post('/study/submit', {'participant_id': 2 ** 40,
+                                                     'trial_id': self.trials[0]}).status_code, 400)
+        self.assertEqual(self.buffer.depth, 0)
+
+    def test_oversized_event_type_is_rejected(self):
+        resp = self.post('/study/event', {'participant_id': self.pid, 'trial_id': self.trials[0],
+                                          'event_type': 'x' * 65})
+        self.assertEqual(resp.status_code, 400)
+
+    def test_valid_submit_is_queued(self):
+        resp = self.post('/study/submit', {'participant_id': self.pid, 'trial_id': self.trials[0],
+                                           'answer': {'value': 2}})
+        self.assertEqual(resp.status_code, 202)
+        self.wait_for(lambda: self.buffer.depth == 0)
+        self.assertEqual(self.responses(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
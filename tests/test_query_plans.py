@@ -0,0 +1,160 @@
+"""
+Query-plan checks for the hot study queries.
+
+Every query below runs on each /study/start, /study/next, /study/submit,
+/study/extend, export poll or reclaim pass; where the app keeps the SQL in a
+module constant, the test imports it rather than a copy. The tests build the schema from the models,
+ask the database for its plan, and fail if any table is read with a full
+sequential scan or the rows have to be sorted instead of read in index order.
+
+SQLite runs against an in-memory database. Postgres runs only when
+TEST_POSTGRES_URL points at a scratch database (e.g.
+postgresql://postgres@localhost/minisurvey_test); the tables are created in
+a throwaway schema and dropped afterwards. There, seq scans and sorts are
+disabled for the session so the planner only picks one when no index can serve.
+"""
+import json
+import os
+import re
+import unittest
+import uuid
+
+from sqlalchemy import bindparam, create_engine, text
+
+from app import db, models  # noqa: F401  (tables on db.metadata)
+from app.allocator import (ASSIGNED_SQL, BUMP_COVERAGE_SQL, FREE_COVERAGE_SQL, LEAST_COVERED_SQL,
+                           WAIT_COVERAGE_SQL)
+from app.design import OPEN_SLOTS_SQL
+from app.export import SNAPSHOT_SQL, rows_query
+from app.reclaim import DELETE_SQL, IDLE_SQL
+from app.stats import AS_OF_SQL
+from app.trial_queue import ANSWERED_SQL, RESUME_SQL, UNANSWERED_SQL
+
+
+def sql(stmt):
+    """The SQL string of a module's text() constant (also one wrapped by .columns())."""
+    stmt = getattr(stmt, 'element', stmt)
+    return getattr(stmt, 'text', stmt)
+
+
+# SQL strings or Core statements; list-valued parameters are bound as expanding IN lists
+HOT_QUERIES = {
+    'unanswered block (/study/next, /study/block)': (sql(UNANSWERED_SQL), {'pid': 1}),
+    'answered check (/study/next without after)': (sql(ANSWERED_SQL), {'pid': 1, 'tid': 2}),
+    'participant resume (/study/start)': (
+        sql(RESUME_SQL), {'worker_id': 'W1', 'assignment_id': 'A1'}),
+    'next open design slot (/study/start with a plan)': (
+        OPEN_SLOTS_SQL, {'condition': 'ai', 'k': 1}),
+    'assigned trials (/study/extend)': (sql(ASSIGNED_SQL), {'pid': 1}),
+    'least-covered trials (allocator)': (LEAST_COVERED_SQL, {'k': 10}),
+    'coverage bump (allocator)': (sql(BUMP_COVERAGE_SQL), {'delta': 1, 'tids': [1, 2, 3]}),
+    'idle participants (reclaim-assignments)': (
+        sql(IDLE_SQL), {'after': 0, 'cutoff': '2025-01-01', 'batch': 500}),
+    'release assignments (reclaim-assignments)': (sql(DELETE_SQL), {'pids': [1, 2, 3]}),
+    'trial payloads (trial queue)': (
+        "SELECT id, payload FROM trial WHERE id IN (1, 2, 3)", {}),
+    'duplicate submit check (unique response)': (
+        "SELECT id FROM response WHERE participant_id = :pid AND trial_id = :tid", {'pid': 1, 'tid': 2}),
+    'export snapshot': (SNAPSHOT_SQL, {'horizon': '2025-01-01'}),
+    'export since_id': (rows_query(since_id=10, upto_id=20), {}),
+    'export since': (rows_query(since='2025-01-01', upto_id=20), {}),
+    'stats cache check': (sql(AS_OF_SQL), {}),
+}
+
+# row-locking variants SQLite has no syntax for
+POSTGRES_QUERIES = {
+    'least-covered trials, skip locked (allocator)': (sql(FREE_COVERAGE_SQL), {'k': 10}),
+    'least-covered trials, trial_id lock order (allocator retry)': (sql(WAIT_COVERAGE_SQL), {'k': 10}),
+}
+
+
+def explain(conn, prefix, sql, params):
+    if not isinstance(sql, str):  # a Core statement: compile it for this database
+        compiled = sql.compile(dialect=conn.dialect)
+        values = compiled.construct_params(params)
+        if compiled.positional:
+            values = tuple(values[k] for k in compiled.positiontup)
+        return conn.exec_driver_sql(prefix + str(compiled), values)
+    stmt = text(prefix + sql).bindparams(
+        *(bindparam(k, expanding=True) for k, v in params.items() if isinstance(v, list)))
+    return conn.execute(stmt, params)
+
+
+def sqlite_fallbacks(conn, sql, params):
+    rows = explain(conn, "EXPLAIN QUERY PLAN ", sql, params).fetchall()
+    # "SCAN response" is a full table scan; "SCAN x USING INDEX ..." walks an index
+    return [r[-1] for r in rows
+            if re.fullmatch(r'SCAN \w+', r[-1]) or r[-1].startswith('USE TEMP B-TREE')]
+
+
+def postgres_fallbacks(conn, sql, params):
+    plan = explain(conn, "EXPLAIN (FORMAT JSON) ", sql, params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    found = []
+
+    def walk(node):
+        if node.get('Node Type') == 'Seq Scan':
+            found.append('Seq Scan on ' + node.get('Relation Name', '?'))
+        elif node.get('Node Type') in ('Sort', 'Incremental Sort'):
+            found.append(node['Node Type'])
+        for child in node.get('Plans', ()):
+            walk(child)
+    walk(plan[0]['Plan'])
+    return found
+
+
+class QueryPlanMixin:
+    fallbacks = None
+    queries = HOT_QUERIES
+
+    def test_hot_queries_use_indexes(self):
+        with self.engine.connect() as conn:
+            self.prepare(conn)
+            for name, (sql, params) in self.queries.items():
+                with self.subTest(query=name):
+                    self.assertEqual(self.fallbacks(conn, sql, params), [], sql)
+            conn.rollback()
+
+
+class SQLiteQueryPlanTest(QueryPlanMixin, unittest.TestCase):
+    fallbacks = staticmethod(sqlite_fallbacks)
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        db.metadata.create_all(self.engine)
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def prepare(self, conn):
+        pass
+
+
+@unittest.skipUnless(os.environ.get('TEST_POSTGRES_URL'), 'set TEST_POSTGRES_URL to check Postgres plans')
+class PostgresQueryPlanTest(QueryPlanMixin, unittest.TestCase):
+    fallbacks = staticmethod(postgres_fallbacks)
+    queries = {**HOT_QUERIES, **POSTGRES_QUERIES}
+
+    def setUp(self):
+        self.engine = create_engine(os.environ['TEST_POSTGRES_URL'])
+        self.schema = 'plan_test_' + uuid.uuid4().hex[:8]
+        with self.engine.begin() as conn:
+            conn.execute(text(f'CREATE SCHEMA {self.schema}'))
+            conn.execute(text(f'SET LOCAL search_path TO {self.schema}'))
+            db.metadata.create_all(conn)
+
+    def tearDown(self):
+        with self.engine.begin() as conn:
+            conn.execute(text(f'DROP SCHEMA {self.schema} CASCADE'))
+        self.engine.dispose()
+
+    def prepare(self, conn):
+        conn.execute(text(f'SET search_path TO {self.schema}'))
+        # empty tables make a seq scan "cheapest"; this leaves it only where no index fits
+        conn.execute(text('SET enable_seqscan = off'))
+        conn.execute(text('SET enable_sort = off'))
+
+
+if __name__ == '__main__':
+    unittest.main()
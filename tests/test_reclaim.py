@@ -0,0 +1,92 @@
+"""
+Reclaiming idle participants' assignments (app/reclaim.py): the delete,
+the coverage decrement, reopened design slots, dry-run counts, the
+ingest-journal guard and the cached trial queues of reclaimed participants.
+"""
+import os
+import unittest
+from datetime import datetime, timedelta
+
+from app import db, design, reclaim, trial_queue
+from app.cli import reclaim_assignments
+from app.allocator import SlotRequest, TrialAllocator
+from app.models import Response
+from tests.helpers import AppTestCase
+
+IDLE_S = 3600
+
+
+class ReclaimTest(AppTestCase, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.trials = self.add_trials(8)
+        design.store(db.session, [('control', self.trials[:2])])
+        db.session.commit()
+        old = datetime.utcnow() - timedelta(hours=3)
+        [(self.planned, self.slot_trials), (self.partial, partial_trials), (self.active, _)] = \
+            TrialAllocator().reserve([
+                SlotRequest({'condition': 'control', 'created_at': old}, 2),  # takes the design slot
+                SlotRequest({'condition': 'ai', 'created_at': old}, 3),
+                SlotRequest({'condition': 'ai', 'created_at': datetime.utcnow()}, 2),
+            ])
+        self.answered = partial_trials[0]
+        db.session.add(Response(participant_id=self.partial, trial_id=self.answered,
+                                answer={'value': 1}, created_at=old))
+        db.session.commit()
+
+    def coverage(self):
+        return self.scalar('SELECT SUM(n_assigned) FROM trial_coverage')
+
+    def assigned(self, pid):
+        return self.scalar('SELECT COUNT(*) FROM assignment WHERE participant_id = :pid', pid=pid)
+
+    def test_dry_run_counts_without_writing(self):
+        totals = reclaim.reclaim(db.session, IDLE_S, dry_run=True)
+        self.assertEqual(totals, {'participants': 2, 'assignments': 4, 'slots_reopened': 1, 'journal_rows': 0})
+        self.assertEqual(self.coverage(), 7)
+        self.assertEqual(self.scalar('SELECT COUNT(*) FROM assignment'), 7)
+
+    def test_releases_unanswered_assignments(self):
+        totals = reclaim.reclaim(db.session, IDLE_S)
+        self.assertEqual(totals, {'participants': 2, 'assignments': 4, 'slots_reopened': 1, 'journal_rows': 0})
+
+        self.assertEqual(self.assigned(self.planned), 0)
+        self.assertEqual(self.assigned(self.partial), 1)  # the answered one stays
+        self.assertEqual(self.assigned(self.active), 2)
+        self.assertEqual(self.coverage(), 3)
+        self.assertEqual(self.scalar('SELECT COUNT(*) FROM reclaimed_assignment'), 4)
+        self.assertIsNone(self.scalar('SELECT participant_id FROM design_slot'))
+
+        # nothing left to reclaim on the next pass
+        self.assertEqual(reclaim.reclaim(db.session, IDLE_S)['assignments'], 0)
+
+    def test_reopened_slot_goes_to_the_next_start(self):
+        reclaim.reclaim(db.session, IDLE_S)
+        [(pid, chosen)] = TrialAllocator().reserve([SlotRequest({'condition': 'control'}, 2)])
+        self.assertEqual(chosen, self.slot_trials)
+        self.assertEqual(self.scalar('SELECT participant_id FROM design_slot'), pid)
+
+    def test_returning_participant_is_not_served_released_trials(self):
+        self.assertIsNotNone(trial_queue.next_trial(self.planned))  # cached queue
+        reclaim.reclaim(db.session, IDLE_S)
+        self.assertIsNone(trial_queue.next_trial(self.planned))
+        self.assertEqual(trial_queue.remaining(self.partial, after=self.answered), [])
+
+    def test_skipped_while_journal_holds_rows(self):
+        journal = self.app.config['STUDY_INGEST_DIR']
+        os.makedirs(journal)
+        with open(os.path.join(journal, '1-1-1.jsonl'), 'w', encoding='utf-8') as f:
+            f.write('{"kind": "response"}\n')
+
+        totals = reclaim.reclaim(db.session, IDLE_S)
+        self.assertEqual(totals['journal_rows'], 1)
+        self.assertEqual(totals['assignments'], 0)
+        self.assertEqual(self.coverage(), 7)
+
+        result = self.app.test_cli_runner().invoke(reclaim_assignments)
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertIn('buffered rows', result.output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+"""
+Idempotent trial seeding (app/seeding.py): the content_hash upsert, the
+counts it reports, and trial_coverage staying in step with the trials.
+"""
+import unittest
+from datetime import datetime
+
+from app import db, seeding
+from app.allocator import SlotRequest, TrialAllocator
+from app.coverage import COVERAGE_KEY
+from app.trial_cache import VERSION_KEY
+from tests.helpers import AppTestCase
+
+
+def dilemma(i, gt=3, **extra):
+    return {'dilemma_text': f'Dilemma number {i}', 'gt_severity_score': gt, 'ai_severity_score': 2, **extra}
+
+
+class SeedTest(AppTestCase, unittest.TestCase):
+    def seed(self, payloads, chunk_rows=2):
+        return seeding.seed((seeding.trial_row(p) for p in payloads), chunk_rows=chunk_rows)
+
+    def trials(self):
+        return dict(db.session.execute(db.text(
+            "SELECT content_hash, id FROM trial")).fetchall())
+
+    def version(self, name):
+        return self.scalar('SELECT version FROM cache_version WHERE name = :name', name=name) or 0
+
+    def coverage(self):
+        return dict(db.session.execute(db.text("SELECT trial_id, n_assigned FROM trial_coverage")).fetchall())
+
+    def test_reseeding_the_same_rows_inserts_none(self):
+        self.assertEqual(self.seed([dilemma(i) for i in range(5)]), (5, 0))
+        before, trials_version = self.trials(), self.version(VERSION_KEY)
+
+        self.assertEqual(self.seed([dilemma(i) for i in range(5)]), (0, 5))
+        self.assertEqual(self.trials(), before)  # same ids
+        self.assertGreater(self.version(VERSION_KEY), trials_version)
+
+    def test_counts_new_and_refreshed_rows(self):
+        self.seed([dilemma(i) for i in range(3)])
+        ids = self.trials()
+        # whitespace changes hash the same; a duplicate later in the input wins
+        rows = [dilemma(0, gt=5), {**dilemma(1), 'dilemma_text': '  Dilemma   number 1 '},
+                dilemma(3), dilemma(4), dilemma(3, gt=1)]
+        self.assertEqual(self.seed(rows, chunk_rows=10), (2, 2))
+        self.assertEqual(self.scalar('SELECT COUNT(*) FROM trial'), 5)
+        self.assertEqual(self.scalar('SELECT gt_severity_score FROM trial WHERE id = :id',
+                                     id=ids[seeding.content_hash(dilemma(0))]), 5)
+        self.assertEqual(self.scalar('SELECT gt_severity_score FROM trial WHERE content_hash = :h',
+                                     h=seeding.content_hash(dilemma(3))), 1)
+
+        # across chunks the second copy is an update, not another insert
+        self.assertEqual(self.seed([dilemma(5), dilemma(6), dilemma(5, gt=2)], chunk_rows=2), (2, 1))
+
+    def test_coverage_stays_consistent(self):
+        self.seed([dilemma(i) for i in range(4)])
+        TrialAllocator().reserve([SlotRequest({'condition': 'control', 'created_at': datetime.utcnow()}, 3)])
+        before, coverage_version = self.coverage(), self.version(COVERAGE_KEY)
+
+        self.seed([dilemma(i) for i in range(4)])  # nothing new: counters and version untouched
+        self.assertEqual(self.coverage(), before)
+        self.assertEqual(self.version(COVERAGE_KEY), coverage_version)
+
+        self.seed([dilemma(i) for i in range(6)])
+        after = self.coverage()
+        self.assertEqual(set(after), set(self.trials().values()))
+        self.assertEqual({t: after[t] for t in before}, before)  # assigned counts kept
+        self.assertEqual(sum(after.values()), 3)
+        self.assertGreater(self.version(COVERAGE_KEY), coverage_version)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+"""
+/study/start (app/routes.py): a repeated (workerId, assignmentId) resumes
+the existing participant, also when it loses the race to a concurrent
+start; only that duplicate is treated as a lost race, any other integrity
+error is a real failure.
+"""
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.allocator import SlotRequest, TrialAllocator, duplicate_start
+from app.models import Participant, Response
+from tests.helpers import AppTestCase
+
+
+class StartTestCase(AppTestCase, unittest.TestCase):
+    config = {'STUDY_TRIALS_PER_PARTICIPANT': 3}
+
+    def setUp(self):
+        super().setUp()
+        self.trials = self.add_trials(4)
+        self.client = self.app.test_client()
+
+    def integrity_error(self, **values):
+        """The IntegrityError SQLite raises for inserting `values`."""
+        db.session.add(Participant(**values))
+        try:
+            db.session.commit()
+        except IntegrityError as e:
+            db.session.rollback()
+            return e
+        self.fail('insert did not fail')
+
+    def start(self, worker='W1', assignment='A1', condition='control'):
+        resp = self.client.post('/study/start', json={'condition': condition,
+                                                      'workerId': worker, 'assignmentId': assignment})
+        self.assertEqual(resp.status_code, 200, resp.get_data(as_text=True))
+        return resp.get_json()
+
+    def next_trial(self, pid):
+        resp = self.client.get('/study/next', query_string={'participant_id': pid})
+        return resp.get_json()['trial_id'] if resp.status_code == 200 else None
+
+
+class ResumeTest(StartTestCase):
+    def test_same_assignment_resumes_with_remaining_trials(self):
+        first = self.start()
+        pid = first['participant_id']
+        self.assertEqual(first['n_trials'], 3)
+        answered = self.next_trial(pid)
+        db.session.add(Response(participant_id=pid, trial_id=answered, answer={'value': 2}))
+        db.session.commit()
+
+        again = self.start(condition='ai')  # a reload keeps the original condition
+        self.assertEqual(again, {'participant_id': pid, 'condition': 'control', 'n_trials': 2, 'resumed': True})
+        self.assertNotEqual(self.next_trial(pid), answered)
+        self.assertEqual(self.scalar('SELECT COUNT(*) FROM participant'), 1)
+        self.assertEqual(self.scalar('SELECT SUM(n_assigned) FROM trial_coverage'), 3)
+
+        other = self.start(assignment='A2')
+        self.assertNotEqual(other['participant_id'], pid)
+        self.assertNotIn('resumed', other)
+
+    def test_lost_race_resolves_to_the_existing_participant(self):
+        winner = {}
+
+        def concurrent_start_commits_first(requests):
+            # the other start passed the resume check too and committed in between
+            [(winner['pid'], _)] = TrialAllocator().reserve([SlotRequest(
+                {'condition': 'ai', 'worker_id': 'W1', 'assignment_id': 'A1',
+                 'created_at': datetime.utcnow()}, 3)])
+            raise self.integrity_error(condition='control', worker_id='W1', assignment_id='A1')
+
+        with mock.patch('app.routes.allocator.reserve', side_effect=concurrent_start_commits_first):
+            resumed = self.start()
+        self.assertEqual(resumed, {'participant_id': winner['pid'], 'condition': 'ai',
+                                   'n_trials': 3, 'resumed': True})
+        self.assertEqual(self.scalar('SELECT COUNT(*) FROM participant'), 1)
+        self.assertIsNotNone(self.next_trial(winner['pid']))
+
+
+class DuplicateStartTest(StartTestCase):
+    def test_only_the_worker_assignment_index_counts_as_a_duplicate(self):
+        self.add_participant(worker_id='W1', assignment_id='A1')
+        self.assertTrue(duplicate_start(self.integrity_error(condition='ai', worker_id='W1', assignment_id='A1')))
+        self.assertFalse(duplicate_start(self.integrity_error(condition=None, worker_id='W2', assignment_id='A2')))
+
+    def test_other_integrity_errors_are_not_swallowed(self):
+        error = self.integrity_error(condition=None)
+        with mock.patch('app.routes.allocator.reserve', side_effect=error):
+            resp = self.client.post('/study/start', json={'condition': 'control',
+                                                          'workerId': 'W1', 'assignmentId': 'A1'})
+        self.assertEqual(resp.status_code, 500)
+
+
+if __name__ == '__main__':
+    unittest.main()
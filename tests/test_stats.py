@@ -0,0 +1,82 @@
+"""
+Study statistics (app/stats.py) on a small seeded dataset: the aggregates
+and RT percentiles agree on which responses count, and the cache follows
+both new responses and the trials cache_version.
+"""
+import unittest
+
+from app import db, stats
+from app.models import Response, Trial
+from app.trial_cache import bump_version
+from tests.helpers import AppTestCase
+
+
+class StatsTest(AppTestCase, unittest.TestCase):
+    config = {'STUDY_STATS_TTL_S': 0}
+
+    def setUp(self):
+        super().setUp()
+        stats._cache.update(key=None, checked_at=0.0, value=None)
+        self.trials = self.add_trials(2)
+        self.score(self.trials[0], gt=3, ai=4)
+        self.score(self.trials[1], gt=5, ai=None)
+        control, ai = self.add_participant(condition='control'), self.add_participant(condition='ai')
+        self.respond(control, self.trials[0], 3, rt_ms=100, revealed=False)
+        self.respond(control, self.trials[1], 4, rt_ms=300, revealed=True)
+        self.respond(ai, self.trials[0], 4, rt_ms=200, revealed=True)
+        # a response whose trial row is gone (SQLite doesn't enforce the FK here)
+        self.respond(ai, 999, 1, rt_ms=50, revealed=False)
+
+    def score(self, trial_id, gt, ai):
+        trial = db.session.get(Trial, trial_id)
+        trial.gt_severity_score, trial.ai_severity_score = gt, ai
+        db.session.commit()
+
+    def respond(self, pid, trial_id, value, rt_ms, revealed):
+        db.session.add(Response(participant_id=pid, trial_id=trial_id, answer={'value': value},
+                                answer_value=value, rt_ms=rt_ms, revealed_ai=revealed))
+        db.session.commit()
+
+    def by_condition(self, result):
+        return {row['condition']: row for row in result['by_condition']}
+
+    def test_aggregates_on_seeded_responses(self):
+        rows = self.by_condition(stats.compute())
+        control, ai = rows['control'], rows['ai']
+
+        self.assertEqual((control['n'], control['n_participants']), (2, 1))
+        self.assertAlmostEqual(control['mae'], 0.5)
+        self.assertAlmostEqual(control['bias'], -0.5)
+        self.assertAlmostEqual(control['reveal_rate'], 0.5)
+        self.assertAlmostEqual(control['ai_agreement'], 0.0)  # trial 2 has no AI score
+        self.assertEqual(control['rt_ms'], {'p50': 100, 'p90': 300, 'p95': 300})
+
+        self.assertEqual(ai['n'], 1)
+        self.assertAlmostEqual(ai['mae'], 1.0)
+        self.assertAlmostEqual(ai['bias'], 1.0)
+        self.assertAlmostEqual(ai['reveal_rate'], 1.0)
+        self.assertAlmostEqual(ai['ai_agreement'], 1.0)
+
+    def test_percentiles_skip_responses_the_aggregates_skip(self):
+        ai = self.by_condition(stats.compute())['ai']
+        # the orphaned 50 ms response would otherwise be p50
+        self.assertEqual(ai['rt_ms'], {'p50': 200, 'p90': 200, 'p95': 200})
+        by_trial = {(r['trial_id'], r['condition']) for r in stats.compute(('trial',))['by_trial']}
+        self.assertNotIn((999, 'ai'), by_trial)
+
+    def test_cache_follows_trials_version(self):
+        before = self.by_condition(stats.cached())['control']
+        self.assertAlmostEqual(before['mae'], 0.5)
+
+        self.score(self.trials[1], gt=4, ai=None)  # e.g. a re-seed with corrected GT
+        self.assertIs(stats.cached(), stats.cached())  # no new response: still the cached value
+        self.assertAlmostEqual(self.by_condition(stats.cached())['control']['mae'], 0.5)
+
+        bump_version()
+        db.session.commit()
+        after = self.by_condition(stats.cached())['control']
+        self.assertAlmostEqual(after['mae'], 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
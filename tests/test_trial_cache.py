@@ -0,0 +1,62 @@
+"""
+Per-worker trial cache (app/trial_cache.py): a version bump committed by
+another session drops the cached bytes once STUDY_TRIAL_CACHE_TTL_S has
+passed, and /api/trials/<id>/ai then serves the new confidence.
+"""
+import json
+import unittest
+
+from app import db
+from app.trial_cache import bump_version, trial_cache
+from tests.helpers import AppTestCase
+
+TTL_S = 60
+
+
+class TrialCacheTest(AppTestCase, unittest.TestCase):
+    config = {'STUDY_TRIAL_CACHE_TTL_S': TTL_S}
+
+    def setUp(self):
+        super().setUp()
+        [self.tid] = self.add_trials(1)
+        self.client = self.app.test_client()
+
+    def ai(self):
+        resp = self.client.get(f'/api/trials/{self.tid}/ai')
+        self.assertEqual(resp.status_code, 200)
+        return json.loads(resp.get_data())
+
+    def import_confidence(self, conf, bump=True):
+        """What import-ai-confidence does, from another connection (another worker)."""
+        with db.engine.begin() as conn:
+            conn.execute(db.text("UPDATE trial SET ai_confidence = :c WHERE id = :id"), {'c': conf, 'id': self.tid})
+            if bump:
+                bump_version(conn)
+
+    def ttl_passes(self):
+        trial_cache._checked_at -= TTL_S
+
+    def test_version_bump_invalidates_after_the_ttl(self):
+        self.assertEqual(self.ai()['ai_confidence'], 0.75)  # default while unset
+        cached = trial_cache.get(self.tid).ai_json
+
+        self.import_confidence(0.9)
+        self.assertIs(trial_cache.get(self.tid).ai_json, cached)  # within the TTL: same bytes
+        self.assertEqual(self.ai()['ai_confidence'], 0.75)
+
+        self.ttl_passes()
+        self.assertEqual(self.ai()['ai_confidence'], 0.9)
+        self.assertIsNot(trial_cache.get(self.tid).ai_json, cached)
+
+    def test_unbumped_write_is_not_picked_up(self):
+        self.ai()
+        self.import_confidence(0.9, bump=False)
+        self.ttl_passes()
+        self.assertEqual(self.ai()['ai_confidence'], 0.75)
+
+    def test_unknown_trial_is_404(self):
+        self.assertEqual(self.client.get(f'/api/trials/{self.tid + 1}/ai').status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
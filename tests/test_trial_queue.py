@@ -0,0 +1,69 @@
+"""
+Cached trial queues for /study/next (app/trial_queue.py): requests without
+`after`, and backends that store copies.
+"""
+import pickle
+import unittest
+
+from app import db, trial_queue
+from app.models import Assignment, Response
+from tests.helpers import AppTestCase
+
+
+class PickleBackend:
+    """Stores serialized copies, like an out-of-process cache would."""
+
+    def __init__(self, config=None):
+        self._data = {}
+
+    def get(self, key):
+        value = self._data.get(key)
+        return pickle.loads(value) if value is not None else None
+
+    def set(self, key, value):
+        self._data[key] = pickle.dumps(value)
+
+    def delete(self, key):
+        self._data.pop(key, None)
+
+
+class QueueTestCase(AppTestCase, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.trials = self.add_trials(3)
+        self.pid = self.add_participant()
+        db.session.add_all(Assignment(participant_id=self.pid, trial_id=t, order_idx=i)
+                           for i, t in enumerate(self.trials))
+        db.session.commit()
+        trial_queue.prime(self.pid, self.trials)
+
+    def answer(self, trial_id):
+        db.session.add(Response(participant_id=self.pid, trial_id=trial_id, answer={'value': 1}))
+        db.session.commit()
+
+
+class NextTrialTest(QueueTestCase):
+    def test_without_after_skips_answered_trials(self):
+        self.assertEqual(trial_queue.next_trial(self.pid), self.trials[0])
+        self.answer(self.trials[0])
+        self.answer(self.trials[1])
+        self.assertEqual(trial_queue.next_trial(self.pid), self.trials[2])
+        self.assertEqual(trial_queue.remaining(self.pid), [self.trials[2]])
+
+    def test_after_moves_the_cursor(self):
+        self.assertEqual(trial_queue.next_trial(self.pid, after=self.trials[0]), self.trials[1])
+        self.assertEqual(trial_queue.next_trial(self.pid, after=self.trials[1]), self.trials[2])
+        self.assertIsNone(trial_queue.next_trial(self.pid, after=self.trials[2]))
+
+
+class CopyingBackendTest(QueueTestCase):
+    config = {'STUDY_QUEUE_BACKEND': 'tests.test_trial_queue:PickleBackend'}
+
+    def test_advance_is_written_back(self):
+        self.assertEqual(trial_queue.next_trial(self.pid, after=self.trials[0]), self.trials[1])
+        self.assertEqual(trial_queue.backend().get(self.pid).current(), self.trials[1])
+        self.assertEqual(trial_queue.next_trial(self.pid), self.trials[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,4 @@
+"""gunicorn entry point (`gunicorn -c gunicorn_conf.py wsgi:app`): the app without CLI/Migrate."""
+from app import create_app
+
+app = create_app(cli=False)